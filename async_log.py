@@ -0,0 +1,98 @@
+import sys
+import threading
+import time
+import atexit
+from collections import deque
+
+# ゲームスレッドからはレコードをキューに積むだけにして、
+# 時刻の整形と出力はバックグラウンドスレッドでまとめて行うロガー。
+# 出力先(端末やパイプ)が遅くても、ゲームループは待たされない。
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARN", ERROR: "ERROR"}
+
+
+class AsyncLogger:
+    def __init__(self, stream=None, level=INFO, capacity=10000, batch_size=256, flush_interval=0.05):
+        self.stream = stream # Noneなら書き込み時点の sys.stdout を使う
+        self.level = level
+        self.capacity = capacity     # キューに溜められる最大レコード数
+        self.batch_size = batch_size # 1回の書き込みでまとめるレコード数
+        self.flush_interval = flush_interval
+        self.dropped = 0 # キューが溢れて捨てたレコード数 (累計)
+        self._queue = deque() # append/popleft はスレッドセーフなのでロック不要
+        self._drop_lock = threading.Lock() # 溢れたときの dropped の加算だけに使う (GIL なしでも数え落とさない)
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="async-log", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def log(self, level, *args):
+        if level < self.level:
+            return
+        if self._closed: # 終了後は同期的に書き出す
+            stamp = time.strftime('%Y-%m-%d %H:%M:%S')
+            self._write([" ".join([f"[{stamp}]", *map(str, args)]) + "\n"])
+            return
+        if len(self._queue) >= self.capacity:
+            # 溢れた場合は新しいレコードを捨てる。ただしERRORは優先して残す
+            if level < ERROR:
+                with self._drop_lock:
+                    self.dropped += 1
+                return
+            try:
+                self._queue.popleft()
+                with self._drop_lock:
+                    self.dropped += 1
+            except IndexError:
+                pass
+        self._queue.append((time.time(), level, args))
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+
+    def _run(self):
+        reported_dropped = 0
+        last_second = None
+        stamp = ""
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            while self._queue:
+                lines = []
+                for _ in range(self.batch_size):
+                    try:
+                        created, level, args = self._queue.popleft()
+                    except IndexError:
+                        break
+                    second = int(created)
+                    if second != last_second: # strftime は1秒に1回だけ
+                        last_second = second
+                        stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(second))
+                    prefix = f"[{stamp}]" if level == INFO else f"[{stamp}] {LEVEL_NAMES.get(level, level)}"
+                    lines.append(" ".join([prefix, *map(str, args)]) + "\n")
+                self._write(lines)
+            if self.dropped != reported_dropped:
+                self._write([f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] WARN log queue overflow: {self.dropped - reported_dropped} records dropped\n"])
+                reported_dropped = self.dropped
+            if self._closed and not self._queue:
+                return
+
+    def _write(self, lines):
+        stream = self.stream or sys.stdout
+        try:
+            stream.write("".join(lines))
+            stream.flush()
+        except Exception:
+            pass
+
+    def close(self, timeout=2.0):
+        # 残っているレコードを書き出してから終了する
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join(timeout)
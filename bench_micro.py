@@ -0,0 +1,302 @@
+import sys
+import json
+import time
+import timeit
+import random
+import argparse
+import platform
+import types
+
+import othello_rules
+import serverv1
+import server
+import main
+import client
+import clientv1
+
+# ルール・プロトコルの処理の速さを測るマイクロベンチマーク (ネットワーク・画面なしで動く)
+# 各 OthelloGame の実装について is_valid_move / place_and_flip / any_valid_moves / is_full と
+# ランダム対局の速さ、broadcast_state のペイロードの JSON 変換、ClientGUI の合法手の走査を測り、
+# 結果を JSON で出力する。基準の結果 (--baseline) と比べ、閾値を超えて遅くなった項目があれば終了コード 1。
+#
+# 基準は計測するマシンごとに記録する (bench_baseline.json はリポジトリに含めない)。
+#
+#   python bench_micro.py --save-baseline bench_baseline.json   # 基準を記録する
+#   python bench_micro.py --baseline bench_baseline.json        # 基準と比べる
+
+DEFAULT_BASELINE = "bench_baseline.json"
+DEFAULT_THRESHOLD = 0.25 # 基準よりこの割合以上遅くなったら回帰とみなす (共有マシンでの揺れを拾わない程度)
+POSITIONS = 200 # 計測に使う局面の数 (ランダムな対局の途中局面)
+SQUARES = [(r, c) for r in range(8) for c in range(8)]
+
+
+# ---------- 局面 ----------
+def initial_board():
+    board = [[None] * 8 for _ in range(8)]
+    board[3][3] = board[4][4] = "white"
+    board[3][4] = board[4][3] = "black"
+    return board
+
+
+def sample_positions(count, seed):
+    # ランダムな対局の途中局面 [(盤面, 手番)] (どの実装で測っても同じ局面になるよう、ここだけで作る)
+    rng = random.Random(seed)
+    result = []
+    while len(result) < count:
+        board, color = initial_board(), "black"
+        while len(result) < count:
+            mask = othello_rules.legal_mask(board, color)
+            opponent = "white" if color == "black" else "black"
+            if not mask:
+                if not othello_rules.legal_mask(board, opponent):
+                    break
+                color = opponent
+                continue
+            result.append(([r[:] for r in board], color))
+            othello_rules.place_and_flip(board, *divmod(rng.choice(list(othello_rules.squares(mask))), 8), color)
+            color = opponent
+    return result
+
+
+# ---------- 実装ごとの呼び出し方の違いを吸収する ----------
+class ServerV1Game:
+    name = "serverv1.OthelloGame"
+
+    def new(self, board):
+        game = serverv1.OthelloGame()
+        game.board = [r[:] for r in board]
+        return game
+
+    def is_valid_move(self, game, row, col, color):
+        return game.is_valid_move(row, col, color)
+
+    def place_and_flip(self, game, row, col, color):
+        game.place_and_flip(row, col, color)
+
+    def any_valid_moves(self, game, color):
+        return game.any_valid_moves(color)
+
+    def is_full(self, game):
+        return game.is_full()
+
+    def legal_moves(self, game, color):
+        return [divmod(square, 8) for square in othello_rules.squares(game.valid_moves_mask(color))]
+
+
+class ServerGame(ServerV1Game):
+    name = "server.OthelloGame"
+
+    def new(self, board):
+        game = server.OthelloGame()
+        game.board = [r[:] for r in board]
+        return game
+
+    def any_valid_moves(self, game, color):
+        return game.any_valid(color)
+
+    def is_full(self, game):
+        return game.full()
+
+    def legal_moves(self, game, color):
+        return [sq for sq in SQUARES if game.is_valid_move(*sq, color)]
+
+
+class MainGame(ServerGame):
+    # main.OthelloGame は Tk の画面と一体なので、盤面だけを持つ代役にメソッドを呼ばせる
+    name = "main.OthelloGame"
+
+    def new(self, board):
+        game = types.SimpleNamespace(board=[r[:] for r in board], board_size=8, turn="black")
+        game.place_piece = lambda row, col, color: game.board[row].__setitem__(col, color)
+        return game
+
+    def is_valid_move(self, game, row, col, color):
+        return main.OthelloGame.is_valid_move(game, row, col, color)
+
+    def place_and_flip(self, game, row, col, color):
+        game.turn = color
+        game.place_piece(row, col, color)
+        main.OthelloGame.flip_pieces(game, row, col)
+
+    def any_valid_moves(self, game, color):
+        return main.OthelloGame.has_valid_moves(game, color)
+
+    def is_full(self, game):
+        return None # main.py には盤面が埋まったかの判定がない
+
+    def legal_moves(self, game, color):
+        return [sq for sq in SQUARES if main.OthelloGame.is_valid_move(game, *sq, color)]
+
+
+GAMES = [ServerV1Game(), ServerGame(), MainGame()]
+
+
+# ---------- 計測 ----------
+def measure(fn, ops, repeat):
+    # fn() 1回で ops 回分の処理をする。timeit で回数を自動で決め、repeat 回のうち最速の値を採る
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+    return {"ops_per_sec": round(ops / best, 1), "usec_per_op": round(best / ops * 1e6, 3)}
+
+
+def bench_game(impl, positions, repeat, games_seed):
+    games = [(impl.new(board), color) for board, color in positions]
+    moves = [(board, color, sq) for board, color in positions for sq in othello_rules.squares(othello_rules.legal_mask(board, color))]
+    results = {}
+
+    def valid_scan():
+        for game, color in games:
+            for row, col in SQUARES:
+                impl.is_valid_move(game, row, col, color)
+    results["is_valid_move"] = measure(valid_scan, len(games) * len(SQUARES), repeat)
+
+    def place():
+        for board, color, square in moves:
+            impl.place_and_flip(impl.new(board), square // 8, square % 8, color)
+    results["place_and_flip"] = measure(place, len(moves), repeat) # 盤面のコピーも含む
+
+    def any_valid():
+        for game, color in games:
+            impl.any_valid_moves(game, color)
+    results["any_valid_moves"] = measure(any_valid, len(games), repeat)
+
+    if impl.is_full(games[0][0]) is not None:
+        def full():
+            for game, _ in games:
+                impl.is_full(game)
+        results["is_full"] = measure(full, len(games), repeat)
+
+    def random_games():
+        rng = random.Random(games_seed)
+        game, color = impl.new(initial_board()), "black"
+        while True:
+            moves = impl.legal_moves(game, color)
+            opponent = "white" if color == "black" else "black"
+            if not moves:
+                if not impl.any_valid_moves(game, opponent):
+                    return
+                color = opponent
+                continue
+            impl.place_and_flip(game, *rng.choice(moves), color)
+            color = opponent
+    results["random_game"] = measure(random_games, 1, repeat)
+    return results
+
+
+def bench_protocol(positions, repeat):
+    # broadcast_state が送るペイロード (serverv1.GameSession._state_payload と同じ形) の変換
+    payloads = []
+    for board, color in positions:
+        payloads.append({"board": board, "turn": color, "case": "CONTINUE", "message": "",
+                         "legal": othello_rules.legal_mask(board, color)})
+    encode = serverv1.STATE_ENCODERS["json"]
+    encoded = [encode(p) for p in payloads]
+    return {
+        "state_encode": measure(lambda: [encode(p) for p in payloads], len(payloads), repeat),
+        "state_decode": measure(lambda: [json.loads(e.decode()) for e in encoded], len(encoded), repeat),
+        "state_payload_bytes": round(sum(map(len, encoded)) / len(encoded), 1),
+    }
+
+
+def bench_client_scan(positions, repeat):
+    # ClientGUI が盤面を受け取ったときの合法手の走査 (サーバーが "legal" を送らない場合の経路)
+    stubs = [(types.SimpleNamespace(board=board, board_size=8), color) for board, color in positions]
+    results = {}
+    for name, gui in (("clientv1", clientv1.ClientGUI), ("client", client.ClientGUI)):
+        def scan(gui=gui):
+            for stub, color in stubs:
+                for row, col in SQUARES:
+                    gui.is_valid_move(stub, row, col, color)
+        results[f"{name}.is_valid_move_scan"] = measure(scan, len(stubs), repeat)
+    def mask():
+        for stub, color in stubs:
+            othello_rules.legal_mask(stub.board, color)
+    results["clientv1.legal_mask"] = measure(mask, len(stubs), repeat) # highlight_valid_moves の経路
+    return results
+
+
+def run(repeat, seed):
+    positions = sample_positions(POSITIONS, seed)
+    benchmarks = {}
+    for impl in GAMES:
+        for key, value in bench_game(impl, positions, repeat, seed).items():
+            benchmarks[f"{impl.name}.{key}"] = value
+    for key, value in bench_protocol(positions, repeat).items():
+        benchmarks[f"protocol.{key}"] = value
+    for key, value in bench_client_scan(positions, repeat).items():
+        benchmarks[f"ClientGUI.{key}"] = value
+    return {
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "positions": len(positions),
+        "seed": seed,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "benchmarks": benchmarks,
+    }
+
+
+def compare(results, baseline, threshold):
+    # 基準と比べた速さの比 (1.0 より小さければ遅くなった) と、閾値を超えて遅くなった項目
+    comparison = {}
+    regressions = []
+    for name, value in results["benchmarks"].items():
+        base = baseline.get("benchmarks", {}).get(name)
+        if not isinstance(value, dict) or not isinstance(base, dict):
+            continue
+        ratio = value["ops_per_sec"] / base["ops_per_sec"]
+        comparison[name] = round(ratio, 3)
+        if ratio < 1.0 - threshold:
+            regressions.append(name)
+    return comparison, regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the rules engine and protocol hot paths")
+    parser.add_argument("--repeat", type=int, default=3, help="Timing repetitions (the best one is reported)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for positions and games")
+    parser.add_argument("--json", metavar="PATH", help="Write results as JSON to PATH ('-' for stdout)")
+    parser.add_argument("--baseline", metavar="PATH", default=None, help=f"Compare against this baseline (default: {DEFAULT_BASELINE} if present)")
+    parser.add_argument("--save-baseline", metavar="PATH", help="Store these results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Slowdown ratio counted as a regression")
+    args = parser.parse_args()
+
+    serverv1.LOGGER.level = serverv1.ERROR
+    results = run(args.repeat, args.seed)
+
+    baseline_path = args.baseline
+    if baseline_path is None and not args.save_baseline:
+        try:
+            open(DEFAULT_BASELINE).close()
+            baseline_path = DEFAULT_BASELINE
+        except OSError:
+            pass
+    regressions = []
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        comparison, regressions = compare(results, baseline, args.threshold)
+        results["baseline"] = {"path": baseline_path, "created": baseline.get("created"), "threshold": args.threshold,
+                               "speed_ratio": comparison, "regressions": regressions}
+
+    if args.json == "-":
+        print(json.dumps(results, indent=2))
+    else:
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=2)
+        print(f"Python {results['python']} ({results['implementation']}), {results['positions']} positions")
+        ratios = results.get("baseline", {}).get("speed_ratio", {})
+        for name, value in results["benchmarks"].items():
+            if not isinstance(value, dict):
+                print(f"{name:<45} {value}")
+                continue
+            ratio = f"  x{ratios[name]:.2f}" if name in ratios else ""
+            flag = "  REGRESSION" if name in regressions else ""
+            print(f"{name:<45} {value['ops_per_sec']:>14,.1f} ops/s {value['usec_per_op']:>10.3f} us/op{ratio}{flag}")
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({k: v for k, v in results.items() if k != "baseline"}, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}", file=sys.stderr)
+    sys.exit(1 if regressions else 0)
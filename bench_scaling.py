@@ -0,0 +1,103 @@
+import sys
+import json
+import time
+import threading
+import argparse
+
+import net_io
+import rate_limit
+import worker_pool
+import serverv1
+from server_stats import STATS
+
+# セッションワーカー数ごとの処理能力 (手/秒) を測るベンチマーク
+# ソケットの代わりに、盤面を受け取ると即座に次の手(合法手のうち最初のもの)を返す相手を使い、
+# 多数の対局をワーカー上で同時に進める。GIL なしのビルド (python3.13t) ではワーカー数に応じて伸びる。
+#
+#   python3.13t bench_scaling.py --sessions 64 --workers 1 2 4 8 --seconds 3
+
+
+class BenchPeer:
+    # FramedConnection の代わり。send_frames は対局のワーカースレッドから呼ばれる
+    def __init__(self):
+        self.channel = None
+        self.guard = rate_limit.ConnectionGuard("bench", rate_limit.RateLimiter(1e9, 1e9), 1e9, 1e9)
+
+    def getpeername(self):
+        return ("bench", 0)
+
+    def send(self, payload, channel=0):
+        pass
+
+    def send_frames(self, frames):
+        session = self.channel.session
+        if session is None or not session.session_active:
+            return
+        color = session.colors[self.channel.seat]
+        mask = session.legal_mask
+        if session.game.turn != color or not mask or session.game.case not in ("CONTINUE", "PASS"):
+            return
+        square = (mask & -mask).bit_length() - 1
+        move = json.dumps({"x": square % 8, "y": square // 8, "turn": color}).encode()
+        session.handle_player_message(self.channel, self.channel.seat, move, self.guard, time.perf_counter())
+
+
+class BenchTable:
+    # 1卓分。対局が終わるたびに次の対局を始め、計測中は常に対局が進んでいるようにする
+    def __init__(self, running):
+        self.running = running
+        self.games = 0
+
+    def start_game(self):
+        channels = []
+        for seat in range(2):
+            peer = BenchPeer()
+            peer.channel = net_io.Channel(peer, seat + 1, f"bench-{seat}", on_close=self._closed)
+            channels.append(peer.channel)
+        serverv1.GameSession(channels, ["black", "white"], [])
+
+    def _closed(self, channel):
+        if channel.seat == 0: # 1対局につき1回だけ
+            self.games += 1
+            if self.running.is_set():
+                self.start_game()
+
+
+def run(sessions, workers, seconds):
+    serverv1.SESSION_POOL = worker_pool.WorkerPool(workers, name=f"bench-{workers}")
+    running = threading.Event()
+    running.set()
+    tables = [BenchTable(running) for _ in range(sessions)]
+    start_moves = STATS.moves.value()
+    started = time.perf_counter()
+    for table in tables:
+        table.start_game()
+    time.sleep(seconds)
+    moves = STATS.moves.value() - start_moves
+    elapsed = time.perf_counter() - started
+    running.clear()
+    time.sleep(0.2) # 進行中の対局が片付くのを待つ
+    return {"workers": workers, "sessions": sessions, "moves": moves, "games": sum(t.games for t in tables),
+            "seconds": round(elapsed, 3), "moves_per_sec": round(moves / elapsed, 1)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure moves/sec scaling across session workers")
+    parser.add_argument("--sessions", type=int, default=64, help="Concurrent games")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="Worker counts to measure")
+    parser.add_argument("--seconds", type=float, default=3.0, help="Duration of each run")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    serverv1.LOGGER.level = serverv1.ERROR # 対局開始・終了のログで計測が歪まないようにする
+    gil = sys._is_gil_enabled() if hasattr(sys, "_is_gil_enabled") else True
+    results = [run(args.sessions, n, args.seconds) for n in args.workers]
+    base = results[0]["moves_per_sec"] or 1.0
+    for r in results:
+        r["speedup"] = round(r["moves_per_sec"] / base, 2)
+    if args.json:
+        print(json.dumps({"python": sys.version.split()[0], "gil_enabled": gil, "results": results}, indent=2))
+    else:
+        print(f"Python {sys.version.split()[0]}, GIL {'enabled' if gil else 'disabled'}, {args.sessions} sessions")
+        for r in results:
+            print(f"workers={r['workers']:>3}  {r['moves_per_sec']:>10.1f} moves/s  x{r['speedup']:.2f}  ({r['games']} games)")
@@ -0,0 +1,207 @@
+import sys
+import random
+import argparse
+import types
+
+import othello_rules
+import othello_engine
+import othello_client
+import serverv1
+import server
+import main
+import client
+import clientv1
+
+# ルールの実装が全エントリーポイントで一致しているかを確かめる差分チェック
+# ランダムな対局の途中局面と、ランダムに石を並べた (対局では現れない) 局面について、
+# 全マス・両方の色で合法手の判定と裏返る石を、素朴な実装 (各エントリーポイントに元々あったもの) と比べる。
+# 不一致があれば最初のいくつかを表示して終了コード 1 で終わる。
+#
+#   python check_rules.py --positions 2000
+
+DIRECTIONS = [(0, 1), (1, 0), (0, -1), (-1, 0), (1, 1), (-1, -1), (1, -1), (-1, 1)]
+MAX_REPORTS = 10
+
+
+# ---------- 基準となる素朴な実装 ----------
+def reference_flips(board, row, col, color):
+    if board[row][col] is not None:
+        return set()
+    opponent = "white" if color == "black" else "black"
+    flipped = set()
+    for dr, dc in DIRECTIONS:
+        line = []
+        r, c = row + dr, col + dc
+        while 0 <= r < 8 and 0 <= c < 8 and board[r][c] == opponent:
+            line.append((r, c))
+            r, c = r + dr, c + dc
+        if line and 0 <= r < 8 and 0 <= c < 8 and board[r][c] == color:
+            flipped.update(line)
+    return flipped
+
+
+def reference_place(board, row, col, color):
+    flipped = reference_flips(board, row, col, color)
+    board = [r[:] for r in board]
+    if flipped:
+        board[row][col] = color
+        for r, c in flipped:
+            board[r][c] = color
+    return board
+
+
+# ---------- 各エントリーポイントの実装を呼び出す ----------
+def _copy(board):
+    return [r[:] for r in board]
+
+
+def _gui_stub(board):
+    # GUI クラスのメソッドを画面なしで呼ぶための代役 (ルールの判定に使う属性だけを持つ)
+    return types.SimpleNamespace(board=_copy(board), board_size=8)
+
+
+def serverv1_place(board, row, col, color):
+    game = serverv1.OthelloGame()
+    game.board = _copy(board)
+    game.place_and_flip(row, col, color)
+    return game.board
+
+
+def server_place(board, row, col, color):
+    game = server.OthelloGame()
+    game.board = _copy(board)
+    game.place_and_flip(row, col, color)
+    return game.board
+
+
+def main_place(board, row, col, color):
+    # main.OthelloGame は駒を置いてから flip_pieces で裏返す
+    stub = _gui_stub(board)
+    stub.turn = color
+    stub.place_piece = lambda r, c, piece: stub.board[r].__setitem__(c, piece)
+    stub.place_piece(row, col, color)
+    main.OthelloGame.flip_pieces(stub, row, col)
+    return stub.board
+
+
+def rules_place(board, row, col, color):
+    board = _copy(board)
+    othello_rules.place_and_flip(board, row, col, color)
+    return board
+
+
+def legal_sets(board, color):
+    # {実装名: 合法手の集合}
+    serverv1_game = serverv1.OthelloGame()
+    serverv1_game.board = board
+    server_game = server.OthelloGame()
+    server_game.board = board
+    stub = _gui_stub(board)
+    own, opp = othello_engine.board_to_bits(board, color)
+    squares = [(r, c) for r in range(8) for c in range(8)]
+    state = othello_client.GameState({"board": board, "turn": color})
+    return {
+        "othello_rules.is_valid_move": {sq for sq in squares if othello_rules.is_valid_move(board, *sq, color)},
+        "othello_rules.legal_mask": {divmod(s, 8) for s in othello_rules.squares(othello_rules.legal_mask(board, color))},
+        "serverv1.is_valid_move": {sq for sq in squares if serverv1_game.is_valid_move(*sq, color)},
+        "serverv1.valid_moves_mask": {divmod(s, 8) for s in othello_rules.squares(serverv1_game.valid_moves_mask(color))},
+        "server.is_valid_move": {sq for sq in squares if server_game.is_valid_move(*sq, color)},
+        "main.is_valid_move": {sq for sq in squares if main.OthelloGame.is_valid_move(stub, *sq, color)},
+        "client.is_valid_move": {sq for sq in squares if client.ClientGUI.is_valid_move(stub, *sq, color)},
+        "clientv1.is_valid_move": {sq for sq in squares if clientv1.ClientGUI.is_valid_move(stub, *sq, color)},
+        "clientv1.flip_squares": {sq for sq in squares if clientv1.ClientGUI.flip_squares(stub, *sq, color)},
+        "othello_client.legal_moves": {(y, x) for x, y in state.legal_moves()},
+        "othello_engine.legal_moves": {divmod(s, 8) for s in othello_rules.squares(othello_engine.legal_moves(own, opp))},
+    }
+
+
+PLACERS = {
+    "othello_rules.place_and_flip": rules_place,
+    "serverv1.place_and_flip": serverv1_place,
+    "server.place_and_flip": server_place,
+    "main.flip_pieces": main_place,
+}
+
+
+# ---------- 局面の生成 ----------
+def initial_board():
+    board = [[None] * 8 for _ in range(8)]
+    board[3][3] = board[4][4] = "white"
+    board[3][4] = board[4][3] = "black"
+    return board
+
+
+def game_positions(rng):
+    # ランダムに1局打ち、途中の局面を順に返す
+    board = initial_board()
+    color = "black"
+    while True:
+        yield board, color
+        moves = [(r, c) for r in range(8) for c in range(8) if reference_flips(board, r, c, color)]
+        opponent = "white" if color == "black" else "black"
+        if not moves:
+            if not any(reference_flips(board, r, c, opponent) for r in range(8) for c in range(8)):
+                return
+            color = opponent
+            continue
+        board = reference_place(board, *rng.choice(moves), color)
+        color = opponent
+
+
+def random_board(rng):
+    density = rng.random()
+    return [[rng.choice(("black", "white")) if rng.random() < density else None for _ in range(8)] for _ in range(8)]
+
+
+def positions(rng, count):
+    produced = 0
+    while produced < count:
+        for board, color in game_positions(rng):
+            yield board, color
+            produced += 1
+            if produced >= count:
+                return
+        yield random_board(rng), rng.choice(("black", "white"))
+        produced += 1
+
+
+def check(count, seed):
+    rng = random.Random(seed)
+    mismatches = []
+    checked_moves = 0
+    for index, (board, color) in enumerate(positions(rng, count)):
+        for mover in ("black", "white"):
+            expected = {(r, c) for r in range(8) for c in range(8) if reference_flips(board, r, c, mover)}
+            for name, got in legal_sets(board, mover).items():
+                if got != expected:
+                    mismatches.append(f"position {index} ({mover}): {name} legal moves {sorted(got)} != {sorted(expected)}")
+            for row, col in expected:
+                checked_moves += 1
+                want = reference_place(board, row, col, mover)
+                for name, place in PLACERS.items():
+                    if place(board, row, col, mover) != want:
+                        mismatches.append(f"position {index} ({mover}): {name} at ({row},{col}) gave a different board")
+                if set(othello_rules.flipped_squares(board, row, col, mover)) != reference_flips(board, row, col, mover):
+                    mismatches.append(f"position {index} ({mover}): othello_rules.flipped_squares at ({row},{col}) differs")
+        expected_counts = (sum(r.count("black") for r in board), sum(r.count("white") for r in board))
+        if othello_rules.count_discs(board) != expected_counts:
+            mismatches.append(f"position {index}: count_discs {othello_rules.count_discs(board)} != {expected_counts}")
+        if othello_rules.is_full(board) != all(cell is not None for r in board for cell in r):
+            mismatches.append(f"position {index}: is_full differs")
+    return checked_moves, mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that every entry point applies the Othello rules identically")
+    parser.add_argument("--positions", type=int, default=1000, help="Number of positions to compare")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    serverv1.LOGGER.level = serverv1.ERROR
+    checked_moves, mismatches = check(args.positions, args.seed)
+    for line in mismatches[:MAX_REPORTS]:
+        print(line)
+    implementations = len(legal_sets(initial_board(), "black")) + len(PLACERS)
+    print(f"{args.positions} positions, {checked_moves} moves, {implementations} implementations: "
+          f"{'OK' if not mismatches else f'{len(mismatches)} mismatches'}")
+    sys.exit(1 if mismatches else 0)
@@ -6,6 +6,7 @@ import argparse  # 追加: コマンドライン引数を扱う
 import time   # リトライ時の待機のため追加
 import signal # Ctrl+Cによる終了処理のため追加 (念のため確認)
 import sys    # sys.exitのため追加 (念のため確認)
+import othello_rules # 合法手の判定 (サーバーと共通)
 
 PORT = 8080
 SERVER_IP = "" #端末のローカルIPアドレス
@@ -248,43 +249,8 @@ class ClientGUI:
         self.update_score()
     
     def is_valid_move(self, row, col, color):
-        # 既に駒が置かれていれば、Falseを返す。
-        if self.board[row][col] is not None:
-            return False
-        # 八方向（縦、横、斜め）
-        directions = [(0, 1), (1, 0), (0, -1), (-1, 0), (1, 1), (-1, -1), (1, -1), (-1, 1)]
-        # デフォルトをFalseに設定
-        valid = False
-        # 各方向のマスの状態を確認
-        for direction in directions:
-            if self.check_direction(row, col, direction, color):
-                valid = True
-        return valid
-    
-    def check_direction(self, row, col, direction, color):
-        # 相手の駒の色を代入
-        opponent_color = "white" if color == "black" else "black"
-        # 指定の方向のマスを確認
-        d_row, d_col = direction
-        row += d_row
-        col += d_col
-        # 盤面外であれば、Falseを返す
-        if not (0 <= row < self.board_size and 0 <= col < self.board_size):
-            return False
-        # 相手の駒がなければ、Falseを返す
-        if self.board[row][col] != opponent_color:
-            return False
-        while 0 <= row < self.board_size and 0 <= col < self.board_size:
-            # マスがNoneであれば、Falseを返す
-            if self.board[row][col] is None:
-                return False
-            # 自分の駒があれば、Trueを返す
-            if self.board[row][col] == color:
-                return True
-            row += d_row
-            col += d_col
-        return False
-                
+        # 判定はサーバーと共通の othello_rules で行う
+        return othello_rules.is_valid_move(self.board, row, col, color)
 
     def first_draw_board(self):
         print("first_draw_board")
@@ -377,15 +343,14 @@ class ClientGUI:
         # 前の盤面でのハイライトを削除
         self.canvas.delete("highlight")
         has_moves = False
-        for row in range(self.board_size):
-            for col in range(self.board_size):
-                if self.is_valid_move(row, col, self.turn):
-                    has_moves = True
-                    x0 = col * self.cell_size + self.cell_size // 2 - 5
-                    y0 = row * self.cell_size + self.cell_size // 2 - 5
-                    x1 = col * self.cell_size + self.cell_size // 2 + 5
-                    y1 = row * self.cell_size + self.cell_size // 2 + 5
-                    self.canvas.create_oval(x0, y0, x1, y1, fill="gray", tags="highlight")
+        for square in othello_rules.squares(othello_rules.legal_mask(self.board, self.turn)):
+            row, col = divmod(square, self.board_size)
+            has_moves = True
+            x0 = col * self.cell_size + self.cell_size // 2 - 5
+            y0 = row * self.cell_size + self.cell_size // 2 - 5
+            x1 = col * self.cell_size + self.cell_size // 2 + 5
+            y1 = row * self.cell_size + self.cell_size // 2 + 5
+            self.canvas.create_oval(x0, y0, x1, y1, fill="gray", tags="highlight")
         if not has_moves:
             print(f"{self.turn.capitalize()} has no valid moves")
           
@@ -411,11 +376,9 @@ class ClientGUI:
     def has_valid_moves(self, color):
         print("has_valid_moves")
         print(f"color:{color}")
-        for row in range(self.board_size):
-            for col in range(self.board_size):
-                if self.is_valid_move(row, col, color):
-                    print("has_valid_moves_true")
-                    return True
+        if othello_rules.legal_mask(self.board, color):
+            print("has_valid_moves_true")
+            return True
         print("has_valid_moves_false")
         return False
     
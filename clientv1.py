@@ -6,56 +6,69 @@ import argparse  # 追加: コマンドライン引数を扱う
 import time  # リトライ時の待機のため追加
 import signal # Ctrl+Cによる終了処理のため追加 (念のため確認)
 import sys    # sys.exitのため追加 (念のため確認)
+import net_io # フレーム単位の送受信
+import othello_client # 再接続 (指数バックオフ) など画面に依存しない部分
+import othello_engine # 解析パネル用の探索エンジン (別プロセスで動かす)
+import othello_rules # 合法手の判定 (サーバーと共通)
 
 PORT = 8080
+FRAME_INTERVAL = 1 / 60 # 盤面の再描画は1フレーム(約60Hz)に1回まで
+PROVISIONAL_OUTLINE = "gold" # サーバーの確認待ちの石の縁取り
+PENDING_MOVE_TIMEOUT_MS = 5000 # この時間内にサーバーの応答がなければ仮の手を取り消す
+CATCHUP_STEP_MS = 300 # 途中参加の観戦で、指定した手数から現在までの手順を再生する間隔
+ANALYSIS_POLL_MS = 50 # 解析プロセスの結果を確認する間隔
+ANALYSIS_BEST_COLOR = "gold" # 解析パネルで最善手の評価値を表示する色
 SERVER_IP = "192.168.1.15" #端末のローカルIPアドレス
-MAX_CONNECT_RETRIES = 3
-CONNECT_RETRY_DELAY = 5 # seconds
-CONNECT_TIMEOUT = 10 # seconds
+MAX_CONNECT_RETRIES = othello_client.RECONNECT_ATTEMPTS # 待ち時間はジッター付きの指数バックオフ (上限 RECONNECT_MAX_DELAY 秒)
+
+def decode_board(text, board_size=8):
+    # サーバーのスナップショットの盤面文字列 ("b"=黒, "w"=白, "."=空き) をリストの盤面に戻す
+    cells = [{"b": "black", "w": "white"}.get(ch) for ch in text]
+    return [cells[row * board_size:(row + 1) * board_size] for row in range(board_size)]
+
+def decode_move(move):
+    # "Bf5" → (row, col, color)
+    return int(move[2:]) - 1, ord(move[1]) - ord("a"), "black" if move[0] == "B" else "white"
 
 class Client:
     def __init__(self, host, port=PORT):  # hostは必須引数に変更
         self.server = (host, port)
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        
-        connected = False
-        for attempt in range(MAX_CONNECT_RETRIES):
-            try:
-                print(f"サーバーへの接続試行中 ({attempt + 1}/{MAX_CONNECT_RETRIES})... {self.server}")
-                self.socket.settimeout(CONNECT_TIMEOUT) # 接続タイムアウト設定
-                self.socket.connect(self.server)
-                self.socket.settimeout(None) # 通常のブロッキングモードに戻す
-                print(f"サーバーに接続しました: {self.server}")
-                connected = True
-                break
-            except socket.timeout:
-                print(f"接続試行 ({attempt + 1}) がタイムアウトしました。")
-            except (socket.error, ConnectionRefusedError) as e: # ConnectionRefusedError も捕捉
-                print(f"接続試行 ({attempt + 1}) に失敗しました: {e}")
-            
-            if attempt < MAX_CONNECT_RETRIES - 1:
-                print(f"{CONNECT_RETRY_DELAY}秒後に再試行します...")
-                # ソケットを再作成する必要がある場合がある
-                self.socket.close() # 古いソケットを閉じる
-                self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM) # 新しいソケットを作成
-                time.sleep(CONNECT_RETRY_DELAY)
-        
-        if not connected:
+        self.connect()
+
+    def connect(self, attempts=MAX_CONNECT_RETRIES):
+        def on_retry(attempt, delay, error):
+            print(f"接続試行 ({attempt}/{attempts}) に失敗しました: {error}")
+            print(f"{delay:.1f}秒後に再試行します...")
+
+        print(f"サーバーへの接続試行中... {self.server}")
+        try:
+            self.socket = othello_client.connect_with_backoff(self.server, attempts, on_retry=on_retry)
+        except ConnectionError as e:
             print("サーバーへの接続に最終的に失敗しました。")
             # GUIに通知するために例外を発生させる
-            raise ConnectionError("サーバーへの接続に失敗しました。リトライ上限に達しました。")
+            raise ConnectionError("サーバーへの接続に失敗しました。リトライ上限に達しました。") from e
+        print(f"サーバーに接続しました: {self.server}")
+        self.conn = net_io.FramedConnection(self.socket) # TCP_NODELAY を設定し、フレーム単位で送受信する
+
+    def reconnect(self, attempts=MAX_CONNECT_RETRIES): # 切断後に新しい接続を張り直す
+        try: self.socket.close()
+        except OSError: pass
+        self.connect(attempts)
 
     def send(self, message): #データの送信のみを行う
         print(f"Send: {message}")
-        self.socket.sendall(message.encode("utf-8"))
+        self.conn.send(message.encode("utf-8"))
         return
 
+    def recv(self): # 1メッセージ(フレーム)分を受信する。切断時は空のバイト列
+        return self.conn.recv()
+
     def close(self):
         print("Close")
         self.socket.close()
 
 class ClientGUI:
-    def __init__(self, root, host, port, mode="player"):  # host, port, mode を受け取る
+    def __init__(self, root, host, port, mode="player", from_ply=None, analysis=False, analysis_depth=othello_engine.DEFAULT_DEPTH, player_id=None):  # host, port, mode を受け取る
         self.root = root
         self.root.title("Othello Client")
         self.player_color = None
@@ -63,9 +76,37 @@ class ClientGUI:
         self.board_size = 8
         self.cell_size = 50
         self.is_spectator = (mode == "spectator") # 観戦モードかどうかのフラグ
+        self.from_ply = from_ply # 観戦モードで途中参加する場合、何手目から見るか
+        self.player_id = player_id # 対局記録に残すプレイヤーID (なければ記録されない)
+        self.seat_token = None
+        self.legal_mask = None # サーバーから受け取った手番側の合法手 (None: サーバーが送ってこない)
 
         self.canvas = tk.Canvas(self.root, width=self.board_size * self.cell_size, height=self.board_size * self.cell_size)
         self.canvas.grid(row=0, column=0)
+        # 盤面のキャンバス項目はマスごとに1つずつ作って使い回し、更新時は変わったマスだけ itemconfig する
+        self.piece_items = None # [row][col] -> 石の楕円 (空きマスは非表示)
+        self.highlight_items = None # [row][col] -> 合法手の印
+        self.drawn_board = None # 最後に描画した盤面
+        self.drawn_highlights = 0 # 最後に表示した合法手の印 (ビットマスク)
+        # 受信スレッドから描画への受け渡し。盤面だけの更新は最新の1件に畳み、PASS や FINISH は順番通りに残す
+        self.pending_updates = [] # [(case, data)]
+        self.pending_lock = threading.Lock()
+        self.frame_scheduled = False
+        self.last_frame = 0.0
+        # 自分の手はサーバーの応答を待たずに盤面へ反映し (仮)、次に届いた盤面で確定または取り消す
+        self.pending_move = None # 確認待ちの手 (row, col)
+        self.provisional_squares = [] # 仮に置いた・裏返したマス
+        self.confirmed_board = None # 仮の手を置く前の (サーバーが確定した) 盤面
+        self.pending_timer = None # 応答待ちのタイムアウト (root.after の ID)
+        # 途中参加の観戦で再生中の手順 ([手, ...], 再生後に表示する現在の状態)。再生中は None 以外
+        self.catchup = None
+        # 解析パネル (任意)。探索は別プロセスで行い、深さが増えるごとに届く結果を盤面に重ねて表示する
+        self.analysis_enabled = tk.BooleanVar(value=analysis)
+        self.analysis_depth = analysis_depth
+        self.analysis = None # othello_engine.AnalysisProcess (最初に使うときに起動する)
+        self.analysis_polling = False
+        self.eval_items = None # [row][col] -> 評価値の文字
+        self.drawn_evals = set() # 評価値を表示しているマス
         
         initial_info_text = "観戦モードで接続中..." if self.is_spectator else "マッチング中..."
         self.info_label = tk.Label(self.root, text=initial_info_text)
@@ -86,10 +127,16 @@ class ClientGUI:
 
         # ★★★ サーバーに自分のモードを通知 ★★★
                 if self.is_spectator:
-                    self.client.send(json.dumps({"mode": "spectator"}))
+                    hello = {"mode": "spectator"}
+                    if self.from_ply is not None:
+                        hello["from_ply"] = self.from_ply
+                    self.client.send(json.dumps(hello))
                     self.info_label.config(text="観戦モード - サーバーに接続しました")
                 else: # プレイヤーモード
-                    self.client.send(json.dumps({"mode": "player"}))
+                    hello = {"mode": "player"}
+                    if self.player_id:
+                        hello["player_id"] = self.player_id
+                    self.client.send(json.dumps(hello))
                     # Player color はまだサーバーから受信していないので、ここでは設定しない
                     self.info_label.config(text="プレイヤーモード - サーバーに接続、マッチング待機中...")
 
@@ -168,11 +215,82 @@ class ClientGUI:
             print("Not your turn!!!!")
             return
 
+        if self.pending_move is not None: # 前の手の応答待ち
+            print("Waiting for the server to confirm the previous move.")
+            return
+
+        if self.legal_mask is not None and not self.legal_mask >> (row * self.board_size + col) & 1:
+            print("Not a legal move.")
+            return
+
         if self.board[row][col] is None:
             # クリックされた手が有効かどうかのチェックはサーバー側で行う想定
             # is_valid_moveはクライアント側の表示用なので、送信自体は行う
             move = {"x": col, "y": row, "turn": self.player_color}
             self.client.send(json.dumps(move))
+            self.apply_provisional_move(row, col) # 送信してから描画する (送信を描画で遅らせない)
+
+    def apply_provisional_move(self, row, col):
+        flips = self.flip_squares(row, col, self.player_color)
+        if not flips: # 手元の盤面では打てない手。判定はサーバーに任せる
+            return
+        board = [r[:] for r in self.board]
+        for r, c in [(row, col)] + flips:
+            board[r][c] = self.player_color
+        self.confirmed_board = self.board
+        self.board = board
+        self.pending_move = (row, col)
+        self.provisional_squares = [(row, col)] + flips
+        self.pending_timer = self.root.after(PENDING_MOVE_TIMEOUT_MS, self.on_pending_timeout)
+        self.render_board()
+        for r, c in self.provisional_squares:
+            self.canvas.itemconfig(self.piece_items[r][c], outline=PROVISIONAL_OUTLINE, width=2)
+        self.show_highlights(0)
+        if self.analysis:
+            self.analysis.cancel() # 仮の盤面は解析しない (確定した盤面が届いたら解析し直す)
+        self.show_analysis(None)
+        self.update_score()
+        self.turn_label.config(text="送信中...")
+
+    def reconcile_provisional(self, rejected):
+        # サーバーの盤面が届いたら仮の表示を解除する。盤面自体は render_board が差分で正しい状態に戻す
+        if self.pending_move is None:
+            return
+        if self.pending_timer is not None:
+            self.root.after_cancel(self.pending_timer)
+            self.pending_timer = None
+        for r, c in self.provisional_squares:
+            self.canvas.itemconfig(self.piece_items[r][c], outline="black", width=1)
+        if rejected:
+            print(f"Move {self.pending_move} was rejected by the server. Rolling back.")
+        self.pending_move = None
+        self.provisional_squares = []
+        self.confirmed_board = None
+
+    def on_pending_timeout(self):
+        self.pending_timer = None
+        self.rollback_provisional("サーバーの応答がありません。もう一度打ってください。")
+
+    def rollback_provisional(self, message=None):
+        # 応答が届かないまま時間が過ぎた・接続し直した場合に、仮の手を取り消して確定した盤面に戻す
+        if self.pending_move is None:
+            return
+        print(f"No reply for move {self.pending_move}. Rolling back.")
+        self.board = self.confirmed_board
+        self.reconcile_provisional(False)
+        self.render_board()
+        self.update_score()
+        self.update_turn_display()
+        self.highlight_valid_moves()
+        self.start_analysis()
+        if message:
+            self.info_label.config(text=message)
+
+    def flip_squares(self, row, col, color):
+        # (row, col) に color を置いたときに裏返るマスのリスト
+        if self.board[row][col] is not None:
+            return []
+        return othello_rules.flipped_squares(self.board, row, col, color)
 
     def set_player_color(self):
         if self.is_spectator: # 観戦モードでは色設定は不要
@@ -181,7 +299,7 @@ class ClientGUI:
         print("Receive player color")
         try:
             self.client.socket.settimeout(20.0) # ★タイムアウトを少し長めに設定★
-            response_bytes = self.client.socket.recv(1024)
+            response_bytes = self.client.recv()
             self.client.socket.settimeout(None) # 通常のブロッキングモードに戻す
 
             if not response_bytes: # ★サーバーから空のデータが来た場合★
@@ -195,6 +313,7 @@ class ClientGUI:
 
             if "player_color" in data:
                 self.player_color = data["player_color"]
+                self.seat_token = data.get("seat_token") # サーバー再起動後の再接続に使う
                 # self.info_label.config(text=f"Your color: {self.player_color}") # ここでの更新はconnect_and_setup_gameに任せる
                 print(f"Player color set to: {self.player_color}")
                 # 色設定が完了したことをサーバーに通知
@@ -236,7 +355,7 @@ class ClientGUI:
         try:
             # 観戦モードの場合、サーバーは初期盤面を送ってくるタイミングがプレイヤーと異なる可能性がある
             # ここでは共通の受信処理とする
-            response = self.client.socket.recv(1024).decode("utf-8")
+            response = self.client.recv().decode("utf-8")
             if not response:
                 print("No data received from server for initial board")
                 # エラー処理またはリトライ処理を検討
@@ -270,10 +389,12 @@ class ClientGUI:
     def receive_updates_loop(self):
         while True:
             try:
-                response = self.client.socket.recv(1024).decode("utf-8")
+                response = self.client.recv().decode("utf-8")
 
                 if not response:
                     print("サーバーとの接続が切断されました。")
+                    if self.try_resume(): # サーバー再起動などの場合は元の席に戻って続ける
+                        continue
                     if self.is_spectator:
                         self.info_label.config(text="サーバーとの接続が切れました。観戦を終了します。")
                     else:
@@ -285,35 +406,34 @@ class ClientGUI:
                 data = json.loads(response)
                 print(f"Received update: {data}") # デバッグ用に受信データを表示
 
+                if data.get("type") == "catchup": # 途中参加: 指定した手数からの手順を再生してから現在の盤面を表示する
+                    self.post_update("CATCHUP", data)
+                    continue
+
                 # サーバーからのメッセージタイプを判定
                 message_type = data.get("case", data.get("type")) # "case" or "type" or other key
 
                 if message_type == "FORCED_TERMINATION":
                     print("Opponent disconnected or server forced termination.")
-                    self.info_label.config(text="対戦相手の接続が切れたか、サーバーにより終了されました。")
-                    self.root.after(0, self.end_game_message, "対戦相手の切断") # end_gameより汎用的なメッセージ表示
+                    self.post_update("FORCED_TERMINATION", data)
                     break # ループを抜ける
 
                 elif message_type == "PASS":
-                    self.info_label.config(text=f"{data.get('passed_player', 'プレイヤー')}がパスしました。")
-                    self.root.after(0, self.update_board_from_server, data)
+                    self.post_update("PASS", data)
                 
                 elif message_type == "FINISH":
-                    self.info_label.config(text="ゲーム終了！")
-                    self.root.after(0, self.update_board_from_server, data) # 最終盤面を更新
-                    self.root.after(0, self.end_game) # end_gameを呼び出し勝敗表示
+                    self.post_update("FINISH", data) # 最終盤面を描画してから勝敗を表示する
                     break # ゲーム終了なのでループを抜ける
 
-                elif message_type == "CONTINUE" or "board" in data: # "CONTINUE" または盤面情報があれば更新
-                    self.root.after(0, self.update_board_from_server, data)
-                
                 elif message_type == "ERROR": # サーバーからのエラーメッセージ
-                    error_msg = data.get("message", "不明なエラー")
-                    print(f"Server error: {error_msg}")
-                    self.info_label.config(text=f"サーバーエラー: {error_msg}")
+                    print(f"Server error: {data.get('message', '不明なエラー')}")
+                    self.post_update("ERROR", data)
                     # エラーによってはゲーム続行不可能かもしれない
                     # self.root.after(0, self.disable_game_interaction)
 
+                elif message_type == "CONTINUE" or "board" in data: # "CONTINUE" または盤面情報があれば更新
+                    self.post_update("CONTINUE", data)
+
 
             except json.JSONDecodeError as e:
                 print(f"不正なJSONデータを受信しました: {response[:100]}... エラー: {e}") # 受信データの一部も表示
@@ -322,6 +442,8 @@ class ClientGUI:
                 # break
             except socket.error as e: # socket.timeoutも含む可能性がある
                 print(f"ソケットエラーが発生しました (受信ループ中): {e}")
+                if self.try_resume():
+                    continue
                 self.info_label.config(text="サーバーとの通信エラーが発生しました。")
                 self.root.after(0, self.disable_game_interaction)
                 break
@@ -333,6 +455,114 @@ class ClientGUI:
         print("Exited receive_updates_loop.")
 
 
+    def try_resume(self):
+        # 対局中に切断されたら再接続し、seat_token で元の席に戻る (サーバーが対応していなければ False)
+        if self.is_spectator or not self.seat_token:
+            return False
+        self.info_label.config(text="接続が切れました。再接続しています...")
+
+        def attempt(): # 停止処理中の古いサーバーに切られた場合も再試行する。待ち時間は retry_with_backoff だけが決める
+            self.client.reconnect(attempts=1)
+            self.client.send(json.dumps({"mode": "resume", "seat_token": self.seat_token}))
+            return json.loads(self.client.recv().decode("utf-8"))
+
+        try:
+            data = othello_client.retry_with_backoff(attempt)
+        except ConnectionError as e:
+            print(f"再接続に失敗しました: {e}")
+            return False
+        if data.get("status") != "resumed":
+            print(f"対局を再開できませんでした: {data}")
+            return False
+        print(f"Resumed game session {data.get('session_id')} as {data.get('player_color')}.")
+        self.info_label.config(text=f"Your color: {self.player_color} (再接続しました)")
+        # 切断前に送った手の応答は届かないので、仮の手は取り消す (再開後に届く盤面で打ち直せる)
+        self.root.after(0, self.rollback_provisional)
+        return True
+
+    def post_update(self, case, data):
+        # 受信スレッドから呼ぶ。描画はフレームごとに flush_updates でまとめて行う
+        with self.pending_lock:
+            if case == "CONTINUE" and self.pending_updates and self.pending_updates[-1][0] == "CONTINUE":
+                self.pending_updates[-1] = (case, data) # まだ描画していない盤面は最新のもので置き換える
+            else:
+                self.pending_updates.append((case, data))
+            if self.frame_scheduled:
+                return
+            self.frame_scheduled = True
+        delay = max(0.0, self.last_frame + FRAME_INTERVAL - time.monotonic())
+        self.root.after(int(delay * 1000), self.flush_updates)
+
+    def flush_updates(self):
+        # Tk のメインループで1フレームに1回だけ呼ばれる。盤面は最後のものだけ描画し、
+        # パス・終局などの通知はその前後関係を保ったまま処理する
+        with self.pending_lock:
+            updates, self.pending_updates = self.pending_updates, []
+            self.frame_scheduled = False
+            if self.catchup is not None: # 手順の再生中に届いた更新は、再生が終わってから反映する
+                self.pending_updates[:0] = updates
+                return
+            catchup = next((i for i, (case, _) in enumerate(updates) if case == "CATCHUP"), None)
+            if catchup is not None:
+                self.pending_updates[:0] = updates[catchup + 1:]
+                updates, catchup = updates[:catchup], updates[catchup][1]
+        self.last_frame = time.monotonic()
+        latest_board = None
+        after_render = [] # 最終盤面を描画してから実行するもの
+        for case, data in updates:
+            if case in ("CONTINUE", "PASS", "FINISH", "ERROR"): # エラー応答にもサーバー側の現在の盤面が付いている
+                latest_board = data
+            if case == "PASS":
+                self.info_label.config(text=f"{data.get('passed_player', 'プレイヤー')}がパスしました。")
+            elif case == "ERROR":
+                self.info_label.config(text=f"サーバーエラー: {data.get('message', '不明なエラー')}")
+            elif case == "FINISH":
+                self.info_label.config(text="ゲーム終了！")
+                after_render.append(self.end_game) # end_gameを呼び出し勝敗表示
+            elif case == "FORCED_TERMINATION":
+                self.info_label.config(text="対戦相手の接続が切れたか、サーバーにより終了されました。")
+                after_render.append(lambda: self.end_game_message("対戦相手の切断")) # end_gameより汎用的なメッセージ表示
+        if latest_board is not None:
+            self.update_board_from_server(latest_board)
+        for callback in after_render:
+            callback()
+        if catchup is not None:
+            self.start_catchup(catchup)
+
+    def start_catchup(self, data):
+        # スナップショットの盤面から from_ply 手目までは描画せずに進め、そこから現在までを1手ずつ再生する
+        snapshot = data["snapshot"]
+        board = decode_board(snapshot["board"], self.board_size)
+        moves = [data["moves"][i:i + 3] for i in range(0, len(data["moves"]), 3)]
+        ply = snapshot["ply"]
+        start = max(ply, min(self.from_ply or 0, data["ply"]))
+        for move in moves[:start - ply]:
+            othello_rules.place_and_flip(board, *decode_move(move))
+        self.board = board
+        self.catchup = (moves[start - ply:], data)
+        self.catchup_ply = start
+        self.render_board()
+        self.update_score()
+        self.turn_label.config(text=f"{start}手目から再生中")
+        self.root.after(CATCHUP_STEP_MS, self.step_catchup)
+
+    def step_catchup(self):
+        moves, data = self.catchup
+        if not moves: # 現在の局面に追いついたので、通常の観戦に戻る
+            self.catchup = None
+            self.update_board_from_server(data)
+            self.flush_updates()
+            return
+        row, col, color = decode_move(moves.pop(0))
+        board = [r[:] for r in self.board]
+        othello_rules.place_and_flip(board, row, col, color)
+        self.board = board
+        self.catchup_ply += 1
+        self.render_board()
+        self.update_score()
+        self.turn_label.config(text=f"再生中: {self.catchup_ply}/{data['ply']}手目")
+        self.root.after(CATCHUP_STEP_MS, self.step_catchup)
+
     def update_board_from_server(self, server_response):
         print("Received board update from server")
         #print(f"Received data: {server_response}") # receive_updates_loopで表示済み
@@ -344,85 +574,151 @@ class ClientGUI:
             self.info_label.config(text=f"サーバーエラー: {server_response['error']}")
             return
         
+        self.reconcile_provisional(server_response.get("case") == "ERROR")
         self.board = server_response["board"]
         self.turn = server_response["turn"]
+        self.legal_mask = server_response.get("legal")
         print(f"Turn: {self.turn}")
         
-        self.canvas.delete("piece", "highlight") # 石とハイライトを一度に消す
-        self.draw_board_line() # 盤面の線は毎回描画
-        for row in range(self.board_size):
-            for col in range(self.board_size):
-                if self.board[row][col] is not None:
-                    self.place_piece(row, col, self.board[row][col])
+        self.render_board() # 前回から変わったマスだけ描き直す
         
         self.update_turn_display()
         self.update_score()
         if not self.is_spectator: # プレイヤーモードの場合のみ有効手を表示
             self.highlight_valid_moves()
+        self.start_analysis(server_response.get("case")) # 前の盤面の解析は打ち切られる
         
         # パスの場合のinfo_label更新はreceive_updates_loopで行う
         # ゲーム終了の場合のinfo_label更新も同様
 
     def is_valid_move(self, row, col, color):
-        if self.board[row][col] is not None:
-            return False
-        directions = [(0, 1), (1, 0), (0, -1), (-1, 0), (1, 1), (-1, -1), (1, -1), (-1, 1)]
-        valid = False
-        for direction in directions:
-            if self.check_direction(row, col, direction, color):
-                valid = True
-        return valid
-    
-    def check_direction(self, row, col, direction, color):
-        opponent_color = "white" if color == "black" else "black"
-        d_row, d_col = direction
-        r, c = row + d_row, col + d_col
-        
-        if not (0 <= r < self.board_size and 0 <= c < self.board_size and self.board[r][c] == opponent_color):
-            return False
-        
-        r += d_row
-        c += d_col
-        while 0 <= r < self.board_size and 0 <= c < self.board_size:
-            if self.board[r][c] is None:
-                return False
-            if self.board[r][c] == color:
-                return True
-            r += d_row
-            c += d_col
-        return False
-              
+        return othello_rules.is_valid_move(self.board, row, col, color)
 
     def first_draw_board(self): # このメソッドは update_board に統合しても良いかもしれない
         print("first_draw_board (called by update_board usually)")
-        self.canvas.delete("all")
-        self.draw_board_line()
-        for row in range(self.board_size):
-            for col in range(self.board_size):
-                if self.board[row][col] is not None:
-                    self.place_piece(row, col, self.board[row][col])
+        self.render_board()
 
     def update_board(self, data): # receive_initialboard_data から呼ばれる想定
         print("Update board (initial)")
         self.board = data["board"]
         self.turn = data.get("turn", self.turn) # 初期手番もここで更新
-        self.canvas.delete("all") # "piece"だけでなく"all"でクリア
-        self.draw_board_line()
-        for row in range(self.board_size):
-            for col in range(self.board_size):
-                if self.board[row][col] is not None:
-                    self.place_piece(row, col, self.board[row][col])
+        self.render_board()
         # self.update_turn_display() # 呼び出し元で行う
         # self.update_score()        # 呼び出し元で行う
 
+    def create_board_items(self):
+        # 盤と線、全マス分の石・合法手の印を最初に1度だけ作る
+        self.draw_board_line()
+        self.piece_items = []
+        self.highlight_items = []
+        self.eval_items = []
+        for row in range(self.board_size):
+            piece_row = []
+            highlight_row = []
+            eval_row = []
+            for col in range(self.board_size):
+                x0 = col * self.cell_size + self.cell_size // 4
+                y0 = row * self.cell_size + self.cell_size // 4
+                x1 = (col + 1) * self.cell_size - self.cell_size // 4
+                y1 = (row + 1) * self.cell_size - self.cell_size // 4
+                piece_row.append(self.canvas.create_oval(x0, y0, x1, y1, fill="black", state="hidden", tags="piece"))
+                cx = col * self.cell_size + self.cell_size // 2
+                cy = row * self.cell_size + self.cell_size // 2
+                highlight_row.append(self.canvas.create_oval(cx - 5, cy - 5, cx + 5, cy + 5, fill="gray", state="hidden", tags="highlight"))
+                eval_row.append(self.canvas.create_text(cx, cy + self.cell_size // 3, text="", font=("Helvetica", 9), state="hidden", tags="eval"))
+            self.piece_items.append(piece_row)
+            self.highlight_items.append(highlight_row)
+            self.eval_items.append(eval_row)
+        self.drawn_board = [[None] * self.board_size for _ in range(self.board_size)]
+        self.drawn_highlights = 0
+
+    def render_board(self):
+        # self.board と最後に描画した盤面を比べ、変わったマスの石だけを更新する
+        if self.piece_items is None:
+            self.create_board_items()
+        for row in range(self.board_size):
+            new_row = self.board[row]
+            drawn_row = self.drawn_board[row]
+            if new_row == drawn_row:
+                continue
+            for col in range(self.board_size):
+                color = new_row[col]
+                if color != drawn_row[col]:
+                    self.place_piece(row, col, color)
+                    drawn_row[col] = color
 
     def place_piece(self, row, col, color):
-        x0 = col * self.cell_size + self.cell_size // 4
-        y0 = row * self.cell_size + self.cell_size // 4
-        x1 = (col + 1) * self.cell_size - self.cell_size // 4
-        y1 = (row + 1) * self.cell_size - self.cell_size // 4
-        self.canvas.create_oval(x0, y0, x1, y1, fill=color, tags="piece") # "piece"タグを追加
+        # color が None なら石を隠す
+        if color is None:
+            self.canvas.itemconfig(self.piece_items[row][col], state="hidden")
+        else:
+            self.canvas.itemconfig(self.piece_items[row][col], fill=color, state="normal")
+
+    def show_highlights(self, mask):
+        # 合法手の印も前回との差分 (XOR) のマスだけ切り替える
+        if self.highlight_items is None:
+            self.create_board_items()
+        changed = mask ^ self.drawn_highlights
+        while changed:
+            bit = changed & -changed
+            square = bit.bit_length() - 1
+            item = self.highlight_items[square // self.board_size][square % self.board_size]
+            self.canvas.itemconfig(item, state="normal" if mask & bit else "hidden")
+            changed ^= bit
+        self.drawn_highlights = mask
     
+    def toggle_analysis(self):
+        if self.analysis_enabled.get():
+            self.start_analysis()
+        else:
+            if self.analysis:
+                self.analysis.cancel()
+            self.show_analysis(None)
+
+    def start_analysis(self, case=None):
+        # 現在の盤面の解析を依頼する。結果は poll_analysis でメインループから受け取るので、ここでは待たない
+        if not self.analysis_enabled.get() or self.piece_items is None:
+            return
+        self.show_analysis(None)
+        if case in ("FINISH", "FORCED_TERMINATION"):
+            if self.analysis:
+                self.analysis.cancel()
+            return
+        if self.analysis is None:
+            self.analysis = othello_engine.AnalysisProcess(self.analysis_depth)
+        self.analysis.analyse(self.board, self.turn)
+        self.analysis_label.config(text="解析中...")
+        if not self.analysis_polling:
+            self.analysis_polling = True
+            self.root.after(ANALYSIS_POLL_MS, self.poll_analysis)
+
+    def poll_analysis(self):
+        infos, done = self.analysis.poll()
+        if infos and self.analysis_enabled.get():
+            self.show_analysis(infos[-1]) # 間に合わなかった浅い結果は飛ばす
+        if done or not self.analysis_enabled.get():
+            self.analysis_polling = False
+            return
+        self.root.after(ANALYSIS_POLL_MS, self.poll_analysis)
+
+    def show_analysis(self, info):
+        # 合法手のマスに評価値 (手番側から見た値) を重ね、最善手順をサイドバーに表示する。None なら消す
+        scores = info["scores"] if info else {}
+        best = info["pv"][0] if info else None
+        for square in self.drawn_evals - scores.keys():
+            self.canvas.itemconfig(self.eval_items[square // self.board_size][square % self.board_size], state="hidden")
+        for square, score in scores.items():
+            self.canvas.itemconfig(self.eval_items[square // self.board_size][square % self.board_size],
+                                   text=othello_engine.format_score(score), state="normal",
+                                   fill=ANALYSIS_BEST_COLOR if square == best else "white")
+        self.drawn_evals = set(scores)
+        if hasattr(self, "analysis_label"):
+            if info:
+                line = " ".join(othello_engine.square_name(square) for square in info["pv"])
+                self.analysis_label.config(text=f"深さ {info['depth']} ({info['nodes']} 局面, {info['seconds']}秒)\n最善手順: {line}")
+            else:
+                self.analysis_label.config(text="")
+
     def draw_board_line(self):
         self.canvas.create_rectangle(
             0, 0,
@@ -441,6 +737,9 @@ class ClientGUI:
         else:
             print("終了処理が呼び出されました...")
         
+        if self.analysis:
+            self.analysis.close()
+
         # サーバーに終了を通知 (オプショナルだが推奨)
         if hasattr(self, 'client') and self.client and hasattr(self.client, 'socket') and self.client.socket.fileno() != -1:
             try:
@@ -488,20 +787,16 @@ class ClientGUI:
 
     
     def highlight_valid_moves(self):
-        self.canvas.delete("highlight")
         if self.is_spectator or self.turn != self.player_color: # 観戦者または自分の手番でなければハイライトしない
+            self.show_highlights(0)
             return
 
-        has_moves = False
-        for row in range(self.board_size):
-            for col in range(self.board_size):
-                if self.is_valid_move(row, col, self.turn):
-                    has_moves = True
-                    x0 = col * self.cell_size + self.cell_size // 2 - 5
-                    y0 = row * self.cell_size + self.cell_size // 2 - 5
-                    x1 = col * self.cell_size + self.cell_size // 2 + 5
-                    y1 = row * self.cell_size + self.cell_size // 2 + 5
-                    self.canvas.create_oval(x0, y0, x1, y1, fill="gray", tags="highlight")
+        if self.legal_mask is not None: # サーバーの合法手マスクがあれば盤面を走査しない
+            mask = self.legal_mask
+        else:
+            mask = othello_rules.legal_mask(self.board, self.turn)
+        self.show_highlights(mask)
+        has_moves = mask != 0
         if not has_moves and not self.is_spectator: # プレイヤーモードで有効手がない場合
             print(f"{self.turn.capitalize()} has no valid moves. (Client-side check)")
             # サーバーからのパス通知を待つ
@@ -522,13 +817,7 @@ class ClientGUI:
         # print(f"Checking valid moves for {color} (client-side)")
         if not hasattr(self, 'board') or not self.board: # board未初期化の場合
             return False
-        for row in range(self.board_size):
-            for col in range(self.board_size):
-                if self.is_valid_move(row, col, color):
-                    # print(f"Valid move found for {color} at ({row},{col})")
-                    return True
-        # print(f"No valid moves found for {color} (client-side)")
-        return False
+        return othello_rules.legal_mask(self.board, color) != 0
     
     def end_game(self): # ゲーム終了時の最終処理 (勝敗表示など)
         if not hasattr(self, 'board') or not self.board:
@@ -629,16 +918,32 @@ class ClientGUI:
         self.mode_display_label = tk.Label(self.sidebar, text=mode_display_text, font=("Helvetica", 10))
         self.mode_display_label.pack(pady=(20,5)) # 下に少し大きな余白
 
+        # 解析パネル
+        tk.Checkbutton(self.sidebar, text="解析を表示", variable=self.analysis_enabled, command=self.toggle_analysis).pack(pady=(10,0))
+        self.analysis_label = tk.Label(self.sidebar, text="", font=("Helvetica", 10), justify="left", wraplength=180)
+        self.analysis_label.pack(pady=5)
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Othello Client")
     parser.add_argument("-s", "--server", default="127.0.0.1", help="Server IP address")
     parser.add_argument("-p", "--port", type=int, default=PORT, help="Server port")
-    parser.add_argument("-m", "--mode", choices=['player', 'spectator'], default='player', help="Mode to run the client in (player or spectator)")
+    parser.add_argument("-m", "--mode", choices=['player', 'spectator', 'dashboard'], default='player', help="Mode to run the client in (player, spectator or dashboard for many games at once)")
+    parser.add_argument("--from-ply", type=int, default=None, help="Spectator mode: request the game history from this ply")
+    parser.add_argument("--boards", type=int, default=16, help="Dashboard mode: number of games to show")
+    parser.add_argument("--player-id", default=None, help="Player mode: name recorded in the game archive (games are recorded anonymously without it)")
+    parser.add_argument("--analysis", action="store_true", help="Show the engine analysis panel from the start")
+    parser.add_argument("--analysis-depth", type=int, default=othello_engine.DEFAULT_DEPTH, help="Maximum search depth of the analysis")
     args = parser.parse_args()
     
     root = tk.Tk()
-    gui = ClientGUI(root, args.server, args.port, args.mode) # modeを渡す
+    if args.mode == "dashboard": # 多数の対局を1つのウィンドウで観戦する
+        import spectator_dashboard
+        gui = spectator_dashboard.DashboardGUI(root, args.server, args.port, args.boards)
+        root.protocol("WM_DELETE_WINDOW", gui.on_close)
+        root.mainloop()
+        sys.exit(0)
+    gui = ClientGUI(root, args.server, args.port, args.mode, args.from_ply, args.analysis, args.analysis_depth, args.player_id) # modeを渡す
 
     signal.signal(signal.SIGINT, lambda sig, frame: gui.on_close(sig, frame))
     root.protocol("WM_DELETE_WINDOW", gui.on_close)
@@ -0,0 +1,300 @@
+import os
+import json
+import mmap
+import struct
+import bisect
+import hashlib
+import heapq
+import tempfile
+
+import game_record
+
+# 対局記録 (game_record のセグメント) の索引と検索
+# 索引は固定長エントリをキー順に並べたファイルで、mmap で開いて二分探索する。
+# 検索時に読み込むのはヒットした範囲のページだけで、アーカイブ全体をメモリに載せることはない。
+#
+# エントリ: key(u64), date(u32), session_id(u32), result(u8), color(u8), 予備(2), segment(u32), offset(u32)
+#   players.idx  : key = プレイヤーIDのハッシュ (1対局につき黒・白の最大2エントリ。IDを名乗らなかった側は載せない)
+#   openings.idx : key = 最初の OPENING_PLIES 手のハッシュ
+#   dates.idx    : key = 0 (日付順の全対局)
+
+ENTRY = struct.Struct("<QIIBBxxII")
+HEADER = struct.Struct("<4sI") # magic, エントリ数
+MAGIC = b"OIX1"
+OPENING_PLIES = 6
+RUN_SIZE = 500_000 # 索引作成時、この件数ごとにソート済みの中間ファイルを書き出す
+
+INDEX_FILES = ("players.idx", "openings.idx", "dates.idx")
+COLOR_CODES = {"black": 0, "white": 1}
+
+
+def hash_key(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def player_key(player_id):
+    return hash_key(b"P" + str(player_id).encode())
+
+
+def opening_key(squares):
+    # squares: 0〜63 のマス番号の並び (先頭 OPENING_PLIES 手を使う)
+    return hash_key(b"O" + bytes(squares[:OPENING_PLIES]))
+
+
+def square_list(moves, board_size=8):
+    # [(row, col), ...] または "d3c5..." 形式の手順をマス番号に変換する
+    if isinstance(moves, str):
+        moves = [(int(moves[i + 1]) - 1, ord(moves[i].lower()) - ord("a")) for i in range(0, len(moves), 2)]
+    return [row * board_size + col for row, col in moves]
+
+
+# ---------- 索引の作成 ----------
+def _iter_finished_games(record_dir):
+    # セグメントを1つずつ mmap して走査し、終了した対局ごとに情報を返す
+    pending = {} # session_id -> [segment_no, offset, meta, 先頭の手]
+    for path in game_record.segment_paths(record_dir):
+        segment_no = game_record.segment_number(path)
+        if os.path.getsize(path) == 0:
+            continue
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            size = len(data)
+            offset = 0
+            while offset + game_record.RECORD.size <= size:
+                session_id, ply, square, flags = game_record.RECORD.unpack_from(data, offset)
+                next_offset = offset + game_record.RECORD.size
+                if flags & game_record.FLAG_START:
+                    if next_offset + ply > size:
+                        break
+                    meta = json.loads(data[next_offset:next_offset + ply])
+                    pending[session_id] = [segment_no, offset, meta, []]
+                    next_offset += ply
+                elif flags & game_record.FLAG_MOVE:
+                    game = pending.get(session_id)
+                    if game and len(game[3]) < OPENING_PLIES:
+                        game[3].append(square)
+                elif flags & game_record.FLAG_END:
+                    game = pending.pop(session_id, None)
+                    if game:
+                        yield session_id, game[0], game[1], game[2], game[3], square
+                elif flags & game_record.FLAG_RESTART: # 再開時の手数より後の手は書き直される
+                    game = pending.get(session_id)
+                    if game:
+                        del game[3][ply:]
+                offset = next_offset
+
+
+def _write_sorted(path, entries_iter):
+    # entries_iter はソート済み。件数は最後にヘッダへ書き戻す
+    count = 0
+    with open(path + ".tmp", "wb") as f:
+        f.write(HEADER.pack(MAGIC, 0))
+        for entry in entries_iter:
+            f.write(ENTRY.pack(*entry))
+            count += 1
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, count))
+    os.replace(path + ".tmp", path)
+    return count
+
+
+def _read_run(path):
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(ENTRY.size * 4096)
+            if not chunk:
+                return
+            yield from ENTRY.iter_unpack(chunk)
+
+
+def build_index(record_dir, index_dir):
+    # 外部ソート: RUN_SIZE 件ごとにソートして中間ファイルに書き、最後にマージする
+    os.makedirs(index_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(dir=index_dir)
+    runs = {name: [] for name in INDEX_FILES}
+    buffers = {name: [] for name in INDEX_FILES}
+
+    def flush(name):
+        buffers[name].sort()
+        run_path = os.path.join(work_dir, f"{name}.{len(runs[name])}")
+        with open(run_path, "wb") as f:
+            f.write(b"".join(ENTRY.pack(*e) for e in buffers[name]))
+        runs[name].append(run_path)
+        buffers[name].clear()
+
+    games = 0
+    for session_id, segment_no, offset, meta, opening, result in _iter_finished_games(record_dir):
+        date = int(meta.get("t", 0))
+        players = meta.get("players", {})
+        for color, player in players.items():
+            if player is None: # IDを名乗らなかったプレイヤーは索引に載せない
+                continue
+            buffers["players.idx"].append((player_key(player), date, session_id, result, COLOR_CODES.get(color, 0), segment_no, offset))
+        buffers["openings.idx"].append((opening_key(opening), date, session_id, result, 0, segment_no, offset))
+        buffers["dates.idx"].append((0, date, session_id, result, 0, segment_no, offset))
+        games += 1
+        for name in INDEX_FILES:
+            if len(buffers[name]) >= RUN_SIZE:
+                flush(name)
+
+    for name in INDEX_FILES:
+        if buffers[name] or not runs[name]:
+            flush(name)
+        merged = heapq.merge(*(_read_run(p) for p in runs[name]))
+        _write_sorted(os.path.join(index_dir, name), merged)
+        for p in runs[name]:
+            os.remove(p)
+    os.rmdir(work_dir)
+    return games
+
+
+# ---------- 検索 ----------
+class _KeyView:
+    # mmap 上のエントリを (key, date) の列として見せる (bisect 用)
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return self.index.count
+
+    def __getitem__(self, i):
+        return struct.unpack_from("<QI", self.index.data, HEADER.size + i * ENTRY.size)
+
+
+class IndexFile:
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Not a game index: {path}")
+        self._keys = _KeyView(self)
+
+    def range(self, key, since=0, until=0xFFFFFFFF, limit=None):
+        # key が一致し、date が [since, until] のエントリを日付順に返す
+        lo = bisect.bisect_left(self._keys, (key, since))
+        hi = bisect.bisect_right(self._keys, (key, until))
+        if limit is not None:
+            hi = min(hi, lo + limit)
+        for i in range(lo, hi):
+            yield ArchiveEntry(*ENTRY.unpack_from(self.data, HEADER.size + i * ENTRY.size))
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+
+class ArchiveEntry:
+    __slots__ = ("key", "date", "session_id", "result", "color", "segment", "offset")
+
+    def __init__(self, key, date, session_id, result, color, segment, offset):
+        self.key = key
+        self.date = date
+        self.session_id = session_id
+        self.result = result
+        self.color = color
+        self.segment = segment
+        self.offset = offset
+
+    def __repr__(self):
+        return f"ArchiveEntry(session={self.session_id}, date={self.date}, result={self.result}, segment={self.segment}, offset={self.offset})"
+
+
+class GameArchive:
+    def __init__(self, record_dir, index_dir=None):
+        self.record_dir = record_dir
+        self.index_dir = index_dir or os.path.join(record_dir, "index")
+        self.players = IndexFile(os.path.join(self.index_dir, "players.idx"))
+        self.openings = IndexFile(os.path.join(self.index_dir, "openings.idx"))
+        self.dates = IndexFile(os.path.join(self.index_dir, "dates.idx"))
+
+    def games_of_player(self, player_id, since=0, until=0xFFFFFFFF, result=None, limit=None):
+        # player_id はハンドシェイクで名乗ったID (ボットは bot_id)。名乗らずに打った対局は見つからない
+        entries = self.players.range(player_key(player_id), since, until)
+        return _filtered(entries, result, limit)
+
+    def games_with_opening(self, moves, since=0, until=0xFFFFFFFF, result=None, limit=None):
+        squares = square_list(moves)
+        if len(squares) < OPENING_PLIES:
+            raise ValueError(f"Opening query needs at least {OPENING_PLIES} moves")
+        return _filtered(self.openings.range(opening_key(squares), since, until), result, limit)
+
+    def games_between(self, since=0, until=0xFFFFFFFF, result=None, limit=None):
+        return _filtered(self.dates.range(0, since, until), result, limit)
+
+    def load_moves(self, entry):
+        # 索引が指す開始レコードから読み進め、その対局の手順だけを取り出す
+        moves = []
+        segment_no, offset = entry.segment, entry.offset
+        while True:
+            path = os.path.join(self.record_dir, game_record.segment_name(segment_no))
+            if not os.path.exists(path):
+                return sorted(moves)
+            if os.path.getsize(path) == 0:
+                segment_no, offset = segment_no + 1, 0
+                continue
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                size = len(data)
+                while offset + game_record.RECORD.size <= size:
+                    session_id, ply, square, flags = game_record.RECORD.unpack_from(data, offset)
+                    offset += game_record.RECORD.size
+                    if flags & game_record.FLAG_START:
+                        offset += ply
+                        continue
+                    if session_id != entry.session_id:
+                        continue
+                    if flags & game_record.FLAG_MOVE:
+                        moves.append((ply, square, "white" if flags & game_record.FLAG_WHITE else "black"))
+                    elif flags & game_record.FLAG_END:
+                        return sorted(moves)
+                    elif flags & game_record.FLAG_RESTART:
+                        moves = [move for move in moves if move[0] <= ply]
+            segment_no, offset = segment_no + 1, 0 # 対局が次のセグメントにまたがっている
+
+    def replay(self, entry):
+        return game_record.replay_moves(self.load_moves(entry))
+
+    def close(self):
+        for index in (self.players, self.openings, self.dates):
+            index.close()
+
+
+def _filtered(entries, result, limit):
+    found = []
+    for entry in entries:
+        if result is not None and entry.result != result:
+            continue
+        found.append(entry)
+        if limit is not None and len(found) >= limit:
+            break
+    return found
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(description="Build or query the game archive index")
+    parser.add_argument("-d", "--dir", default="game_records", help="Record directory")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("build")
+    q_player = sub.add_parser("player")
+    q_player.add_argument("player_id")
+    q_opening = sub.add_parser("opening")
+    q_opening.add_argument("moves", help='e.g. "f5d6c3d3c4f4"')
+    args = parser.parse_args()
+
+    if args.command == "build":
+        started = time.perf_counter()
+        games = build_index(args.dir, os.path.join(args.dir, "index"))
+        print(f"Indexed {games} games in {time.perf_counter() - started:.2f}s")
+    else:
+        archive = GameArchive(args.dir)
+        started = time.perf_counter()
+        if args.command == "player":
+            found = archive.games_of_player(args.player_id)
+        else:
+            found = archive.games_with_opening(args.moves)
+        elapsed = (time.perf_counter() - started) * 1000
+        for entry in found:
+            print(entry)
+        print(f"{len(found)} games in {elapsed:.2f} ms")
+        archive.close()
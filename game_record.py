@@ -0,0 +1,290 @@
+import os
+import struct
+import threading
+import time
+import json
+import sys
+from collections import deque
+
+from async_log import ERROR, WARNING
+
+# 対局記録の追記専用ログ
+# 1手 = 8バイトのレコード (セッションID, 手数, マス, フラグ) をセグメントファイルに追記する。
+# 書き込みはキューに積むだけで、ディスクへの書き出しと fsync は
+# バックグラウンドスレッドがまとめて行う (グループコミット)。
+
+RECORD = struct.Struct("<IHBB") # session_id(u32), ply(u16), square(u8), flags(u8)
+
+FLAG_MOVE = 0x01
+FLAG_WHITE = 0x02  # 白番の手
+FLAG_START = 0x10  # 対局開始。ply にメタデータ(JSON)のバイト長が入り、直後にメタデータが続く
+FLAG_END = 0x20    # 対局終了。ply に総手数、square に結果コードが入る
+FLAG_FORCED = 0x40 # FLAG_END と併用: 切断などによる強制終了
+FLAG_RESTART = 0x80 # チェックポイントからの再開。ply に再開時の手数が入る。
+                    # それより前に書かれたこの手数より後の手 (チェックポイント後・クラッシュ前の手) は無効
+
+RESULT_DRAW = 0
+RESULT_BLACK = 1
+RESULT_WHITE = 2
+RESULT_ABORTED = 3
+
+SEGMENT_PREFIX = "games-"
+SEGMENT_SUFFIX = ".seg"
+SEQUENCE_FILE = "session.seq"
+SESSION_ID_BLOCK = 1000 # セッションIDはこの数ずつ予約してファイルに記録する
+
+
+def square_of(row, col, board_size=8):
+    return row * board_size + col
+
+
+def segment_paths(directory):
+    if not os.path.isdir(directory):
+        return []
+    names = sorted(n for n in os.listdir(directory) if n.startswith(SEGMENT_PREFIX) and n.endswith(SEGMENT_SUFFIX))
+    return [os.path.join(directory, n) for n in names]
+
+
+def segment_number(path):
+    return int(os.path.basename(path)[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+
+
+def segment_name(number):
+    return f"{SEGMENT_PREFIX}{number:06d}{SEGMENT_SUFFIX}"
+
+
+class GameRecordLog:
+    def __init__(self, directory, segment_bytes=4 * 1024 * 1024, commit_interval=0.05, log=None):
+        self.directory = directory
+        self.segment_bytes = segment_bytes     # このサイズを超えたら次のセグメントに切り替える
+        self.commit_interval = commit_interval # グループコミットの間隔(秒)
+        self.log = log # 書き出しの失敗を報告する関数 (serverv1.log と同じ形)。None なら標準エラーに出す
+        os.makedirs(directory, exist_ok=True)
+
+        self._pending = deque() # 書き込み待ちのバイト列。append/popleft はロック不要
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._commit_lock = threading.Lock() # 閉じた後の書き出しがバックグラウンドの最後のコミットと重ならないように
+        self._failing = False # 直前のコミットが失敗した (復旧するまで同じエラーを繰り返し報告しない)
+        self._id_lock = threading.Lock()
+        self._next_session_id, self._reserved_until = self._load_sequence()
+
+        existing = segment_paths(directory)
+        # 再起動時は既存セグメントに追記せず、新しいセグメントから始める
+        self._segment_no = segment_number(existing[-1]) + 1 if existing else 1
+        self._file = None
+        self._open_segment()
+
+        self._thread = threading.Thread(target=self._run, name="game-record", daemon=True)
+        self._thread.start()
+
+    # ---------- セッションID ----------
+    def _load_sequence(self):
+        path = os.path.join(self.directory, SEQUENCE_FILE)
+        try:
+            with open(path) as f:
+                start = int(f.read().strip() or 1)
+        except (OSError, ValueError):
+            start = 1
+        return start, start # 予約済み範囲は new_session_id の初回で確保する
+
+    def new_session_id(self):
+        with self._id_lock:
+            if self._next_session_id >= self._reserved_until:
+                self._reserved_until = self._next_session_id + SESSION_ID_BLOCK
+                path = os.path.join(self.directory, SEQUENCE_FILE)
+                with open(path + ".tmp", "w") as f:
+                    f.write(str(self._reserved_until))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(path + ".tmp", path)
+            session_id = self._next_session_id
+            self._next_session_id += 1
+            return session_id
+
+    # ---------- 書き込み (ゲームスレッドから呼ばれる) ----------
+    def record_start(self, session_id, players, started_at=None):
+        meta = json.dumps({"t": int(started_at or time.time()), "players": players}, separators=(",", ":")).encode()
+        if len(meta) > 0xFFFF: # 長さは ply (u16) に入れる
+            raise ValueError(f"Game metadata too long: {len(meta)} bytes")
+        self._append(RECORD.pack(session_id, len(meta), 0, FLAG_START) + meta, wake=True)
+
+    def record_move(self, session_id, ply, row, col, color):
+        flags = FLAG_MOVE | (FLAG_WHITE if color == "white" else 0)
+        self._append(RECORD.pack(session_id, ply, square_of(row, col), flags))
+
+    def record_end(self, session_id, total_plies, result, forced=False):
+        flags = FLAG_END | (FLAG_FORCED if forced else 0)
+        self._append(RECORD.pack(session_id, total_plies, result, flags), wake=True)
+
+    def record_restart(self, session_id, ply):
+        self._append(RECORD.pack(session_id, ply, 0, FLAG_RESTART), wake=True)
+
+    def _append(self, record, wake=False):
+        self._pending.append(record)
+        if self._closed: # 閉じた後に届いた記録は呼び出したスレッドで書き出す (async_log と同じ)
+            self._commit(keep_open=False)
+        elif wake:
+            self._wakeup.set()
+
+    # ---------- バックグラウンドの書き出し ----------
+    def _open_segment(self):
+        path = os.path.join(self.directory, segment_name(self._segment_no))
+        self._file = open(path, "ab")
+
+    def _rotate_if_needed(self):
+        if self._file.tell() >= self.segment_bytes:
+            self._file.close()
+            self._file = None
+            self._segment_no += 1
+            self._open_segment()
+
+    def _close_file(self, truncate_to=None):
+        # truncate_to: 書きかけのバッチを切り詰める位置。次のコミットで開き直し、同じ位置から書き直す
+        if self._file is None:
+            return
+        path = self._file.name
+        try:
+            self._file.close() # 書き出せなかったバッファもここで捨てられる
+        except OSError:
+            pass
+        self._file = None
+        if truncate_to is not None:
+            try:
+                os.truncate(path, truncate_to)
+            except OSError:
+                pass
+
+    def _report(self, message, level):
+        if self.log:
+            self.log(message, level=level)
+        else:
+            print(message, file=sys.stderr)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.commit_interval)
+            self._wakeup.clear()
+            closing = self._closed
+            self._commit()
+            if closing:
+                return
+
+    def _commit(self, keep_open=True):
+        with self._commit_lock:
+            if self._pending:
+                self._write_pending()
+            if not keep_open:
+                self._close_file()
+
+    def _write_pending(self):
+        chunks = []
+        while True:
+            try:
+                chunks.append(self._pending.popleft())
+            except IndexError:
+                break
+        start = None
+        try:
+            if self._file is None: # 前回の失敗や close の後
+                self._open_segment()
+            start = self._file.tell()
+            self._file.write(b"".join(chunks))
+            self._file.flush()
+            os.fsync(self._file.fileno()) # まとめた分を1回のfsyncで確定させる
+        except OSError as e:
+            # 書けなかった分は捨てずに先頭へ戻し、次のコミットで書き直す (手が欠けると対局を再生できなくなる)
+            self._pending.extendleft(reversed(chunks))
+            self._close_file(truncate_to=start)
+            if not self._failing:
+                self._report(f"[game_record] write failed, retrying: {e}", ERROR)
+            self._failing = True
+            return
+        if self._failing:
+            self._report("[game_record] write recovered", WARNING)
+            self._failing = False
+        try:
+            self._rotate_if_needed()
+        except OSError as e: # 書き込みは確定済み。次のコミットで新しいセグメントを開き直す
+            self._file = None
+            self._report(f"[game_record] segment rotation failed: {e}", ERROR)
+
+    def close(self, timeout=5.0):
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join(timeout)
+        self._commit(keep_open=False)
+
+
+# ---------- 読み出しと再生 ----------
+def iter_records(directory):
+    # (segment_path, offset, session_id, ply, square, flags, meta) を順に返す
+    for path in segment_paths(directory):
+        with open(path, "rb") as f:
+            data = f.read()
+        offset = 0
+        while offset + RECORD.size <= len(data):
+            session_id, ply, square, flags = RECORD.unpack_from(data, offset)
+            meta = None
+            next_offset = offset + RECORD.size
+            if flags & FLAG_START:
+                if next_offset + ply > len(data):
+                    break # 書き込み途中で切れたレコード
+                meta = json.loads(data[next_offset:next_offset + ply])
+                next_offset += ply
+            yield path, offset, session_id, ply, square, flags, meta
+            offset = next_offset
+
+
+def load_game_records(directory, session_id):
+    # 指定セッションの開始メタデータ・手順・終了レコードを集める
+    meta, moves, end = None, [], None
+    for _, _, sid, ply, square, flags, record_meta in iter_records(directory):
+        if sid != session_id:
+            continue
+        if flags & FLAG_START:
+            meta = record_meta
+        elif flags & FLAG_MOVE:
+            moves.append((ply, square, "white" if flags & FLAG_WHITE else "black"))
+        elif flags & FLAG_END:
+            end = {"plies": ply, "result": square, "forced": bool(flags & FLAG_FORCED)}
+        elif flags & FLAG_RESTART: # 再開後に同じ手数の手が書き直される
+            moves = [move for move in moves if move[0] <= ply]
+            end = None
+    moves.sort()
+    return meta, moves, end
+
+
+def replay_moves(moves, game=None, board_size=8):
+    # 手順を OthelloGame で先頭から再生し、最終局面のゲームを返す
+    if game is None:
+        from serverv1 import OthelloGame
+        game = OthelloGame(board_size)
+    game.initialize_board()
+    for ply, square, color in moves:
+        row, col = divmod(square, board_size)
+        if not game.is_valid_move(row, col, color):
+            raise ValueError(f"Illegal move in record at ply {ply}: ({row},{col}) by {color}")
+        game.place_and_flip(row, col, color)
+        opponent = "white" if color == "black" else "black"
+        game.turn = opponent if game.any_valid_moves(opponent) else color
+    return game
+
+
+def replay_game(directory, session_id, game=None):
+    meta, moves, end = load_game_records(directory, session_id)
+    return replay_moves(moves, game), meta, end
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Replay a recorded Othello game")
+    parser.add_argument("session_id", type=int)
+    parser.add_argument("-d", "--dir", default="game_records", help="Record directory")
+    args = parser.parse_args()
+    game, meta, end = replay_game(args.dir, args.session_id)
+    print(f"meta: {meta}  end: {end}")
+    for row in game.board:
+        print(" ".join({"black": "X", "white": "O"}.get(cell, ".") for cell in row))
@@ -1,7 +1,16 @@
+import time
+import argparse
 import tkinter as tk
+import othello_engine
+import othello_rules
+
+# コンピューターの設定
+ENGINE_DEPTH = 6 # 読みの深さ
+ENGINE_MAX_THINK = 3.0 # この秒数を超えたら、その時点で最も深く読めた結果で打つ
+ENGINE_POLL_MS = 30 # 思考プロセスの結果を確認する間隔
 
 class OthelloGame:
-    def __init__(self, root):
+    def __init__(self, root, computer=None, depth=ENGINE_DEPTH):
         # rootオブジェクト
         self.root = root
         # ウィンドウのタイトル
@@ -14,12 +23,27 @@ class OthelloGame:
         self.board = [[None for _ in range(self.board_size)] for _ in range(self.board_size)]
         # 先行を黒に指定
         self.turn = "black"
+        # ゲームが終わったかどうか
+        self.game_over = False
+        # コンピューターが受け持つ色 (None なら2人で対局する)
+        self.computer = computer
+        # コンピューターは別プロセスで考えるので、思考中も画面は止まらない
+        self.engine = othello_engine.AnalysisProcess(depth) if computer else None
+        # 思考プロセスに依頼している仕事 ("think" か "ponder", 局面)
+        self.engine_job = None
+        # 依頼した局面について届いた最も深い結果と、読み終えたかどうか
+        self.engine_info = None
+        self.engine_done = False
+        self.engine_polling = False
+        self.think_started = 0.0
         self.create_sidebar()
         self.create_board()
         self.initialize_board()
         self.update_turn_display()
         self.update_score()
         self.highlight_valid_moves()
+        # コンピューターが先手なら考え始める
+        self.schedule_computer()
 
     def create_board(self):
         # Canvasの定義
@@ -34,6 +58,23 @@ class OthelloGame:
                 x1 = x0 + self.cell_size
                 y1 = y0 + self.cell_size
                 self.canvas.create_rectangle(x0, y0, x1, y1, outline="black", fill="green")
+
+        # 駒とハイライトはマスごとに1つずつ先に作っておき、以降は色の変更と表示・非表示だけで描画する
+        # (置くたびに create_oval すると、裏返した駒の下に古い楕円が積み重なっていくため)
+        self.piece_items = [[None] * self.board_size for _ in range(self.board_size)]
+        self.highlight_items = [[None] * self.board_size for _ in range(self.board_size)]
+        for row in range(self.board_size):
+            for col in range(self.board_size):
+                x0 = col     * self.cell_size + self.cell_size // 4
+                y0 = row     * self.cell_size + self.cell_size // 4
+                x1 = (col+1) * self.cell_size - self.cell_size // 4
+                y1 = (row+1) * self.cell_size - self.cell_size // 4
+                self.piece_items[row][col] = self.canvas.create_oval(x0, y0, x1, y1, fill="black", state="hidden")
+                cx = col * self.cell_size + self.cell_size // 2
+                cy = row * self.cell_size + self.cell_size // 2
+                self.highlight_items[row][col] = self.canvas.create_oval(cx - 5, cy - 5, cx + 5, cy + 5, fill="gray", state="hidden")
+        # 表示中のハイライトのマス
+        self.highlighted = set()
                 
         # クリックイベント（左ボタンクリック時に、handle_clickメソッドを呼び出す）
         self.canvas.bind("<Button-1>", self.handle_click)
@@ -47,14 +88,10 @@ class OthelloGame:
         self.place_piece(center  , center-1, "black")
 
     def place_piece(self, row, col, color):
-        x0 = col     * self.cell_size + self.cell_size // 4
-        y0 = row     * self.cell_size + self.cell_size // 4
-        x1 = (col+1) * self.cell_size - self.cell_size // 4
-        y1 = (row+1) * self.cell_size - self.cell_size // 4
         # マスの状態を更新
         self.board[row][col] = color
-        # 駒を描画
-        self.canvas.create_oval(x0, y0, x1, y1, fill=color)
+        # そのマスの駒の色を変えて表示する
+        self.canvas.itemconfig(self.piece_items[row][col], fill=color, state="normal")
 
     def handle_click(self, event):
         # クリック位置からマスを判定
@@ -64,103 +101,130 @@ class OthelloGame:
         # クリック位置が正しくない場合は、無効
         if not (0 <= row < self.board_size and 0 <= col < self.board_size):
             return
+        # ゲーム終了後やコンピューターの手番のクリックは、無効
+        if self.game_over or self.turn == self.computer:
+            return
         
         # 合法手かどうか判定し、
         if self.is_valid_move(row, col, self.turn):
-            # 駒を置く
-            self.place_piece(row, col, self.turn)
-            # 駒をひっくり返す
-            self.flip_pieces(row, col)
-            # スコアの更新
-            self.update_score()
-            # 手番の更新
-            self.turn = "white" if self.turn == "black" else "black"
-            # 盤面を更新
-            self.update_turn_display()
-            # 駒を置けるマスをハイライト表示
-            self.highlight_valid_moves()
-            
-            # 駒を置けるマスがなければ、パス
-            if not self.has_valid_moves(self.turn):
-                self.pass_turn()
+            self.play_move(row, col)
+
+    def play_move(self, row, col):
+        # 人とコンピューターの共通の着手処理
+        # 駒を置く
+        self.place_piece(row, col, self.turn)
+        # 駒をひっくり返す
+        self.flip_pieces(row, col)
+        # スコアの更新
+        self.update_score()
+        # 手番の更新
+        self.turn = "white" if self.turn == "black" else "black"
+        # 盤面を更新
+        self.update_turn_display()
+        # 駒を置けるマスをハイライト表示
+        self.highlight_valid_moves()
+        
+        # 駒を置けるマスがなければ、パス
+        if not self.has_valid_moves(self.turn):
+            self.pass_turn()
+        # 次がコンピューターの手番なら考え始める
+        self.schedule_computer()
+
+    def schedule_computer(self):
+        if self.computer is None or self.game_over or self.turn != self.computer:
+            return
+        position = othello_rules.board_to_bits(self.board, self.computer)
+        if self.engine_job == ("ponder", position):
+            # 予想どおりの手だった。先読みの結果をそのまま使い、読み終えていれば即座に打つ
+            self.engine_label.config(text="予想どおりの手です")
+        else:
+            # 予想が外れた (または先読みしていない)。先読みを打ち切って、今の局面を考え直す
+            self.engine.analyse_bits(*position)
+            self.engine_info = None
+            self.engine_done = False
+            self.engine_label.config(text="考え中...")
+        self.engine_job = ("think", position)
+        self.think_started = time.monotonic()
+        self.start_engine_polling()
+
+    def start_pondering(self, square):
+        # 人の手番の間に、予想した応手 square を打った後の局面を先読みしておく
+        human, computer = othello_rules.board_to_bits(self.board, self.turn)
+        if not othello_rules.legal_moves(human, computer) >> square & 1:
+            return
+        flipped = othello_rules.flips(human, computer, square)
+        position = (computer & ~flipped, human | flipped | (1 << square))
+        self.engine.analyse_bits(*position)
+        self.engine_job = ("ponder", position)
+        self.engine_info = None
+        self.engine_done = False
+        self.start_engine_polling()
+
+    def start_engine_polling(self):
+        # 結果は root.after でメインループから受け取る (待つことはしない)
+        if not self.engine_polling:
+            self.engine_polling = True
+            self.root.after(0, self.poll_engine)
+
+    def poll_engine(self):
+        infos, done = self.engine.poll()
+        if infos:
+            self.engine_info = infos[-1]
+        self.engine_done = self.engine_done or done
+        kind = self.engine_job[0] if self.engine_job else None
+        if kind == "think" and self.engine_info and (self.engine_done or time.monotonic() - self.think_started >= ENGINE_MAX_THINK):
+            self.engine_polling = False
+            self.computer_move()
+            return
+        if kind != "think" and (self.engine_done or kind is None):
+            # 先読みは終わった。結果は人が打つまで持っておく
+            self.engine_polling = False
+            return
+        self.root.after(ENGINE_POLL_MS, self.poll_engine)
+
+    def computer_move(self):
+        info = self.engine_info
+        square = info["pv"][0]
+        # 読み筋の次の手を人の応手として予想する
+        predicted = info["pv"][1] if len(info["pv"]) > 1 else othello_engine.PASS
+        self.engine_job = None
+        self.engine_label.config(text=f"コンピューター: {othello_engine.square_name(square)} "
+                                      f"(評価 {othello_engine.format_score(info['scores'][square])}, 深さ {info['depth']}, {time.monotonic() - self.think_started:.2f}秒)")
+        row, col = divmod(square, self.board_size)
+        self.play_move(row, col)
+        # 人の手番になったら、予想した応手の局面を先読みする
+        if not self.game_over and self.turn != self.computer and predicted != othello_engine.PASS:
+            self.start_pondering(predicted)
+
+    def on_close(self):
+        if self.engine:
+            self.engine.close()
+        self.root.destroy()
 
     def is_valid_move(self, row, col, color):
-        # 既に駒が置かれていれば、Falseを返す。
-        if self.board[row][col] is not None:
-            return False
-        # 八方向（縦、横、斜め）
-        directions = [(0, 1), (1, 0), (0, -1), (-1, 0), (1, 1), (-1, -1), (1, -1), (-1, 1)]
-        # デフォルトをFalseに設定
-        valid = False
-        # 各方向のマスの状態を確認
-        for direction in directions:
-            if self.check_direction(row, col, direction, color):
-                valid = True
-        return valid
-
-    def check_direction(self, row, col, direction, color):
-        # 相手の駒の色を代入
-        opponent_color = "white" if color == "black" else "black"
-        # 指定の方向のマスを確認
-        d_row, d_col = direction
-        row += d_row
-        col += d_col
-        # 盤面外であれば、Falseを返す
-        if not (0 <= row < self.board_size and 0 <= col < self.board_size):
-            return False
-        # 相手の駒がなければ、Falseを返す
-        if self.board[row][col] != opponent_color:
-            return False
-        while 0 <= row < self.board_size and 0 <= col < self.board_size:
-            # マスがNoneであれば、Falseを返す
-            if self.board[row][col] is None:
-                return False
-            # 自分の駒があれば、Trueを返す
-            if self.board[row][col] == color:
-                return True
-            row += d_row
-            col += d_col
-        return False
+        # 合法手の判定はサーバー・クライアントと共通の othello_rules で行う
+        return othello_rules.is_valid_move(self.board, row, col, color)
 
     def flip_pieces(self, row, col):
-        directions = [(0, 1), (1, 0), (0, -1), (-1, 0), (1, 1), (-1, -1), (1, -1), (-1, 1)]
-        for direction in directions:
-            if self.check_direction(row, col, direction, self.turn):
-                self.flip_in_direction(row, col, direction)
-
-    def flip_in_direction(self, row, col, direction):
-        opponent_color = "white" if self.turn == "black" else "black"
-        d_row, d_col = direction
-        row += d_row
-        col += d_col
-        while self.board[row][col] == opponent_color:
-            # 相手の駒を自分の駒に置き換える
-            self.place_piece(row, col, self.turn)
-            row += d_row
-            col += d_col
+        # (row, col) に置いた駒で挟んだ相手の駒を、自分の駒に置き換える
+        for r, c in othello_rules.flipped_squares(self.board, row, col, self.turn):
+            self.place_piece(r, c, self.turn)
 
     def highlight_valid_moves(self):
-        # 前の盤面でのハイライトを削除
-        self.canvas.delete("highlight")
-        has_moves = False
-        for row in range(self.board_size):
-            for col in range(self.board_size):
-                if self.is_valid_move(row, col, self.turn):
-                    has_moves = True
-                    x0 = col * self.cell_size + self.cell_size // 2 - 5
-                    y0 = row * self.cell_size + self.cell_size // 2 - 5
-                    x1 = col * self.cell_size + self.cell_size // 2 + 5
-                    y1 = row * self.cell_size + self.cell_size // 2 + 5
-                    self.canvas.create_oval(x0, y0, x1, y1, fill="gray", tags="highlight")
+        # 合法手のマスを集める
+        moves = {divmod(square, self.board_size) for square in othello_rules.squares(othello_rules.legal_mask(self.board, self.turn))}
+        # 前の盤面との差分のマスだけ、ハイライトの表示・非表示を切り替える
+        for row, col in self.highlighted - moves:
+            self.canvas.itemconfig(self.highlight_items[row][col], state="hidden")
+        for row, col in moves - self.highlighted:
+            self.canvas.itemconfig(self.highlight_items[row][col], state="normal")
+        self.highlighted = moves
+        has_moves = bool(moves)
         if not has_moves:
             print(f"{self.turn.capitalize()} has no valid moves")
 
     def has_valid_moves(self, color):
-        for row in range(self.board_size):
-            for col in range(self.board_size):
-                if self.is_valid_move(row, col, color):
-                    return True
-        return False
+        return othello_rules.legal_mask(self.board, color) != 0
 
     def pass_turn(self):
         print("pass turn")
@@ -174,6 +238,7 @@ class OthelloGame:
             self.end_game()
 
     def end_game(self):
+        self.game_over = True
         black_count, white_count = self.count_pieces()
         if black_count > white_count:
             winner = "黒の勝利！"
@@ -200,6 +265,10 @@ class OthelloGame:
         self.score_label = tk.Label(self.sidebar, text="", font=("Helvetica", 14))
         self.score_label.pack(pady=10)
 
+        # コンピューターの着手や思考の状況
+        self.engine_label = tk.Label(self.sidebar, text="", font=("Helvetica", 10), wraplength=200, justify="left")
+        self.engine_label.pack(pady=10)
+
     def update_turn_display(self):
         self.turn_label.config(text=f"Turn: {self.turn.capitalize()}")
 
@@ -208,18 +277,16 @@ class OthelloGame:
         self.score_label.config(text=f"Black: {black_count}  White: {white_count}")
 
     def count_pieces(self):
-        black_count = 0
-        white_count = 0
-        for row in range(self.board_size):
-            for col in range(self.board_size):
-                if self.board[row][col] == "black":
-                    black_count += 1
-                elif self.board[row][col] == "white":
-                    white_count += 1
-        return black_count, white_count
+        return othello_rules.count_discs(self.board)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Othello Game")
+    parser.add_argument("--computer", choices=["black", "white"], default=None, help="Let the computer play this color")
+    parser.add_argument("--depth", type=int, default=ENGINE_DEPTH, help="Search depth of the computer")
+    args = parser.parse_args()
+
     root = tk.Tk()
-    game = OthelloGame(root)
+    game = OthelloGame(root, args.computer, args.depth)
+    root.protocol("WM_DELETE_WINDOW", game.on_close)
     root.mainloop()
     
\ No newline at end of file
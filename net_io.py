@@ -0,0 +1,303 @@
+import errno
+import socket
+import struct
+import threading
+
+# フレーム単位の送受信
+# フレーム = ヘッダ(ペイロード長 u32, チャンネル u32, ビッグエンディアン) + ペイロード
+# 送信側はヘッダとペイロードを memoryview のまま溜め、溜まった分を sendmsg の
+# スキャッター・ギャザーで1回のシステムコールにまとめて送る。
+# 共有のペイロード(ブロードキャストの盤面など)は全ピアで同じバイト列を参照し、コピーしない。
+# サーバーでは送信をピアごとの送信スレッドに任せ (QueuedPeerWriter)、セッションのワーカーがソケットを待たないようにする。
+
+FRAME_HEADER = struct.Struct("!II")
+MAX_FRAME_SIZE = 1 << 20 # これを超える長さのフレームは不正として扱う
+MAX_IOV = 512 # 1回の sendmsg に渡すバッファ数の上限 (IOV_MAX 対策)
+MAX_QUEUED_BYTES = 1 << 20 # サーバー側のピアごとの送信待ちの上限。超えたら受信していないピアとみなして切断する
+CLOSE_TIMEOUT = 5.0 # 閉じるときに送信待ちを送り切るのを待つ上限(秒)
+RECV_SIZE = 65536
+HAS_SENDMSG = hasattr(socket.socket, "sendmsg")
+
+
+class FrameError(Exception):
+    pass
+
+
+class SendQueueFull(OSError):
+    pass
+
+
+def make_frame(payload, channel=0):
+    # 複数のピアに同じフレームを送るときは1度だけ作って使い回す
+    return (FRAME_HEADER.pack(len(payload), channel), memoryview(payload))
+
+
+def set_nodelay(sock):
+    # 対局の操作は小さなメッセージなので Nagle アルゴリズムで待たせない
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except OSError:
+        pass
+
+
+class PeerWriter:
+    # 複数スレッドから送られたフレームを溜め、その時点で送信中でないスレッドがまとめて送る
+    def __init__(self, sock):
+        self.sock = sock
+        self._queue = [] # 送信待ちのバッファ (bytes / memoryview)
+        self._queue_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+
+    def send_frames(self, frames):
+        with self._queue_lock:
+            for header, payload in frames:
+                self._queue.append(header)
+                self._queue.append(payload)
+        self._flush()
+
+    def _flush(self):
+        while True:
+            if not self._send_lock.acquire(blocking=False):
+                return # 送信中のスレッドがこちらの分も送る
+            try:
+                while True:
+                    with self._queue_lock:
+                        buffers, self._queue = self._queue, []
+                    if not buffers:
+                        break
+                    self._write(buffers)
+            except Exception:
+                with self._queue_lock:
+                    self._queue.clear()
+                raise
+            finally:
+                self._send_lock.release()
+            # 解放する直前に積まれた分が取り残されないよう確認する
+            with self._queue_lock:
+                if not self._queue:
+                    return
+
+    def _write(self, buffers):
+        if not HAS_SENDMSG:
+            self.sock.sendall(b"".join(buffers))
+            return
+        views = [memoryview(b) for b in buffers]
+        while views:
+            sent = self.sock.sendmsg(views[:MAX_IOV])
+            # 送れた分だけ先頭から進める (途中までしか送れなかったバッファはスライスする)
+            while views and sent >= len(views[0]):
+                sent -= len(views[0])
+                views.pop(0)
+            if views and sent:
+                views[0] = views[0][sent:]
+
+    def close(self):
+        self.sock.close()
+
+
+class QueuedPeerWriter(PeerWriter):
+    # 送信をピアごとの送信スレッドに任せる版 (サーバー用)。send_frames はキューに積むだけでソケットを待たない。
+    # ワーカー1つが多数のセッションを順に処理するので、遅いピアや止まったピアで他のセッションを止めないためのもの。
+    # 送信待ちが max_queued バイトを超えたら接続を切る (受信側のスレッドが切断として処理する)。
+    def __init__(self, sock, max_queued=MAX_QUEUED_BYTES):
+        super().__init__(sock)
+        self.max_queued = max_queued
+        self._queued_bytes = 0
+        self._wakeup = threading.Condition(self._queue_lock)
+        self._thread = None # 最初の送信で起動する
+        self._running = False
+        self._busy = False # 送信スレッドが書き込み中
+        self._closing = False
+        self._error = None # 送信に失敗した理由。以降の send_frames はこれを投げる
+
+    def send_frames(self, frames):
+        with self._queue_lock:
+            if self._error is not None:
+                raise self._error
+            if self._closing:
+                raise OSError(errno.EBADF, "Connection is closing")
+            for header, payload in frames:
+                self._queue.append(header)
+                self._queue.append(payload)
+                self._queued_bytes += len(header) + len(payload)
+            overflow = self._queued_bytes > self.max_queued
+            if overflow:
+                self._error = SendQueueFull(f"Peer is not reading: more than {self.max_queued} bytes queued")
+                self._queue.clear()
+                self._queued_bytes = 0
+                self._wakeup.notify()
+            elif self._thread is None:
+                self._running = True
+                self._thread = threading.Thread(target=self._run, name="peer-writer", daemon=True)
+                self._thread.start()
+            else:
+                self._wakeup.notify()
+        if overflow:
+            self._abort()
+            raise self._error
+
+    def _run(self):
+        try:
+            while True:
+                with self._queue_lock:
+                    self._busy = False
+                    while not self._queue and not self._closing and self._error is None:
+                        self._wakeup.wait()
+                    if self._error is not None:
+                        return
+                    buffers, self._queue = self._queue, []
+                    self._queued_bytes = 0
+                    if not buffers: # 閉じる前の送信待ちを送り切った
+                        return
+                    self._busy = True
+                self._write(buffers)
+        except OSError as e:
+            with self._queue_lock:
+                if self._error is None:
+                    self._error = e
+                self._queue.clear()
+                self._queued_bytes = 0
+        finally:
+            with self._queue_lock:
+                self._running = False
+                self._busy = False
+                close_now = self._closing
+            if close_now:
+                self._close_socket()
+
+    def _abort(self):
+        # 書き込みや受信で止まっているスレッドを起こして接続を切る
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _close_socket(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def close(self):
+        # 送信待ちを送り切ってから送信スレッドが閉じる (終局の盤面を送った直後に閉じても届くように)。呼び出し側は待たない
+        with self._queue_lock:
+            if self._closing:
+                return
+            self._closing = True
+            running = self._running
+            draining = running and (self._busy or bool(self._queue))
+            self._wakeup.notify()
+        if not running:
+            self._close_socket()
+        elif draining: # 受信しないピアのために送信スレッドが残り続けないよう、期限を過ぎたら切る
+            timer = threading.Timer(CLOSE_TIMEOUT, self._abort)
+            timer.daemon = True
+            timer.start()
+
+
+class FrameReader:
+    def __init__(self, sock):
+        self.sock = sock
+        self._buffer = bytearray()
+
+    def read_frame(self):
+        # (チャンネル, ペイロード) を返す。接続が閉じられたら None
+        while True:
+            if len(self._buffer) >= FRAME_HEADER.size:
+                length, channel = FRAME_HEADER.unpack_from(self._buffer)
+                if length > MAX_FRAME_SIZE:
+                    raise FrameError(f"Frame too large: {length} bytes")
+                end = FRAME_HEADER.size + length
+                if len(self._buffer) >= end:
+                    payload = bytes(self._buffer[FRAME_HEADER.size:end])
+                    del self._buffer[:end]
+                    return channel, payload
+            chunk = self.sock.recv(RECV_SIZE)
+            if not chunk:
+                return None
+            self._buffer += chunk
+
+
+class FramedConnection:
+    # ソケットをフレーム単位で扱うラッパー。サーバー・クライアントの両方で使う
+    # max_queued_bytes を指定すると送信は送信スレッドが行い (サーバー用)、指定しなければ呼び出したスレッドで送る
+    def __init__(self, sock, nodelay=True, max_queued_bytes=None):
+        self.sock = sock
+        if nodelay:
+            set_nodelay(sock)
+        try:
+            self._peername = sock.getpeername()
+        except OSError:
+            self._peername = None
+        self.player_id = None # プレイヤーがハンドシェイクで名乗ったID (対局記録用)
+        self.reader = FrameReader(sock)
+        self.writer = PeerWriter(sock) if max_queued_bytes is None else QueuedPeerWriter(sock, max_queued_bytes)
+
+    def getpeername(self):
+        # 切断後もログに出せるよう接続時の値を返す
+        return self._peername
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send(self, payload, channel=0):
+        self.writer.send_frames([make_frame(payload, channel)])
+
+    def send_frame(self, frame):
+        self.writer.send_frames([frame])
+
+    def send_frames(self, frames):
+        self.writer.send_frames(frames)
+
+    def recv_frame(self):
+        return self.reader.read_frame()
+
+    def recv(self):
+        # socket.recv と同じく、切断時は空のバイト列を返す
+        frame = self.reader.read_frame()
+        return frame[1] if frame else b""
+
+    def close(self):
+        self.writer.close()
+
+
+class Channel:
+    # 多重化された接続上の1チャンネル。ソケットと同じように send / close / getpeername を持つので、
+    # GameSession からは通常の接続と同じように扱える
+    def __init__(self, connection, channel_id, player_id=None, on_close=None):
+        self.connection = connection
+        self.channel_id = channel_id
+        self.player_id = player_id
+        self.on_close = on_close
+        self.session = None # 着席しているセッションと席番号 (bind で設定)
+        self.seat = None
+        self.closed = False
+
+    def bind(self, session, seat):
+        self.session = session
+        self.seat = seat
+
+    def getpeername(self):
+        return self.connection.getpeername()
+
+    def send(self, payload):
+        self.connection.send(payload, self.channel_id)
+
+    def send_frame(self, frame):
+        # ペイロードは共有したまま、ヘッダだけこのチャンネル用に作り直す
+        payload = frame[1]
+        self.connection.send_frames([(FRAME_HEADER.pack(len(payload), self.channel_id), payload)])
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.connection.send(b'{"status": "channel_closed"}', self.channel_id)
+        except OSError:
+            pass
+        if self.on_close:
+            self.on_close(self)
@@ -0,0 +1,389 @@
+import json
+import time
+import socket
+import random
+import asyncio
+import argparse
+
+import net_io
+import othello_rules
+
+# 画面を持たないクライアントの共通部分 (tkinter は import しない)
+# 接続・ハンドシェイク・フレームの送受信・盤面状態の管理を行い、手の選択だけを
+# choose_move(state) -> (x, y) の関数 (戦略) に任せる。ボットや結合テストから使う。
+#
+#   ProtocolClient      : ブロッキング版。1接続で1対局
+#   AsyncProtocolClient : asyncio 版。1接続で1対局 (1つのイベントループで多数の接続を動かせる)
+#   AsyncBotClient      : asyncio 版の多重化モード。1接続で多数の対局を同時に行う
+
+PORT = 8080
+CONNECT_TIMEOUT = 10 # seconds
+RECONNECT_ATTEMPTS = 8
+RECONNECT_BASE_DELAY = 0.5 # seconds
+RECONNECT_MAX_DELAY = 30.0 # 待ち時間の上限 (seconds)
+PLAYING_CASES = ("CONTINUE", "PASS")
+FINAL_CASES = ("FINISH", "FORCED_TERMINATION")
+MAX_CONSECUTIVE_ERRORS = 3 # 戦略が不正な手を続けて返したら諦める
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class GameState:
+    # サーバーから受け取った盤面1つ分
+    __slots__ = ("board", "turn", "case", "message", "legal", "color")
+
+    def __init__(self, data, color=None):
+        self.board = data["board"]
+        self.turn = data.get("turn")
+        self.case = data.get("case")
+        self.message = data.get("message", "")
+        self.legal = data.get("legal") # 手番側の合法手 (ビットマスク)
+        self.color = color # 自分の色 (観戦者は None)
+
+    def is_over(self):
+        return self.case in FINAL_CASES
+
+    def my_turn(self):
+        return self.color is not None and self.turn == self.color and self.case in PLAYING_CASES + ("ERROR",)
+
+    def legal_moves(self):
+        # [(x, y), ...]。サーバーが合法手マスクを送ってこない場合は盤面から求める
+        size = len(self.board)
+        if self.legal is not None:
+            mask = self.legal
+            moves = []
+            while mask:
+                square = (mask & -mask).bit_length() - 1
+                moves.append((square % size, square // size))
+                mask &= mask - 1
+            return moves
+        return [(square % size, square // size) for square in othello_rules.squares(othello_rules.legal_mask(self.board, self.turn))]
+
+    def count(self):
+        return othello_rules.count_discs(self.board)
+
+    def winner(self):
+        black, white = self.count()
+        return "black" if black > white else "white" if white > black else None
+
+
+# ---------- 戦略 ----------
+def first_legal_move(state):
+    moves = state.legal_moves()
+    return moves[0] if moves else None
+
+
+def random_move(state):
+    moves = state.legal_moves()
+    return random.choice(moves) if moves else None
+
+
+STRATEGIES = {"first": first_legal_move, "random": random_move}
+
+
+# ---------- 接続 ----------
+def backoff_delay(attempt, base_delay=RECONNECT_BASE_DELAY, max_delay=RECONNECT_MAX_DELAY):
+    # 指数バックオフ + full jitter: 0 〜 min(上限, base * 2^attempt) の一様乱数
+    # サーバー再起動で多数のクライアントが同時に切れても、再接続の時刻がばらけて accept に集中しない
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def retry_with_backoff(fn, attempts=RECONNECT_ATTEMPTS, base_delay=RECONNECT_BASE_DELAY,
+                       max_delay=RECONNECT_MAX_DELAY, on_retry=None):
+    # fn() が OSError (ConnectionError を含む) を投げる間、待ち時間を空けて繰り返す
+    for attempt in range(attempts):
+        try:
+            return fn()
+        except (OSError, ValueError) as e: # ValueError: 接続直後に閉じられて応答が壊れていた場合
+            if attempt == attempts - 1:
+                raise ConnectionError(f"Gave up after {attempts} attempts: {e}") from e
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            if on_retry:
+                on_retry(attempt + 1, delay, e)
+            time.sleep(delay)
+
+
+def connect_with_backoff(server, attempts=RECONNECT_ATTEMPTS, base_delay=RECONNECT_BASE_DELAY,
+                         max_delay=RECONNECT_MAX_DELAY, on_retry=None):
+    # 接続できたソケットを返す。attempts 回失敗したら ConnectionError
+    def connect():
+        sock = socket.create_connection(server, timeout=CONNECT_TIMEOUT)
+        sock.settimeout(None)
+        return sock
+    return retry_with_backoff(connect, attempts, base_delay, max_delay, on_retry)
+
+
+# ---------- メッセージ ----------
+def encode(message):
+    return json.dumps(message).encode("utf-8")
+
+
+def decode(payload):
+    return json.loads(payload.decode("utf-8"))
+
+
+def move_message(move, color):
+    x, y = move
+    return {"x": x, "y": y, "turn": color}
+
+
+class GameDriver:
+    # 1対局分の進行 (同期版・非同期版で共通)。受け取ったメッセージを渡すと、送るべきメッセージを返す
+    def __init__(self, strategy, color=None, on_state=None):
+        self.strategy = strategy
+        self.color = color
+        self.on_state = on_state
+        self.state = None
+        self.errors = 0
+
+    def handle(self, data):
+        if "board" not in data:
+            return None
+        self.state = GameState(data, self.color)
+        if self.on_state:
+            self.on_state(self.state)
+        if self.state.case == "ERROR":
+            self.errors += 1
+            if self.errors >= MAX_CONSECUTIVE_ERRORS:
+                raise ProtocolError(f"Strategy made {self.errors} invalid moves in a row: {self.state.message}")
+        elif self.state.case in PLAYING_CASES:
+            self.errors = 0
+        if not self.state.my_turn():
+            return None
+        move = self.strategy(self.state)
+        return move_message(move, self.color) if move else None
+
+    def finished(self):
+        return self.state is not None and self.state.is_over()
+
+
+# ---------- ブロッキング版 ----------
+class ProtocolClient:
+    def __init__(self, host, port=PORT, strategy=first_legal_move, mode="player", from_ply=None, player_id=None):
+        self.server = (host, port)
+        self.strategy = strategy
+        self.mode = mode # "player" または "spectator"
+        self.from_ply = from_ply
+        self.player_id = player_id # 対局記録に残すID (なければ記録されない)
+        self.conn = None
+        self.color = None
+        self.seat_token = None
+
+    def connect(self):
+        self.conn = net_io.FramedConnection(connect_with_backoff(self.server))
+
+    def send(self, message):
+        self.conn.send(encode(message))
+
+    def recv(self):
+        payload = self.conn.recv()
+        if not payload:
+            raise ConnectionError("Server closed the connection.")
+        return decode(payload)
+
+    def handshake(self):
+        hello = {"mode": self.mode}
+        if self.from_ply is not None:
+            hello["from_ply"] = self.from_ply
+        if self.player_id and self.mode == "player":
+            hello["player_id"] = self.player_id
+        self.send(hello)
+        if self.mode != "player":
+            return None
+        data = self.recv() # 相手が見つかるまで待つ
+        if "player_color" not in data:
+            raise ProtocolError(f"Expected a color assignment, got: {data}")
+        self.color = data["player_color"]
+        self.seat_token = data.get("seat_token")
+        self.send({"status": "color_set", "color": self.color})
+        return self.color
+
+    def play(self, on_state=None):
+        # 対局が終わるまで進め、最終状態を返す
+        driver = GameDriver(self.strategy, self.color, on_state)
+        while not driver.finished():
+            try:
+                data = self.recv()
+            except (ConnectionError, OSError):
+                if not self.resume(): # サーバー再起動などで切れた場合は席に戻って続ける
+                    raise
+                continue
+            reply = driver.handle(data)
+            if reply:
+                self.send(reply)
+        return driver.state
+
+    def resume(self):
+        # 再接続して seat_token で元の席に戻る。サーバーが再開できない場合は False
+        if not self.seat_token:
+            return False
+
+        def attempt():
+            # 停止処理中の古いサーバーにつながって即座に切られることもあるので、応答までを1回の試行とする
+            self.close()
+            self.conn = net_io.FramedConnection(connect_with_backoff(self.server, attempts=1))
+            self.send({"mode": "resume", "seat_token": self.seat_token})
+            return self.recv()
+
+        try:
+            data = retry_with_backoff(attempt)
+        except ConnectionError:
+            return False
+        return data.get("status") == "resumed"
+
+    def run(self, on_state=None):
+        self.connect()
+        try:
+            self.handshake()
+            return self.play(on_state)
+        finally:
+            self.close()
+
+    def close(self):
+        if self.conn:
+            try: self.conn.close()
+            except OSError: pass
+
+
+# ---------- asyncio 版 ----------
+async def read_frame(reader):
+    # (チャンネル, ペイロード)。切断されたら None
+    try:
+        header = await reader.readexactly(net_io.FRAME_HEADER.size)
+        length, channel = net_io.FRAME_HEADER.unpack(header)
+        if length > net_io.MAX_FRAME_SIZE:
+            raise net_io.FrameError(f"Frame too large: {length} bytes")
+        return channel, await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        return None
+
+
+def write_frame(writer, message, channel=0):
+    payload = encode(message)
+    writer.write(net_io.FRAME_HEADER.pack(len(payload), channel) + payload)
+
+
+async def open_framed_connection(host, port):
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), CONNECT_TIMEOUT)
+    net_io.set_nodelay(writer.get_extra_info("socket"))
+    return reader, writer
+
+
+class AsyncProtocolClient:
+    def __init__(self, host, port=PORT, strategy=first_legal_move, mode="player", player_id=None):
+        self.server = (host, port)
+        self.strategy = strategy
+        self.mode = mode
+        self.player_id = player_id
+        self.reader = self.writer = None
+        self.color = None
+        self.seat_token = None
+
+    async def recv(self):
+        frame = await read_frame(self.reader)
+        if frame is None:
+            raise ConnectionError("Server closed the connection.")
+        return decode(frame[1])
+
+    async def run(self, on_state=None):
+        self.reader, self.writer = await open_framed_connection(*self.server)
+        try:
+            hello = {"mode": self.mode}
+            if self.player_id and self.mode == "player":
+                hello["player_id"] = self.player_id
+            write_frame(self.writer, hello)
+            if self.mode == "player":
+                data = await self.recv()
+                if "player_color" not in data:
+                    raise ProtocolError(f"Expected a color assignment, got: {data}")
+                self.color = data["player_color"]
+                self.seat_token = data.get("seat_token")
+                write_frame(self.writer, {"status": "color_set", "color": self.color})
+            driver = GameDriver(self.strategy, self.color, on_state)
+            while not driver.finished():
+                reply = driver.handle(await self.recv())
+                if reply:
+                    write_frame(self.writer, reply)
+            return driver.state
+        finally:
+            self.writer.close()
+
+
+class AsyncBotClient:
+    # 多重化モード: 1接続上でチャンネルごとに別々の対局を進める (サーバーの handle_multiplex を使う)
+    def __init__(self, host, port=PORT, strategy=first_legal_move, bot_id=None, token=None):
+        self.server = (host, port)
+        self.strategy = strategy
+        self.bot_id = bot_id
+        self.token = token
+
+    async def play_games(self, games, on_state=None):
+        # games 局を同時に行い、チャンネル順に最終状態のリストを返す
+        reader, writer = await open_framed_connection(*self.server)
+        try:
+            hello = {"mode": "multiplex", "bot_id": self.bot_id}
+            if self.token:
+                hello["token"] = self.token
+            write_frame(writer, hello)
+            frame = await read_frame(reader)
+            if frame is None or decode(frame[1]).get("status") != "multiplex_ready":
+                raise ProtocolError(f"Multiplex handshake failed: {frame and frame[1][:200]}")
+            drivers = {}
+            for channel in range(1, games + 1):
+                drivers[channel] = GameDriver(self.strategy, None, on_state)
+                write_frame(writer, {"action": "join"}, channel)
+            results = {}
+            while len(results) < games:
+                frame = await read_frame(reader)
+                if frame is None:
+                    raise ConnectionError("Server closed the connection.")
+                channel, payload = frame
+                driver = drivers.get(channel)
+                if driver is None or channel in results:
+                    continue
+                data = decode(payload)
+                if "player_color" in data:
+                    driver.color = data["player_color"]
+                    continue
+                if data.get("status") == "channel_closed": # 最終盤面を受け取らないまま閉じられた
+                    results[channel] = driver.state
+                    continue
+                reply = driver.handle(data)
+                if reply:
+                    write_frame(writer, reply, channel)
+                if driver.finished():
+                    results[channel] = driver.state
+                await writer.drain()
+            return [results[channel] for channel in sorted(results)]
+        finally:
+            writer.close()
+
+
+async def run_bots(host, port, connections, games_per_connection, strategy=first_legal_move, token=None):
+    # connections 本の多重化接続を1つのイベントループで動かす
+    bots = [AsyncBotClient(host, port, strategy, f"bot-{i}", token) for i in range(connections)]
+    results = await asyncio.gather(*(bot.play_games(games_per_connection) for bot in bots))
+    return [state for states in results for state in states]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless Othello bots")
+    parser.add_argument("-s", "--server", default="127.0.0.1", help="Server IP address")
+    parser.add_argument("-p", "--port", type=int, default=PORT, help="Server port")
+    parser.add_argument("--strategy", choices=sorted(STRATEGIES), default="random")
+    parser.add_argument("--connections", type=int, default=2, help="Multiplexed bot connections")
+    parser.add_argument("--games", type=int, default=10, help="Games per connection")
+    parser.add_argument("--token", default=None, help="Bot token (OTHELLO_BOT_TOKEN on the server)")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    states = asyncio.run(run_bots(args.server, args.port, args.connections, args.games, STRATEGIES[args.strategy], args.token))
+    elapsed = time.perf_counter() - started
+    finished = [s for s in states if s is not None and s.case == "FINISH"]
+    wins = {"black": 0, "white": 0, None: 0}
+    for s in finished:
+        wins[s.winner()] += 1
+    print(f"{len(finished)}/{len(states)} games finished in {elapsed:.2f}s "
+          f"(black {wins['black']}, white {wins['white']}, draw {wins[None]})")
@@ -0,0 +1,198 @@
+import time
+import queue
+import multiprocessing
+
+from othello_rules import legal_moves, flips, board_to_bits, squares
+
+# 盤面解析用の探索エンジン (アルファベータ付きネガマックス、反復深化)
+# 盤面は手番側の石 own と相手の石 opp の2つの64ビット整数で表す (othello_rules と同じ表現)。
+# 解析は AnalysisProcess で別プロセスに任せ、深さが1つ増えるごとに結果を返す。
+# 新しい盤面を渡すと世代番号が上がり、探索中の古い解析は次の確認時に打ち切られる。
+
+SQUARE_WEIGHTS = (
+    100, -20, 10,  5,  5, 10, -20, 100,
+    -20, -50, -2, -2, -2, -2, -50, -20,
+     10,  -2, -1, -1, -1, -1,  -2,  10,
+      5,  -2, -1, -1, -1, -1,  -2,   5,
+      5,  -2, -1, -1, -1, -1,  -2,   5,
+     10,  -2, -1, -1, -1, -1,  -2,  10,
+    -20, -50, -2, -2, -2, -2, -50, -20,
+    100, -20, 10,  5,  5, 10, -20, 100,
+)
+# 1行(8ビット)ぶんの石の並び -> 重みの合計。評価のたびにビットを1つずつ数えずに済むよう先に作っておく
+ROW_WEIGHTS = [[sum(SQUARE_WEIGHTS[row * 8 + col] for col in range(8) if bits >> col & 1) for bits in range(256)]
+               for row in range(8)]
+MOBILITY_WEIGHT = 8
+EXACT_SCALE = 1000 # 終局まで読み切った評価は 石差 * EXACT_SCALE (途中の評価値より必ず大きい)
+INFINITY = 1 << 30
+CANCEL_CHECK_NODES = 1024 # この節点数ごとに打ち切りを確認する
+DEFAULT_DEPTH = 8
+PASS = -1 # 読み筋の中のパス
+
+
+class SearchCancelled(Exception):
+    pass
+
+
+def square_name(square):
+    # 棋譜と同じ表記 (例: 37 -> "f5")
+    if square == PASS:
+        return "pass"
+    return chr(ord("a") + square % 8) + str(square // 8 + 1)
+
+
+def format_score(score):
+    # 読み切った評価は石差で表す
+    if abs(score) >= EXACT_SCALE:
+        return f"{score // EXACT_SCALE:+d}石"
+    return f"{score:+d}"
+
+
+def _positional(bits):
+    total = 0
+    for row in range(8):
+        total += ROW_WEIGHTS[row][(bits >> (row * 8)) & 0xFF]
+    return total
+
+
+def evaluate(own, opp, moves):
+    # 手番側から見た評価値 (石の位置の重み + 着手可能数の差)
+    mobility = moves.bit_count() - legal_moves(opp, own).bit_count()
+    return _positional(own) - _positional(opp) + MOBILITY_WEIGHT * mobility
+
+
+def _squares(moves, first=None):
+    # 重みの大きいマスから調べると枝刈りがよく効く。first (前回の最善手) があれば最初にする
+    ordered = sorted(squares(moves), key=SQUARE_WEIGHTS.__getitem__, reverse=True)
+    if first in ordered:
+        ordered.remove(first)
+        ordered.insert(0, first)
+    return ordered
+
+
+class Search:
+    def __init__(self, should_stop=None):
+        self.should_stop = should_stop # 打ち切るなら True を返す関数
+        self.nodes = 0
+
+    def negamax(self, own, opp, depth, alpha, beta):
+        # (手番側から見た評価値, 読み筋) を返す
+        self.nodes += 1
+        if self.should_stop and self.nodes % CANCEL_CHECK_NODES == 0 and self.should_stop():
+            raise SearchCancelled()
+        moves = legal_moves(own, opp)
+        if not moves:
+            if not legal_moves(opp, own): # 両者とも打てない: 終局
+                return (own.bit_count() - opp.bit_count()) * EXACT_SCALE, []
+            score, line = self.negamax(opp, own, depth, -beta, -alpha) # パスは深さに数えない
+            return -score, [PASS] + line
+        if depth <= 0:
+            return evaluate(own, opp, moves), []
+        best, best_line = -INFINITY, []
+        for square in _squares(moves):
+            flipped = flips(own, opp, square)
+            score, line = self.negamax(opp & ~flipped, own | flipped | (1 << square), depth - 1, -beta, -alpha)
+            score = -score
+            if score > best:
+                best, best_line = score, [square] + line
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        return best, best_line
+
+
+def analyse(own, opp, max_depth=DEFAULT_DEPTH, should_stop=None):
+    # 深さ 1, 2, ... と読みを深め、深さごとに {"depth", "scores", "pv", "nodes"} を返すジェネレータ
+    # scores は合法手ごとの評価値 (手番側から見た値)。打ち切られたら SearchCancelled
+    moves = legal_moves(own, opp)
+    if not moves:
+        return
+    search = Search(should_stop)
+    empties = 64 - (own | opp).bit_count()
+    best_square = None
+    for depth in range(1, max_depth + 1):
+        scores = {}
+        best, pv = -INFINITY, []
+        for square in _squares(moves, best_square):
+            # 全マスの評価値を出すため、根では手ごとに窓を狭めずに読む
+            flipped = flips(own, opp, square)
+            score, line = search.negamax(opp & ~flipped, own | flipped | (1 << square), depth - 1, -INFINITY, INFINITY)
+            score = -score
+            scores[square] = score
+            if score > best:
+                best, pv = score, [square] + line
+        best_square = pv[0]
+        yield {"depth": depth, "scores": scores, "pv": pv, "nodes": search.nodes}
+        if depth >= empties: # 終局まで読み切った
+            return
+
+
+def _analysis_main(jobs, results, generation):
+    # 解析プロセスの本体。世代番号が変わった解析は打ち切って次の依頼に移る
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        job_generation, own, opp, max_depth = job
+        if job_generation != generation.value:
+            continue
+        started = time.perf_counter()
+        try:
+            for info in analyse(own, opp, max_depth, lambda: generation.value != job_generation):
+                info["seconds"] = round(time.perf_counter() - started, 3)
+                results.put((job_generation, info))
+        except SearchCancelled:
+            continue
+        results.put((job_generation, None)) # この盤面の解析はここまで
+
+
+class AnalysisProcess:
+    # 解析用のプロセスを1つ持ち、最新の盤面だけを解析させる。呼び出し側 (Tk のメインスレッド) は待たされない
+    def __init__(self, max_depth=DEFAULT_DEPTH):
+        context = multiprocessing.get_context("spawn") # Tk を使っているプロセスを fork しない
+        self.max_depth = max_depth
+        self.generation = context.Value("q", 0, lock=False) # 書くのはこちらだけなのでロックは要らない
+        self.jobs = context.Queue()
+        self.results = context.Queue()
+        self.process = context.Process(target=_analysis_main, args=(self.jobs, self.results, self.generation),
+                                       name="othello-analysis", daemon=True)
+        self.process.start()
+
+    def analyse(self, board, color):
+        # 前の解析を打ち切り、board (color の手番) の解析を依頼する
+        self.analyse_bits(*board_to_bits(board, color))
+
+    def analyse_bits(self, own, opp):
+        self.generation.value += 1
+        self.jobs.put((self.generation.value, own, opp, self.max_depth))
+
+    def cancel(self):
+        self.generation.value += 1
+
+    def poll(self):
+        # 届いている現在の盤面の結果を ([info, ...], 解析が終わったか) で返す。古い盤面の結果は捨てる
+        infos = []
+        done = False
+        while True:
+            try:
+                result_generation, info = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if result_generation != self.generation.value:
+                continue
+            if info is None:
+                done = True
+            else:
+                infos.append(info)
+        return infos, done
+
+    def close(self):
+        self.cancel()
+        try:
+            self.jobs.put(None)
+            self.process.join(1.0)
+        except (OSError, ValueError):
+            pass
+        if self.process.is_alive():
+            self.process.terminate()
@@ -0,0 +1,130 @@
+# オセロのルール (合法手の判定・石の反転・石数) の共通実装
+# サーバー (server.py, serverv1.py)、クライアント (client.py, clientv1.py)、ローカル対局 (main.py)、
+# ボット用ライブラリと解析エンジンがすべてここを使う。実装を速くするときはここだけ直せばよい。
+#
+# 内部では盤面を2つの64ビット整数 (手番側の石 own と相手の石 opp) で表し、8方向の判定を
+# ビットシフトでまとめて行う。ビット番号は row * 8 + col で、サーバーが送る合法手のマスク "legal" と同じ並び。
+# 呼び出し側は今までどおり 8x8 のリスト (各マス "black" / "white" / None) を渡せばよい。
+# 盤面の大きさは 8x8 のみ対応。
+
+BOARD_SIZE = 8
+FULL = (1 << 64) - 1
+NOT_A_FILE = 0xFEFEFEFEFEFEFEFE # 左端の列を除く (右へずらしたときの回り込み防止)
+NOT_H_FILE = 0x7F7F7F7F7F7F7F7F # 右端の列を除く
+DIRECTIONS = ( # (ビットをずらす量, ずらした後に掛けるマスク)
+    (1, NOT_A_FILE), (-1, NOT_H_FILE), (8, FULL), (-8, FULL),
+    (9, NOT_A_FILE), (7, NOT_H_FILE), (-7, NOT_A_FILE), (-9, NOT_H_FILE),
+)
+
+_ROW_BITS = {} # 1行分のマスの並び (tuple) -> (黒の8ビット, 白の8ビット)。並びは高々 3^8 通り
+
+
+def _shift(bits, amount, mask):
+    return ((bits << amount) if amount > 0 else (bits >> -amount)) & mask & FULL
+
+
+def legal_moves(own, opp):
+    # 手番側 (own) の合法手のビットマスク
+    empty = ~(own | opp) & FULL
+    moves = 0
+    for amount, mask in DIRECTIONS:
+        run = _shift(own, amount, mask) & opp
+        for _ in range(5): # 挟める相手の石は1方向に最大6個
+            run |= _shift(run, amount, mask) & opp
+        moves |= _shift(run, amount, mask) & empty
+    return moves
+
+
+def flips(own, opp, square):
+    # square に打ったときに裏返る石のビットマスク (square が空いているかどうかは見ない)
+    flipped = 0
+    for amount, mask in DIRECTIONS:
+        run = 0
+        cursor = _shift(1 << square, amount, mask)
+        while cursor & opp:
+            run |= cursor
+            cursor = _shift(cursor, amount, mask)
+        if cursor & own:
+            flipped |= run
+    return flipped
+
+
+def squares(mask):
+    # マスクの立っているビットの番号を小さい順に返す
+    while mask:
+        bit = mask & -mask
+        yield bit.bit_length() - 1
+        mask ^= bit
+
+
+def _row_bits(row):
+    key = tuple(row)
+    bits = _ROW_BITS.get(key)
+    if bits is None:
+        black = white = 0
+        for col, cell in enumerate(key):
+            if cell == "black":
+                black |= 1 << col
+            elif cell == "white":
+                white |= 1 << col
+        bits = _ROW_BITS[key] = (black, white)
+    return bits
+
+
+def board_bits(board):
+    # リストの盤面を (黒, 白) のビット列にする。行ごとの変換結果を使い回すので、1回あたり8回の辞書引きで済む
+    black = white = 0
+    shift = 0
+    for row in board:
+        row_black, row_white = _row_bits(row)
+        black |= row_black << shift
+        white |= row_white << shift
+        shift += BOARD_SIZE
+    return black, white
+
+
+def board_to_bits(board, color):
+    # (color の石, 相手の石)
+    black, white = board_bits(board)
+    return (black, white) if color == "black" else (white, black)
+
+
+def legal_mask(board, color):
+    # color の合法手のビットマスク
+    return legal_moves(*board_to_bits(board, color))
+
+
+def is_valid_move(board, row, col, color):
+    if not (0 <= row < BOARD_SIZE and 0 <= col < BOARD_SIZE) or board[row][col] is not None:
+        return False
+    own, opp = board_to_bits(board, color)
+    return flips(own, opp, row * BOARD_SIZE + col) != 0
+
+
+def flipped_squares(board, row, col, color):
+    # (row, col) に color を打ったときに裏返る石の [(row, col), ...]。打てない手なら空
+    own, opp = board_to_bits(board, color)
+    return [divmod(square, BOARD_SIZE) for square in squares(flips(own, opp, row * BOARD_SIZE + col))]
+
+
+def place_and_flip(board, row, col, color):
+    # 合法手なら board を書き換えて裏返した石の [(row, col), ...] を返す。不正な手なら何もせず空を返す
+    if not (0 <= row < BOARD_SIZE and 0 <= col < BOARD_SIZE) or board[row][col] is not None:
+        return []
+    flipped = flipped_squares(board, row, col, color)
+    if flipped:
+        board[row][col] = color
+        for r, c in flipped:
+            board[r][c] = color
+    return flipped
+
+
+def count_discs(board):
+    # (黒の石数, 白の石数)
+    black, white = board_bits(board)
+    return black.bit_count(), white.bit_count()
+
+
+def is_full(board):
+    black, white = board_bits(board)
+    return (black | white) == FULL
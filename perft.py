@@ -0,0 +1,167 @@
+import sys
+import json
+import time
+import argparse
+import concurrent.futures
+
+import othello_rules
+import serverv1
+
+# perft: 指定した深さまでの末端局面の数を数え、手の生成が正しいことと速さ (局面/秒) を確かめる
+# パスも1手として数える (両者とも打てなくなった局面はその深さで末端とする)。
+# 初期局面からの値は既知の値 (REFERENCE_COUNTS) と照合し、違えば終了コード 1。
+#
+#   python perft.py 8                         # 深さ 1〜8 を OthelloGame で数える
+#   python perft.py 10 --jobs 8 --only        # 深さ 10 だけを、初手ごとに8プロセスへ分けて数える
+#   python perft.py 6 --backend bitboard      # othello_rules のビット演算を直接使う (比較用)
+#   python perft.py 4 --board <64文字> --turn white --divide
+
+REFERENCE_COUNTS = {
+    1: 4, 2: 12, 3: 56, 4: 244, 5: 1396, 6: 8200, 7: 55092, 8: 390216, 9: 3005288, 10: 24571284,
+}
+
+
+def initial_board():
+    game = serverv1.OthelloGame()
+    game.initialize_board()
+    return game.board
+
+
+def decode_board(text):
+    # serverv1.encode_board の逆 ("b"=黒, "w"=白, "."=空き の64文字)
+    if len(text) != 64 or set(text) - set("bw."):
+        raise ValueError("board must be 64 characters of 'b', 'w' and '.'")
+    cells = [{"b": "black", "w": "white"}.get(ch) for ch in text]
+    return [cells[row * 8:(row + 1) * 8] for row in range(8)]
+
+
+def opponent_of(color):
+    return "white" if color == "black" else "black"
+
+
+# ---------- OthelloGame (serverv1) で数える ----------
+def perft_game(game, color, depth, passed=False):
+    if depth == 0:
+        return 1
+    mask = game.valid_moves_mask(color)
+    if not mask:
+        if passed: # 両者とも打てない: 終局
+            return 1
+        return perft_game(game, opponent_of(color), depth - 1, True)
+    if depth == 1:
+        return mask.bit_count()
+    nodes = 0
+    saved = game.board
+    for square in othello_rules.squares(mask):
+        game.board = [row[:] for row in saved]
+        game.place_and_flip(square // 8, square % 8, color)
+        nodes += perft_game(game, opponent_of(color), depth - 1)
+    game.board = saved
+    return nodes
+
+
+# ---------- ビット演算で直接数える ----------
+def perft_bits(own, opp, depth, passed=False):
+    if depth == 0:
+        return 1
+    moves = othello_rules.legal_moves(own, opp)
+    if not moves:
+        if passed:
+            return 1
+        return perft_bits(opp, own, depth - 1, True)
+    if depth == 1:
+        return moves.bit_count()
+    nodes = 0
+    for square in othello_rules.squares(moves):
+        flipped = othello_rules.flips(own, opp, square)
+        nodes += perft_bits(opp & ~flipped, own | flipped | (1 << square), depth - 1)
+    return nodes
+
+
+def perft(backend, board, color, depth, passed=False):
+    if backend == "bitboard":
+        own, opp = othello_rules.board_to_bits(board, color)
+        return perft_bits(own, opp, depth, passed)
+    game = serverv1.OthelloGame()
+    game.board = [row[:] for row in board]
+    return perft_game(game, color, depth, passed)
+
+
+def root_children(board, color):
+    # 初手ごとの (手の表記, 盤面, 手番, パス直後か)。打てなければパスの1つだけ
+    mask = othello_rules.legal_mask(board, color)
+    if not mask:
+        return [("pass", board, opponent_of(color), True)]
+    children = []
+    for square in othello_rules.squares(mask):
+        child = [row[:] for row in board]
+        othello_rules.place_and_flip(child, square // 8, square % 8, color)
+        children.append((chr(ord("a") + square % 8) + str(square // 8 + 1), child, opponent_of(color), False))
+    return children
+
+
+def divide(backend, board, color, depth, pool=None):
+    # 初手ごとの末端局面数 {手: 数}。pool があれば初手ごとに別プロセスで数える
+    if depth == 0:
+        return {"-": 1}
+    if not othello_rules.legal_mask(board, color) and not othello_rules.legal_mask(board, opponent_of(color)):
+        return {"-": 1} # 終局している
+    children = root_children(board, color)
+    if pool is None:
+        return {name: perft(backend, child, turn, depth - 1, passed) for name, child, turn, passed in children}
+    futures = {name: pool.submit(perft, backend, child, turn, depth - 1, passed) for name, child, turn, passed in children}
+    return {name: future.result() for name, future in futures.items()}
+
+
+def run(backend, board, color, depths, jobs, show_divide, check_reference):
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    results = []
+    try:
+        for depth in depths:
+            started = time.perf_counter()
+            split = divide(backend, board, color, depth, pool)
+            elapsed = time.perf_counter() - started
+            nodes = sum(split.values())
+            expected = REFERENCE_COUNTS.get(depth) if check_reference else None
+            result = {"depth": depth, "nodes": nodes, "seconds": round(elapsed, 3),
+                      "nodes_per_sec": round(nodes / elapsed, 1) if elapsed > 0 else None,
+                      "expected": expected, "ok": None if expected is None else nodes == expected}
+            if show_divide:
+                result["divide"] = split
+            results.append(result)
+            yield result
+    finally:
+        if pool:
+            pool.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Count leaf nodes to a given depth (passes count as moves)")
+    parser.add_argument("depth", type=int, nargs="?", default=8, help="Maximum depth")
+    parser.add_argument("--only", action="store_true", help="Count only the maximum depth instead of 1..depth")
+    parser.add_argument("--board", default=None, help="Start position as 64 characters of 'b', 'w', '.' (default: initial position)")
+    parser.add_argument("--turn", choices=["black", "white"], default="black", help="Side to move in the start position")
+    parser.add_argument("--backend", choices=["game", "bitboard"], default="game", help="serverv1.OthelloGame or raw othello_rules bitboards")
+    parser.add_argument("--jobs", type=int, default=1, help="Split the root moves across this many processes")
+    parser.add_argument("--divide", action="store_true", help="Show the node count below each root move")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    serverv1.LOGGER.level = serverv1.ERROR
+    board = decode_board(args.board) if args.board else initial_board()
+    check_reference = args.board is None and args.turn == "black"
+    depths = [args.depth] if args.only else list(range(1, args.depth + 1))
+
+    results = []
+    for result in run(args.backend, board, args.turn, depths, args.jobs, args.divide, check_reference):
+        results.append(result)
+        if args.json:
+            continue
+        status = "" if result["ok"] is None else "  OK" if result["ok"] else f"  MISMATCH (expected {result['expected']})"
+        print(f"perft({result['depth']:>2}) = {result['nodes']:>12,}  {result['seconds']:>9.3f}s  "
+              f"{result['nodes_per_sec'] or 0:>12,.0f} nodes/s{status}", flush=True)
+        for move, count in result.get("divide", {}).items():
+            print(f"    {move:>4}: {count:,}")
+    if args.json:
+        print(json.dumps({"backend": args.backend, "jobs": args.jobs, "python": sys.version.split()[0], "results": results}, indent=2))
+    sys.exit(1 if any(r["ok"] is False for r in results) else 0)
@@ -0,0 +1,126 @@
+import threading
+import time
+
+# 接続ごと・IPごとのトークンバケットによる流量制限
+# 受信のたびに呼ばれるので、処理は time.monotonic() と数回の四則演算だけにしている。
+# 制限を超えたり不正な入力を送ってきた接続には違反点(strike)を加算し、
+# 点数に応じて 遅延 → 切断 と段階的に重くする。
+# メッセージは黙って捨てない (手番の手が失われると、応答を待つ両者とも進めなくなるため)。
+
+ALLOW = "allow"
+DELAY = "delay"
+DISCONNECT = "disconnect"
+
+# 1局で1人が打つ手は高々60なので、ボットが待ち時間なしで1局打っても CONN_BURST には届かない
+CONN_RATE = 20.0  # 1接続あたり 毎秒のメッセージ数
+CONN_BURST = 80.0
+IP_RATE = 80.0    # 1IPあたり (同じIPの全接続の合計)。同じ端末の2人が続けて対局しても届かないようにする
+IP_BURST = 160.0
+DELAY_STRIKES = 5.0       # この点数以上で遅延させる
+DISCONNECT_STRIKES = 20.0 # この点数以上で切断する
+STRIKE_DECAY = 1.0        # 違反点は毎秒この分だけ減る
+PENALTY_DELAY = 0.2       # 遅延時に受信スレッドを止める秒数
+MALFORMED_PENALTY = 2.0   # 不正なJSONなどの違反点
+IP_IDLE_EXPIRE = 300.0    # この秒数使われていないIPのバケットは捨てる
+MUX_RATE = 2000.0    # 多重化接続(ボット)は1本で多数の対局を運ぶので上限を別に設ける
+MUX_BURST = 4000.0
+MUX_IP_RATE = 4000.0
+MUX_IP_BURST = 8000.0
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def consume(self, cost=1.0, now=None):
+        now = now or time.monotonic()
+        tokens = self.tokens + (now - self.updated) * self.rate
+        if tokens > self.capacity:
+            tokens = self.capacity
+        self.updated = now
+        if tokens >= cost:
+            self.tokens = tokens - cost
+            return True
+        self.tokens = tokens
+        return False
+
+
+class RateLimiter:
+    def __init__(self, ip_rate=IP_RATE, ip_burst=IP_BURST):
+        self.ip_rate = ip_rate
+        self.ip_burst = ip_burst
+        self._ip_buckets = {} # ip -> [TokenBucket, Lock]
+        self._lock = threading.Lock() # バケットの作成と掃除のときだけ使う
+        self._last_prune = time.monotonic()
+
+    def _ip_entry(self, ip):
+        entry = self._ip_buckets.get(ip)
+        if entry is None:
+            with self._lock:
+                entry = self._ip_buckets.get(ip)
+                if entry is None:
+                    entry = [TokenBucket(self.ip_rate, self.ip_burst), threading.Lock()]
+                    self._ip_buckets[ip] = entry
+        return entry
+
+    def consume_ip(self, ip, cost=1.0, now=None):
+        now = now or time.monotonic()
+        bucket, lock = self._ip_entry(ip)
+        with lock: # 同じIPの複数接続が同時に更新するため
+            allowed = bucket.consume(cost, now)
+        if now - self._last_prune > IP_IDLE_EXPIRE:
+            self._prune(now)
+        return allowed
+
+    def _prune(self, now):
+        with self._lock:
+            self._last_prune = now
+            for ip in [ip for ip, (bucket, _) in self._ip_buckets.items() if now - bucket.updated > IP_IDLE_EXPIRE]:
+                del self._ip_buckets[ip]
+
+    def guard(self, ip):
+        return ConnectionGuard(ip, self)
+
+
+class ConnectionGuard:
+    # 1接続分の状態。on_message は受信スレッドだけが呼ぶ。penalize はセッションのスレッドからも呼ばれるが、
+    # 違反点が多少ずれても判定が1メッセージ遅れる程度なのでロックは取らない
+    def __init__(self, ip, limiter, rate=CONN_RATE, burst=CONN_BURST):
+        self.ip = ip
+        self.limiter = limiter
+        self.bucket = TokenBucket(rate, burst)
+        self.strikes = 0.0
+        self.strikes_updated = time.monotonic()
+
+    def _decay(self, now):
+        self.strikes = max(0.0, self.strikes - (now - self.strikes_updated) * STRIKE_DECAY)
+        self.strikes_updated = now
+
+    def _action(self, now, over_limit):
+        self._decay(now)
+        if self.strikes >= DISCONNECT_STRIKES:
+            return DISCONNECT
+        if over_limit or self.strikes >= DELAY_STRIKES: # 流量は守っていても違反点が多ければ罰則を続ける
+            return DELAY
+        return ALLOW
+
+    def on_message(self, nbytes):
+        # 受信したメッセージの扱いを判定する。DELAY なら呼び出し側は PENALTY_DELAY 秒待ってから処理する
+        now = time.monotonic()
+        cost = 1.0 + nbytes / 1024.0
+        if self.bucket.consume(cost, now) and self.limiter.consume_ip(self.ip, cost, now):
+            if not self.strikes:
+                return ALLOW
+            return self._action(now, False)
+        self.strikes += 1.0
+        return self._action(now, True)
+
+    def penalize(self, weight=MALFORMED_PENALTY):
+        # 不正な入力を受け取ったときに呼ぶ。対応は次のメッセージ受信時の on_message で決まる
+        self._decay(time.monotonic())
+        self.strikes += weight
@@ -1,6 +1,7 @@
 import socket
 import threading
 import json
+import othello_rules
 
 PORT = 8080
 
@@ -23,63 +24,21 @@ class OthelloGame:
         self.board[center - 1][center] = "black"
         self.board[center][center - 1] = "black"
 
+    # ルールの判定は othello_rules (全クライアント・サーバー共通) に任せる
     def is_valid_move(self, row, col, color):
-        # すでに駒がある場合は False
-        if self.board[row][col] is not None:
-            return False
-        # 8方向を探索して挟めるか確認
-        directions = [(0,1),(1,0),(0,-1),(-1,0),(1,1),(-1,-1),(1,-1),(-1,1)]
-        for dr, dc in directions:
-            if self._check_direction(row, col, dr, dc, color):
-                return True
-        return False
-
-    def _check_direction(self, r, c, dr, dc, color):
-        # 指定方向に相手色の石を挟んで自色に届くか
-        opponent = "white" if color == "black" else "black"
-        r += dr; c += dc
-        # 盤外は False
-        if not (0 <= r < self.board_size and 0 <= c < self.board_size):
-            return False
-        # 最初に隣接するのが相手色でなければ False
-        if self.board[r][c] != opponent:
-            return False
-        # さらに進んで自色に到達すれば True
-        while 0 <= r < self.board_size and 0 <= c < self.board_size:
-            if self.board[r][c] is None:
-                return False
-            if self.board[r][c] == color:
-                return True
-            r += dr; c += dc
-        return False
+        return othello_rules.is_valid_move(self.board, row, col, color)
 
     def place_and_flip(self, row, col, color):
         # 駒を置いて、挟める方向の石をひっくり返す
-        self.board[row][col] = color
-        directions = [(0,1),(1,0),(0,-1),(-1,0),(1,1),(-1,-1),(1,-1),(-1,1)]
-        for dr, dc in directions:
-            if self._check_direction(row, col, dr, dc, color):
-                self._flip_direction(row, col, dr, dc, color)
-
-    def _flip_direction(self, r, c, dr, dc, color):
-        # 指定方向に沿って相手色を自色にひっくり返す
-        opponent = "white" if color == "black" else "black"
-        r += dr; c += dc
-        while self.board[r][c] == opponent:
-            self.board[r][c] = color
-            r += dr; c += dc
+        othello_rules.place_and_flip(self.board, row, col, color)
 
     def any_valid(self, color):
         # 次のプレイヤーに合法手が存在するか
-        for r in range(self.board_size):
-            for c in range(self.board_size):
-                if self.is_valid_move(r, c, color):
-                    return True
-        return False
+        return othello_rules.legal_mask(self.board, color) != 0
 
     def full(self):
         # 盤面がすべて埋まっているか
-        return all(cell is not None for row in self.board for cell in row)
+        return othello_rules.is_full(self.board)
 
 class GameSession:
     def __init__(self, clients, colors):
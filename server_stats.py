@@ -0,0 +1,237 @@
+import socket
+import threading
+import json
+import time
+
+# サーバー稼働状況の統計と管理用エンドポイント
+# カウンタはスレッドごとのセル(シャード)に書き込むので、ゲームスレッドはロックを取らない。
+# 読み出し側はセルを合計するだけなので、統計の問い合わせがゲーム処理を止めることはない。
+
+ADMIN_HOST = "127.0.0.1" # 管理用ポートはローカルからのみ受け付ける
+ADMIN_PORT = 8081
+RATE_SAMPLE_INTERVAL = 1.0 # 毎秒のメッセージ数・バイト数を更新する間隔(秒)
+
+
+class ShardedCounter:
+    def __init__(self):
+        self._local = threading.local()
+        self._cells = [] # 全スレッドのセル [値] のリスト
+        self._register_lock = threading.Lock() # セル登録時(スレッドごとに初回のみ)だけ使う
+
+    def _cell(self):
+        cell = getattr(self._local, "cell", None)
+        if cell is None:
+            cell = [0]
+            with self._register_lock:
+                self._cells.append(cell)
+            self._local.cell = cell
+        return cell
+
+    def add(self, n=1):
+        # 自スレッドのセルにしか書き込まないのでロック不要
+        self._cell()[0] += n
+
+    def value(self):
+        return sum(cell[0] for cell in list(self._cells))
+
+
+class LatencyHistogram:
+    # 2のべき乗(マイクロ秒)のバケットを持つヒストグラム。バケットもスレッドごとにシャードする
+    NUM_BUCKETS = 24 # 1us 〜 約8秒
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._register_lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = [0] * (self.NUM_BUCKETS + 2) # バケット + [件数合計, 合計マイクロ秒]
+            with self._register_lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+        return shard
+
+    def observe(self, seconds):
+        micros = int(seconds * 1_000_000)
+        bucket = min(max(micros, 1).bit_length() - 1, self.NUM_BUCKETS - 1)
+        shard = self._shard()
+        shard[bucket] += 1
+        shard[self.NUM_BUCKETS] += 1
+        shard[self.NUM_BUCKETS + 1] += micros
+
+    def snapshot(self):
+        totals = [0] * (self.NUM_BUCKETS + 2)
+        for shard in list(self._shards):
+            for i, v in enumerate(list(shard)):
+                totals[i] += v
+        count = totals[self.NUM_BUCKETS]
+        buckets = {f"<{1 << (i + 1)}us": totals[i] for i in range(self.NUM_BUCKETS) if totals[i]}
+        return {
+            "count": count,
+            "avg_us": (totals[self.NUM_BUCKETS + 1] / count) if count else 0.0,
+            "p50_us": self._percentile(totals, count, 0.50),
+            "p99_us": self._percentile(totals, count, 0.99),
+            "buckets": buckets,
+        }
+
+    def _percentile(self, totals, count, q):
+        if not count:
+            return 0
+        target = count * q
+        seen = 0
+        for i in range(self.NUM_BUCKETS):
+            seen += totals[i]
+            if seen >= target:
+                return 1 << (i + 1) # バケット上限を返す
+        return 1 << self.NUM_BUCKETS
+
+
+class ServerStats:
+    def __init__(self):
+        self.started_at = time.time()
+        self.messages_in = ShardedCounter()
+        self.messages_out = ShardedCounter()
+        self.bytes_in = ShardedCounter()
+        self.bytes_out = ShardedCounter()
+        self.moves = ShardedCounter()
+        self.rate_limited = ShardedCounter() # 流量制限で遅延・切断したメッセージ数
+        self.histograms = {
+            "move": LatencyHistogram(),      # 手の受信からブロードキャスト完了まで
+            "broadcast": LatencyHistogram(), # broadcast_state 1回分
+        }
+        self._rate_lock = threading.Lock() # 管理スレッド側だけが使う
+        self._last_sample = (time.monotonic(), self._totals())
+        self._rates = {"messages_per_sec": 0.0, "bytes_per_sec": 0.0}
+
+    def record_in(self, nbytes):
+        self.messages_in.add()
+        self.bytes_in.add(nbytes)
+
+    def record_out(self, nbytes, count=1):
+        self.messages_out.add(count)
+        self.bytes_out.add(nbytes * count)
+
+    def _totals(self):
+        return (self.messages_in.value() + self.messages_out.value(),
+                self.bytes_in.value() + self.bytes_out.value())
+
+    def sample_rates(self):
+        # 管理スレッドから定期的に呼び出し、前回との差分から毎秒の値を求める
+        with self._rate_lock:
+            now = time.monotonic()
+            totals = self._totals()
+            last_time, last_totals = self._last_sample
+            elapsed = now - last_time
+            if elapsed > 0:
+                self._rates = {
+                    "messages_per_sec": (totals[0] - last_totals[0]) / elapsed,
+                    "bytes_per_sec": (totals[1] - last_totals[1]) / elapsed,
+                }
+            self._last_sample = (now, totals)
+
+    def snapshot(self, gauges=None):
+        with self._rate_lock:
+            rates = dict(self._rates)
+        data = {
+            "uptime_sec": round(time.time() - self.started_at, 1),
+            "threads": threading.active_count(),
+            "messages_in": self.messages_in.value(),
+            "messages_out": self.messages_out.value(),
+            "bytes_in": self.bytes_in.value(),
+            "bytes_out": self.bytes_out.value(),
+            "moves": self.moves.value(),
+            "rate_limited": self.rate_limited.value(),
+            "latency": {name: h.snapshot() for name, h in self.histograms.items()},
+        }
+        data.update(rates)
+        if gauges:
+            data.update(gauges())
+        return data
+
+
+STATS = ServerStats()
+
+
+class AdminServer:
+    # 1行のコマンド ("stats" など) を受け取り、JSONを1つ返して切断する簡易プロトコル
+    def __init__(self, gauges, host=ADMIN_HOST, port=ADMIN_PORT, stats=STATS):
+        self.gauges = gauges # 現在のセッション数などを返す関数 (ロックを取らずに読むこと)
+        self.stats = stats
+        self.address = (host, port)
+        self.sock = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(self.address)
+        self.sock.listen()
+        self.sock.settimeout(RATE_SAMPLE_INTERVAL) # 問い合わせがなくても、この間隔でレートを更新する
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def _serve(self):
+        next_sample = time.monotonic() + RATE_SAMPLE_INTERVAL
+        while not self.stop_event.is_set():
+            try:
+                conn, _ = self.sock.accept()
+            except socket.timeout:
+                conn = None
+            except OSError:
+                break
+            # 問い合わせが1秒より短い間隔で続くとタイムアウトしないので、期限で判定する
+            now = time.monotonic()
+            if now >= next_sample:
+                self.stats.sample_rates()
+                next_sample = now + RATE_SAMPLE_INTERVAL
+            if conn is None:
+                continue
+            try:
+                self._handle(conn)
+            except Exception:
+                pass
+            finally:
+                try: conn.close()
+                except Exception: pass
+
+    def _handle(self, conn):
+        conn.settimeout(2.0)
+        try:
+            command = conn.recv(256).decode(errors="ignore").strip() or "stats"
+        except socket.timeout:
+            command = "stats"
+        if command == "stats":
+            reply = self.stats.snapshot(self.gauges)
+        else:
+            reply = {"error": f"unknown command: {command}"}
+        conn.sendall((json.dumps(reply) + "\n").encode())
+
+    def stop(self):
+        self.stop_event.set()
+        if self.sock:
+            try: self.sock.close()
+            except Exception: pass
+
+
+def query_stats(host=ADMIN_HOST, port=ADMIN_PORT, command="stats"):
+    with socket.create_connection((host, port), timeout=5.0) as s:
+        s.sendall((command + "\n").encode())
+        chunks = []
+        while True:
+            chunk = s.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return json.loads(b"".join(chunks).decode())
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Othello server stats")
+    parser.add_argument("-s", "--server", default=ADMIN_HOST, help="Admin host")
+    parser.add_argument("-p", "--port", type=int, default=ADMIN_PORT, help="Admin port")
+    args = parser.parse_args()
+    print(json.dumps(query_stats(args.server, args.port), indent=2, ensure_ascii=False))
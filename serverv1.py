@@ -2,12 +2,60 @@ import socket
 import threading
 import json
 import time # タイムアウトや遅延のため
+import secrets # 再接続用の席トークン
+import signal
+import os
+import sys
+import queue
+from server_stats import STATS, AdminServer
+from async_log import AsyncLogger, DEBUG, INFO, WARNING, ERROR
+import game_record
+import session_checkpoint
+import rate_limit
+import net_io
+import worker_pool
+import othello_rules
 
 PORT = 8080
+GAME_RECORD_DIR = "game_records" # 対局記録セグメントの保存先
+SNAPSHOT_INTERVAL = 8 # 途中参加の観戦者向けに、この手数ごとに盤面のスナップショットを取る
+CHECKPOINT_INTERVAL = 2.0 # 進行中セッションのチェックポイント間隔(秒)
+RESUME_TIMEOUT = 60.0 # 再起動後、この秒数以内に両プレイヤーが戻らなければセッションを終了する
 SERVER_SHUTDOWN_EVENT = threading.Event() # サーバーシャットダウン用
+RATE_LIMITER = rate_limit.RateLimiter() # IPごとのバケットは全接続で共有する
+SESSION_POOL = worker_pool.WorkerPool() # セッションの処理を分担するワーカー (既定は CPU コア数)
+MUX_RATE_LIMITER = rate_limit.RateLimiter(rate_limit.MUX_IP_RATE, rate_limit.MUX_IP_BURST) # 多重化接続用
+MULTIPLEX_TOKEN = os.environ.get("OTHELLO_BOT_TOKEN") # 設定されていれば多重化接続にこのトークンを要求する
+MAX_PLAYER_ID_BYTES = 64 # ハンドシェイクで名乗るプレイヤーID・ボットIDの上限 (対局記録のメタデータ長は u16 に収める)
 
-def log(*args):
-    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}]", *args)
+LOGGER = AsyncLogger(level=INFO) # 出力はバックグラウンドスレッドでまとめて行う
+
+def log(*args, level=INFO):
+    LOGGER.log(level, *args)
+
+def encode_board(board):
+    # 盤面を64文字の文字列にする ("b"=黒, "w"=白, "."=空き)
+    return "".join("b" if cell == "black" else "w" if cell == "white" else "." for row in board for cell in row)
+
+def clean_player_id(value):
+    # ハンドシェイクで名乗ったIDを対局記録に残せる形にする (空なら None、長すぎれば切り詰める)
+    if value is None:
+        return None
+    value = str(value).encode()[:MAX_PLAYER_ID_BYTES].decode(errors="ignore").strip()
+    return value or None
+
+def player_label(conn):
+    # 対局記録に残すプレイヤーID (多重化チャンネルはボットID、それ以外はハンドシェイクで名乗ったID)。
+    # 名乗らなかったプレイヤーは None (接続元のアドレスとポートは接続ごとに変わり、同じ人の対局を束ねられないため)
+    return getattr(conn, "player_id", None)
+
+def valid_coordinates(x, y, board_size=8):
+    # 手の座標は盤内の整数だけを受け付ける (bool・小数・リストなどは不正な入力)
+    return type(x) is int and type(y) is int and 0 <= x < board_size and 0 <= y < board_size
+
+def encode_move(row, col, color):
+    # 1手を3文字で表す (例: 黒がf5に打った → "Bf5")
+    return ("B" if color == "black" else "W") + chr(ord("a") + col) + str(row + 1)
 
 class OthelloGame:
     def __init__(self, board_size=8):
@@ -27,112 +75,337 @@ class OthelloGame:
         self.case = "CONTINUE"
         self.message = ""
 
+    # ルールの判定は othello_rules に任せる
     def is_valid_move(self, row, col, color):
-        if not (0 <= row < self.board_size and 0 <= col < self.board_size):
-            return False
-        if self.board[row][col] is not None:
-            return False
-        directions = [(0,1),(1,0),(0,-1),(-1,0),(1,1),(-1,-1),(1,-1),(-1,1)]
-        for dr, dc in directions:
-            if self._check_direction(row, col, dr, dc, color):
-                return True
-        return False
-
-    def _check_direction(self, r_start, c_start, dr, dc, color):
-        opponent = "white" if color == "black" else "black"
-        r, c = r_start + dr, c_start + dc
-        if not (0 <= r < self.board_size and 0 <= c < self.board_size and self.board[r][c] == opponent):
-            return False
-        r += dr; c += dc
-        while 0 <= r < self.board_size and 0 <= c < self.board_size:
-            if self.board[r][c] is None:
-                return False
-            if self.board[r][c] == color:
-                return True
-            r += dr; c += dc
-        return False
+        return othello_rules.is_valid_move(self.board, row, col, color)
 
     def place_and_flip(self, row, col, color):
-        if not self.is_valid_move(row, col, color): # 事前チェックは行うべき
-            log(f"Warning: place_and_flip called with invalid move ({row},{col}) for {color}")
-            return False # 不正な手なら何もしない
-
-        self.board[row][col] = color
-        directions = [(0,1),(1,0),(0,-1),(-1,0),(1,1),(-1,-1),(1,-1),(-1,1)]
-        flipped_any = False
-        for dr, dc in directions:
-            if self._check_direction(row, col, dr, dc, color):
-                self._flip_direction(row, col, dr, dc, color)
-                flipped_any = True
-        return flipped_any # 実際に反転が起きたか (is_valid_moveがTrueなら通常True)
-
-    def _flip_direction(self, r_start, c_start, dr, dc, color):
-        opponent = "white" if color == "black" else "black"
-        r, c = r_start + dr, c_start + dc
-        while 0 <= r < self.board_size and 0 <= c < self.board_size and self.board[r][c] == opponent:
-            self.board[r][c] = color
-            r += dr; c += dc
+        if not othello_rules.place_and_flip(self.board, row, col, color): # 不正な手なら何もしない
+            log(f"place_and_flip called with invalid move ({row},{col}) for {color}", level=WARNING)
+            return False
+        return True
+
+    def valid_moves_mask(self, color):
+        # 合法手をビットマスクで返す (ビット位置 = row * board_size + col)
+        return othello_rules.legal_mask(self.board, color)
 
     def any_valid_moves(self, color):
-        for r in range(self.board_size):
-            for c in range(self.board_size):
-                if self.is_valid_move(r, c, color):
-                    return True
-        return False
+        return othello_rules.legal_mask(self.board, color) != 0
 
     def is_full(self):
-        return all(cell is not None for row in self.board for cell in row)
-    
+        return othello_rules.is_full(self.board)
+
+    def count_discs(self):
+        return othello_rules.count_discs(self.board)
+
+STATE_ENCODERS = {
+    "json": lambda data: json.dumps(data).encode(),
+}
+
+class VersionedState:
+    # セッション状態の版番号と、版ごとのエンコード済みペイロードのキャッシュ
+    # 状態を変えたら必ず bump() し、次に要求されたときに1度だけエンコードし直す
+    def __init__(self):
+        self.version = 0
+        self._encoded = {} # (種類, エンコーディング) -> bytes
+
+    def bump(self):
+        self.version += 1
+        self._encoded.clear()
+
+    def encoded(self, key, build, encoding="json"):
+        cache_key = (key, encoding)
+        payload = self._encoded.get(cache_key)
+        if payload is None:
+            payload = STATE_ENCODERS[encoding](build())
+            self._encoded[cache_key] = payload
+        return payload
+
 class GameSession:
-    def __init__(self, clients, colors, initial_spectators):
+    # セッションの状態 (盤面・プレイヤー・観戦者) は割り当てられたワーカースレッドだけが触る。
+    # 手・観戦者の追加・切断・タイマーなどはすべてワーカーへのメッセージとして渡し、到着順に1つずつ処理する。
+    # そのため状態を守るロックはなく、受信スレッドや管理スレッドが対局処理を待たされることもない。
+    def __init__(self, clients, colors, initial_spectators, seat_tokens=None, start=True):
+        self._init_fields(clients, colors, seat_tokens)
+        self.session_id = game_recorder.new_session_id() if game_recorder else 0
+
+        log(f"Starting new game session {self.session_id} between {self.clients[0].getpeername()} ({colors[0]}) and {self.clients[1].getpeername()} ({colors[1]})")
+        self.game.initialize_board()
+        self.legal_mask = self.game.valid_moves_mask(self.game.turn)
+        self.snapshots.append((0, encode_board(self.game.board), self.game.turn))
+        if game_recorder:
+            players = {color: player_label(conn) for conn, color in zip(self.clients, self.colors)}
+            game_recorder.record_start(self.session_id, players)
+
+        for idx, conn in enumerate(self.clients):
+            if isinstance(conn, net_io.Channel):
+                conn.bind(self, idx)
+
+        # 初期観戦者を追加 (初期盤面は最初のbroadcastで送る)
+        self.current_spectators.extend(initial_spectators)
+
+        if start:
+            self.start()
+
+    def start(self):
+        self._post(self._on_start)
+
+    def _on_start(self):
+        self.broadcast_state() # 初期盤面と手番を送信
+        self._start_player_threads()
+
+    def _init_fields(self, clients, colors, seat_tokens):
         self.clients = clients  # [conn1, conn2] (プレイヤー)
         self.colors = colors    # ["black", "white"]
         self.game = OthelloGame()
-        self.lock = threading.Lock()
+        self.worker = SESSION_POOL.assign() # このセッションのメッセージを処理するワーカー
+        self.inbox_lock = threading.Lock() # 受付を閉じる瞬間と投函が競合しないようにするためだけに使う
+        self.inbox_closed = False
+        self.stopping = False # True になったら以降のメッセージを受け付けない
+        self.stopped = threading.Event()
         self.current_spectators = [] # このゲームセッションの観戦者ソケットリスト
         self.player_threads = []
         self.session_active = True
+        self.ply = 0 # 打たれた手の数
+        self.end_recorded = False
+        self.move_history = [] # encode_move 形式の手順
+        self.snapshots = [] # [(ply, 盤面文字列, 手番)] ply の昇順
+        self.seat_tokens = seat_tokens or [secrets.token_hex(8) for _ in colors] # 再接続時に席を特定するトークン
+        self.clock = {color: 0.0 for color in colors} # 各色の消費時間(秒)
+        self.turn_started = time.monotonic()
+        self.started_at = time.time()
+        self.state = VersionedState() # 盤面が変わるたびに版を上げる (ペイロードのキャッシュとチェックポイントの要否判定用)
+        self.legal_mask = 0 # 手番側の合法手 (パス判定のついでに求めたものをクライアントへ送る)
+
+    # ---------- メッセージ処理 ----------
+    def _post(self, handler, *args):
+        # どのスレッドからでも呼べる。セッションが終了していれば False
+        with self.inbox_lock:
+            if self.inbox_closed:
+                return False
+            self.worker.submit(self._dispatch, handler, args)
+        return True
 
-        log(f"Starting new game session between {self.clients[0].getpeername()} ({colors[0]}) and {self.clients[1].getpeername()} ({colors[1]})")
-        self.game.initialize_board()
-
-        # 初期観戦者を追加
-        for spec_conn in initial_spectators:
-            self.add_spectator(spec_conn, send_initial_state=False) # 初期盤面は最初のbroadcastで送る
-
-        self.broadcast_state() # 初期盤面と手番を送信
+    def _dispatch(self, handler, args):
+        # ワーカースレッドで実行される
+        try:
+            handler(*args)
+        except Exception as e:
+            import traceback
+            log(f"Unexpected error in game session {self.session_id} ({handler.__name__}): {e}\n{traceback.format_exc()}", level=ERROR)
+        if self.stopping and not self.inbox_closed:
+            # 以降の投函は断る。閉じる前に届いていた分はこのあと処理される (session_active が False なので後始末だけになる)
+            with self.inbox_lock:
+                self.inbox_closed = True
+            self.stopped.set()
+
+    def call(self, fn, timeout=2.0):
+        # fn をセッションのスレッドで実行して結果を返す。終了済みや応答がない場合は None
+        reply = queue.SimpleQueue()
+        if not self._post(lambda: reply.put(fn())):
+            return None
+        try:
+            return reply.get(timeout=timeout)
+        except queue.Empty:
+            return None
 
+    def _start_player_threads(self):
+        self.turn_started = time.monotonic()
         for idx, conn in enumerate(self.clients):
+            if isinstance(conn, net_io.Channel):
+                continue # 多重化チャンネルの入力は接続ごとの受信スレッドが handle_player_message へ渡す
             thread = threading.Thread(target=self.handle_player, args=(conn, idx), daemon=True)
             self.player_threads.append(thread)
             thread.start()
 
-    def add_spectator(self, spectator_conn, send_initial_state=True):
-        with self.lock:
-            if spectator_conn not in self.current_spectators and self.session_active:
-                self.current_spectators.append(spectator_conn)
-                log(f"Spectator {spectator_conn.getpeername()} added to game session.")
-                if send_initial_state:
-                    try:
-                        current_state = {
-                            "board": self.game.board,
-                            "turn": self.game.turn,
-                            "case": self.game.case, # 通常は "CONTINUE"
-                            "message": "Spectating ongoing game.",
-                            "type": "initial_spectate"
-                        }
-                        spectator_conn.sendall(json.dumps(current_state).encode())
-                    except Exception as e:
-                        log(f"Error sending initial state to new spectator {spectator_conn.getpeername()}: {e}")
-                        self._remove_spectator_socket(spectator_conn) # 送信失敗したらリストから除く
-            elif not self.session_active:
-                log(f"Game session is not active. Cannot add spectator {spectator_conn.getpeername()}.")
-                try: spectator_conn.close() # セッション非アクティブなら観戦不可
-                except: pass
+    # ---------- チェックポイントと再開 ----------
+    def checkpoint_state(self):
+        return self.call(self._checkpoint_state)
 
+    def _checkpoint_state(self):
+        if not self.session_active:
+            return None
+        black, white = session_checkpoint.board_to_masks(self.game.board)
+        clock = dict(self.clock)
+        if self.game.turn in clock: # 手番側の考慮中の時間も含める
+            clock[self.game.turn] += time.monotonic() - self.turn_started
+        return {
+            "session_id": self.session_id,
+            "colors": self.colors,
+            "black": black,
+            "white": white,
+            "turn": self.game.turn,
+            "case": self.game.case,
+            "message": self.game.message,
+            "ply": self.ply,
+            "moves": "".join(self.move_history),
+            "seat_tokens": self.seat_tokens,
+            "clock": {color: round(t, 3) for color, t in clock.items()},
+            "started_at": self.started_at,
+        }
+
+    @classmethod
+    def restore(cls, state):
+        # チェックポイントから復元する。プレイヤーが attach_player で戻るまで対局は再開しない
+        self = cls.__new__(cls)
+        self._init_fields([None] * len(state["colors"]), state["colors"], state["seat_tokens"])
+        self.session_id = state["session_id"]
+        self.game.board = session_checkpoint.masks_to_board(state["black"], state["white"])
+        self.game.turn = state["turn"]
+        self.game.case = state["case"]
+        self.game.message = state["message"]
+        self.ply = state["ply"]
+        self.clock.update(state.get("clock", {}))
+        self.started_at = state.get("started_at", self.started_at)
+        moves = state.get("moves", "")
+        self.move_history = [moves[i:i + 3] for i in range(0, len(moves), 3)]
+        self._rebuild_snapshots()
+        self.legal_mask = self.game.valid_moves_mask(self.game.turn)
+        if game_recorder: # チェックポイント後・停止前に記録された手は、再開後の手で置き換わる
+            game_recorder.record_restart(self.session_id, self.ply)
+        self.resume_timer = threading.Timer(RESUME_TIMEOUT, self._post, args=(self._on_resume_timeout,))
+        self.resume_timer.daemon = True
+        self.resume_timer.start()
+        log(f"Restored game session {self.session_id} at ply {self.ply}. Waiting for players to reconnect.")
+        return self
+
+    def _rebuild_snapshots(self):
+        replay = OthelloGame()
+        replay.initialize_board()
+        self.snapshots = [(0, encode_board(replay.board), replay.turn)]
+        for ply, move in enumerate(self.move_history, start=1):
+            row, col, color = session_checkpoint.decode_move(move)
+            replay.place_and_flip(row, col, color)
+            opponent = "white" if color == "black" else "black"
+            replay.turn = opponent if replay.any_valid_moves(opponent) else color
+            if ply % SNAPSHOT_INTERVAL == 0:
+                self.snapshots.append((ply, encode_board(replay.board), replay.turn))
+
+    def attach_player(self, conn, seat_token):
+        # 再接続したプレイヤーを元の席に戻す。席に戻れなかった場合は接続側に resume_failed を返して閉じる
+        if not self._post(self._on_attach, conn, seat_token):
+            _reject_resume(conn)
+
+    def _on_attach(self, conn, seat_token):
+        if not self.session_active or seat_token not in self.seat_tokens or self.clients[self.seat_tokens.index(seat_token)] is not None:
+            _reject_resume(conn)
+            return
+        idx = self.seat_tokens.index(seat_token)
+        self.clients[idx] = conn
+        if isinstance(conn, net_io.Channel):
+            conn.bind(self, idx)
+        color = self.colors[idx]
+        log(f"Player {color} ({conn.getpeername()}) resumed game session {self.session_id}.")
+        conn.send(json.dumps({"status": "resumed", "player_color": color, "session_id": self.session_id}).encode())
+        if all(c is not None for c in self.clients): # 全員そろったら対局を再開する
+            self.resume_timer.cancel()
+            self.broadcast_state()
+            self._start_player_threads()
+
+    def _on_resume_timeout(self):
+        if not self.session_active or all(c is not None for c in self.clients):
+            return
+        self.game.case = "FORCED_TERMINATION"
+        self.game.message = "Players did not reconnect after server restart."
+        self.state.bump()
+        log(f"Game session {self.session_id} ended: players did not reconnect within {RESUME_TIMEOUT}s.")
+        self.clients = [c for c in self.clients if c is not None]
+        self.broadcast_state() # 戻ってきた側に最終状態を送り、セッションを終える
+
+    def suspend(self):
+        # サーバー停止時: 終了記録は残さずに接続だけを閉じる (再起動後に再開するため)
+        if self._post(self._on_suspend):
+            self.stopped.wait(timeout=2.0)
+
+    def _on_suspend(self):
+        self.session_active = False
+        log(f"Suspending game session {self.session_id} at ply {self.ply}.")
+        for c in self.clients + self.current_spectators:
+            if c is None: continue
+            try: c.close()
+            except Exception: pass
+        self.clients.clear()
+        self.current_spectators.clear()
+        with lobby_lock:
+            game_sessions.discard(self)
+        self.stopping = True
+
+    def add_spectator(self, spectator_conn, send_initial_state=True, from_ply=None):
+        if not self._post(self._on_add_spectator, spectator_conn, send_initial_state, from_ply):
+            self._on_add_spectator(spectator_conn, send_initial_state, from_ply) # 終了済みなので閉じるだけ
+
+    def _on_add_spectator(self, spectator_conn, send_initial_state, from_ply):
+        if spectator_conn not in self.current_spectators and self.session_active:
+            self.current_spectators.append(spectator_conn)
+            log(f"Spectator {spectator_conn.getpeername()} added to game session.")
+            if send_initial_state:
+                try:
+                    payload = self._spectate_payload(from_ply)
+                    spectator_conn.send(payload)
+                    STATS.record_out(len(payload))
+                except Exception as e:
+                    log(f"Error sending initial state to new spectator {spectator_conn.getpeername()}: {e}")
+                    self._remove_spectator_socket(spectator_conn) # 送信失敗したらリストから除く
+        elif not self.session_active:
+            log(f"Game session is not active. Cannot add spectator {spectator_conn.getpeername()}.")
+            try: spectator_conn.close() # セッション非アクティブなら観戦不可
+            except: pass
+
+    def _state_payload(self):
+        return self.state.encoded("state", lambda: {
+            "board": self.game.board,
+            "turn": self.game.turn,
+            "case": self.game.case,
+            "message": self.game.message,
+            "legal": self._current_legal_mask(),
+        })
+
+    def _spectate_payload(self, from_ply=None):
+        def build():
+            current_state = {
+                "board": self.game.board,
+                "turn": self.game.turn,
+                "case": self.game.case, # 通常は "CONTINUE"
+                "message": "Spectating ongoing game.",
+                "legal": self._current_legal_mask(),
+                "type": "initial_spectate"
+            }
+            if from_ply is not None: # 途中参加: 指定手数以前の最寄りのスナップショットと以降の手順を付ける
+                current_state.update(self._catchup(from_ply))
+                current_state["type"] = "catchup"
+            return current_state
+        key = "spectate" if from_ply is None else ("catchup", self._snapshot_for(from_ply)[0])
+        return self.state.encoded(key, build)
+
+    def _error_payload(self, y, x):
+        return self.state.encoded(("error", y, x), lambda: {
+            "board": self.game.board, "turn": self.game.turn, "case": "ERROR",
+            "legal": self._current_legal_mask(),
+            "message": f"Invalid move at ({y},{x}). Try again."
+        })
+
+    def _current_legal_mask(self):
+        # 対局が終わっていれば合法手はない
+        return self.legal_mask if self.game.case in ("CONTINUE", "PASS") else 0
+
+    def _snapshot_for(self, from_ply):
+        from_ply = max(0, min(int(from_ply), self.ply))
+        snapshot = self.snapshots[0]
+        for candidate in self.snapshots:
+            if candidate[0] > from_ply:
+                break
+            snapshot = candidate
+        return snapshot
+
+    def _catchup(self, from_ply):
+        snapshot_ply, board_str, turn = self._snapshot_for(from_ply)
+        return {
+            "snapshot": {"ply": snapshot_ply, "board": board_str, "turn": turn},
+            "moves": "".join(self.move_history[snapshot_ply:]), # snapshot_ply+1 手目から現在まで
+            "ply": self.ply,
+        }
 
     def _remove_spectator_socket(self, spectator_conn):
-        #ロックは呼び出し元で取得想定
         if spectator_conn in self.current_spectators:
             self.current_spectators.remove(spectator_conn)
             log(f"Spectator {spectator_conn.getpeername()} removed from session.")
@@ -142,211 +415,316 @@ class GameSession:
             pass
 
     def broadcast_state(self):
+        #セッションのスレッドから呼ぶ
         if not self.session_active:
             return
 
-        with self.lock: # gameオブジェクトへのアクセスを保護
-            data = {
-                "board": self.game.board,
-                "turn": self.game.turn,
-                "case": self.game.case,
-                "message": self.game.message
-            }
-        payload = json.dumps(data).encode()
+        started = time.perf_counter()
+        payload = self._state_payload()
+        frame = net_io.make_frame(payload) # ヘッダとペイロードは全員で共有し、コピーしない
 
-        active_clients_after_broadcast = []
         for c in self.clients:
             try:
-                c.sendall(payload)
-                active_clients_after_broadcast.append(c)
+                c.send_frame(frame)
+                STATS.record_out(len(payload))
             except Exception as e:
                 log(f"Error sending state to player {c.getpeername()}: {e}. Player will be marked for removal.")
-                # 実際の削除は handle_player の切断検知に任せるか、ここで能動的に行う
-                # ここで削除すると、handle_player内での処理と競合する可能性
-        # self.clients = active_clients_after_broadcast # ここでリストを更新すると問題が起きやすい
+                # 削除は handle_player の切断検知 (notify_disconnection のメッセージ) に任せる
 
-        current_spectators_copy = list(self.current_spectators) # イテレーション中の変更を避ける
-        for s_conn in current_spectators_copy:
+        for s_conn in list(self.current_spectators): # イテレーション中の変更を避ける
             try:
-                s_conn.sendall(payload)
+                s_conn.send_frame(frame)
+                STATS.record_out(len(payload))
             except Exception as e:
                 log(f"Error sending state to spectator {s_conn.getpeername()}: {e}. Removing spectator.")
-                with self.lock:
-                    self._remove_spectator_socket(s_conn)
+                self._remove_spectator_socket(s_conn)
+        STATS.histograms["broadcast"].observe(time.perf_counter() - started)
 
         if self.game.case in ["FINISH", "FORCED_TERMINATION"]:
             log(f"Game ended. Case: {self.game.case}. Message: {self.game.message}")
-            self.end_session()
+            self._end()
 
 
     def handle_player(self, conn, player_idx):
+        # プレイヤーごとの受信スレッド。受信したメッセージはセッションの inbox に渡すだけ
         player_color = self.colors[player_idx]
         log(f"Handler started for player {player_color} ({conn.getpeername()})")
+        guard = RATE_LIMITER.guard(conn.getpeername()[0])
 
         try:
             while self.session_active:
                 if SERVER_SHUTDOWN_EVENT.is_set(): break
                 try:
-                    raw = conn.recv(1024)
+                    raw = conn.recv()
                     if not raw:
                         log(f"Player {player_color} ({conn.getpeername()}) disconnected (received empty).")
                         self.notify_disconnection(conn, player_color)
                         return # スレッド終了
+                    received_at = time.perf_counter()
+                    STATS.record_in(len(raw))
+                    action = guard.on_message(len(raw))
+                    if action != rate_limit.ALLOW:
+                        STATS.rate_limited.add()
+                        if action == rate_limit.DISCONNECT:
+                            log(f"Player {player_color} ({conn.getpeername()}) exceeded rate limits. Disconnecting.", level=WARNING)
+                            self.notify_disconnection(conn, player_color, "Rate limit exceeded")
+                            return
+                        # DELAY: 受信を止めてTCPの流量制御で相手を待たせてから処理する (手は捨てない)
+                        time.sleep(rate_limit.PENALTY_DELAY)
                 except socket.timeout: # タイムアウト設定している場合
                     continue
-                except (socket.error, ConnectionResetError, BrokenPipeError) as e:
-                    log(f"Socket error with player {player_color} ({conn.getpeername()}): {e}. Player disconnected.")
-                    self.notify_disconnection(conn, player_color)
+                except (socket.error, ConnectionResetError, BrokenPipeError, net_io.FrameError) as e:
+                    if self.session_active:
+                        log(f"Socket error with player {player_color} ({conn.getpeername()}): {e}. Player disconnected.")
+                        self.notify_disconnection(conn, player_color)
                     return # スレッド終了
 
-                try:
-                    move = json.loads(raw.decode())
-                    # log(f"Received from {player_color}: {move}")
-                except json.JSONDecodeError:
-                    log(f"Invalid JSON from {player_color} ({conn.getpeername()}): {raw.decode()[:100]}")
-                    # 不正なデータなので接続を切るか、エラーを返すか。ここでは無視して次の入力を待つこともできるが危険。
-                    # self.notify_disconnection(conn, player_color, "Invalid data received")
-                    continue # 今回は次の入力を待つ形にするが、通常は切断推奨
-
-                # クライアントからの切断通知
-                if move.get("action") == "disconnect":
-                    log(f"Player {player_color} ({conn.getpeername()}) sent disconnect message.")
-                    self.notify_disconnection(conn, player_color, "Player initiated disconnect")
-                    return
-
-
-                # ゲームロジックはロック内で処理
-                with self.lock:
-                    if not self.session_active: return # セッションが終了していたら処理しない
-
-                    # 自分のターンか、正しい色が送られてきたか
-                    if move.get("turn") != player_color:
-                        log(f"Move from {player_color} but message turn is {move.get('turn')}. Ignoring.")
-                        # エラーをクライアントに返すことも検討
-                        # conn.sendall(json.dumps({"error": "Not your color in message"}).encode())
-                        continue
-                    if self.game.turn != player_color:
-                        log(f"Not {player_color}'s turn (game turn is {self.game.turn}). Ignoring move.")
-                        # conn.sendall(json.dumps({"error": "Not your turn"}).encode())
-                        continue
-
-                    x, y = move.get("x"), move.get("y")
-                    if x is None or y is None:
-                        log(f"Invalid move format from {player_color}: {move}")
-                        continue
-
-                    if self.game.is_valid_move(y, x, player_color):
-                        self.game.place_and_flip(y, x, player_color)
-                        next_player_color = "white" if player_color == "black" else "black"
-
-                        if self.game.any_valid_moves(next_player_color):
-                            self.game.turn = next_player_color
-                            self.game.case = "CONTINUE"
-                        elif self.game.any_valid_moves(player_color): # 相手に手がないが自分にはまだ手がある場合 (パス)
-                            self.game.turn = player_color # 手番は変わらず、相手がパスしたことになる
-                            self.game.case = "PASS"
-                            self.game.message = f"{next_player_color.capitalize()} has no moves and passes."
-                        else: # 両者ともに手がない、または盤面が埋まった
-                            self.game.case = "FINISH"
-                            self.game.message = "No valid moves for both players. Game over."
-                        
-                        if self.game.is_full() and self.game.case != "FINISH":
-                             self.game.case = "FINISH"
-                             self.game.message = "Board is full. Game over."
-
-                    else: # 不正な手
-                        log(f"Invalid move ({y},{x}) by {player_color}. Board not changed.")
-                        # 不正な手を打ったことをクライアントに通知しても良い
-                        error_data = {
-                            "board": self.game.board, "turn": self.game.turn, "case": "ERROR",
-                            "message": f"Invalid move at ({y},{x}). Try again."
-                        }
-                        try: conn.sendall(json.dumps(error_data).encode())
-                        except: pass
-                        continue # 盤面更新せずに次の入力を待つ
-
-                    self.game.message = "" # 通常のCONTINUEならメッセージはクリア
-                    if self.game.case == "PASS":
-                        self.game.message = f"{('White' if self.game.turn == 'black' else 'Black')} has no valid moves. Pass."
-
-
-                self.broadcast_state() # 状態変更後にブロードキャスト
-
-                if self.game.case in ["FINISH", "FORCED_TERMINATION"]:
-                    return # ゲーム終了なのでハンドラも終了
+                self.handle_player_message(conn, player_idx, raw, guard, received_at)
 
         except Exception as e:
-            log(f"Unexpected error in player handler for {player_color} ({conn.getpeername()}): {e}")
+            log(f"Unexpected error in player handler for {player_color} ({conn.getpeername()}): {e}", level=ERROR)
             self.notify_disconnection(conn, player_color, f"Unexpected error: {e}")
         finally:
             log(f"Handler for player {player_color} ({conn.getpeername()}) ended.")
-            # conn.close() は notify_disconnection や end_session で行われる
+            # conn.close() はセッション終了時に行われる
 
 
-    def notify_disconnection(self, disconnected_conn, disconnected_player_color, reason="Player disconnected"):
-        global active_game_session # グローバル変数を更新するため
-        with self.lock:
-            if not self.session_active: return #既に終了処理済みなら何もしない
-            self.session_active = False # まずセッションを非アクティブに
+    def handle_player_message(self, conn, player_idx, raw, guard, received_at):
+        # プレイヤーからの1メッセージをセッションに渡す
+        # (ソケットごとのスレッドからも、多重化接続の受信スレッドからも呼ばれる)
+        self._post(self._on_player_message, conn, player_idx, raw, guard, received_at)
+
+    def _on_player_message(self, conn, player_idx, raw, guard, received_at):
+        # guard の違反点はこのスレッドからも加算する (受信スレッドとの多少のずれは問題にならない)
+        if not self.session_active or conn not in self.clients:
+            return # セッションが終了していたら処理しない
+        player_color = self.colors[player_idx]
+        try:
+            move = json.loads(raw.decode())
+            # log(f"Received from {player_color}: {move}")
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            guard.penalize()
+            log(f"Invalid JSON from {player_color} ({conn.getpeername()}): {raw.decode(errors='ignore')[:100]}", level=WARNING)
+            # 不正なデータなので接続を切るか、エラーを返すか。ここでは無視して次の入力を待つこともできるが危険。
+            # self.notify_disconnection(conn, player_color, "Invalid data received")
+            return # 今回は次の入力を待つ形にするが、通常は切断推奨
+        if not isinstance(move, dict):
+            guard.penalize()
+            log(f"Malformed message from {player_color} ({conn.getpeername()}): {raw.decode(errors='ignore')[:100]}", level=WARNING)
+            return
 
-            log(f"Player {disconnected_player_color} ({disconnected_conn.getpeername()}) disconnected. Reason: {reason}")
+        # クライアントからの切断通知
+        if move.get("action") == "disconnect":
+            log(f"Player {player_color} ({conn.getpeername()}) sent disconnect message.")
+            self._on_disconnection(conn, player_color, "Player initiated disconnect")
+            return
 
-            if disconnected_conn in self.clients:
-                self.clients.remove(disconnected_conn)
+        # 自分のターンか、正しい色が送られてきたか
+        if move.get("turn") != player_color:
+            guard.penalize()
+            log(f"Move from {player_color} but message turn is {move.get('turn')}. Ignoring.", level=DEBUG)
+            # エラーをクライアントに返すことも検討
+            # conn.sendall(json.dumps({"error": "Not your color in message"}).encode())
+            return
+        if self.game.turn != player_color:
+            guard.penalize(1.0)
+            log(f"Not {player_color}'s turn (game turn is {self.game.turn}). Ignoring move.", level=DEBUG)
+            # conn.sendall(json.dumps({"error": "Not your turn"}).encode())
+            return
+
+        x, y = move.get("x"), move.get("y")
+        if not valid_coordinates(x, y, self.game.board_size):
+            guard.penalize()
+            log(f"Invalid move format from {player_color} ({conn.getpeername()}): {raw.decode(errors='ignore')[:100]}", level=WARNING)
+            return
+
+        if self.game.is_valid_move(y, x, player_color):
+            self.game.place_and_flip(y, x, player_color)
+            self.ply += 1
+            now = time.monotonic()
+            self.clock[player_color] += now - self.turn_started
+            self.turn_started = now
+            self.move_history.append(encode_move(y, x, player_color))
+            if game_recorder: # キューに積むだけなのでディスク待ちは発生しない
+                game_recorder.record_move(self.session_id, self.ply, y, x, player_color)
+            next_player_color = "white" if player_color == "black" else "black"
+
+            next_mask = self.game.valid_moves_mask(next_player_color)
+            own_mask = 0 if next_mask else self.game.valid_moves_mask(player_color)
+            if next_mask:
+                self.game.turn = next_player_color
+                self.game.case = "CONTINUE"
+                self.legal_mask = next_mask
+            elif own_mask: # 相手に手がないが自分にはまだ手がある場合 (パス)
+                self.game.turn = player_color # 手番は変わらず、相手がパスしたことになる
+                self.game.case = "PASS"
+                self.game.message = f"{next_player_color.capitalize()} has no moves and passes."
+                self.legal_mask = own_mask
+            else: # 両者ともに手がない、または盤面が埋まった
+                self.game.case = "FINISH"
+                self.game.message = "No valid moves for both players. Game over."
+                self.legal_mask = 0
+            
+            if self.game.is_full() and self.game.case != "FINISH":
+                 self.game.case = "FINISH"
+                 self.game.message = "Board is full. Game over."
+
+            if self.ply % SNAPSHOT_INTERVAL == 0:
+                self.snapshots.append((self.ply, encode_board(self.game.board), self.game.turn))
+
+        else: # 不正な手
+            log(f"Invalid move ({y},{x}) by {player_color}. Board not changed.", level=DEBUG)
+            guard.penalize(1.0) # 不正な手を連発する接続は受信側で遅延・切断する。応答は必ず返す (返さないと相手は待ち続ける)
             try:
-                disconnected_conn.close()
-            except Exception as e:
-                log(f"Error closing disconnected player socket: {e}")
+                error_payload = self._error_payload(y, x)
+                conn.send(error_payload)
+                STATS.record_out(len(error_payload))
+            except: pass
+            return # 盤面更新せずに次の入力を待つ
 
-            self.game.case = "FORCED_TERMINATION"
-            self.game.message = f"Player {disconnected_player_color.capitalize()} disconnected. {reason}. Game over."
+        self.game.message = "" # 通常のCONTINUEならメッセージはクリア
+        if self.game.case == "PASS":
+            self.game.message = f"{('White' if self.game.turn == 'black' else 'Black')} has no valid moves. Pass."
+        self.state.bump()
 
-        self.broadcast_state() # 最終状態をブロードキャスト (これによりend_sessionも呼ばれる)
-        
-        # end_session内で他のクライアントもクローズされる
-        if active_game_session == self: #自分がアクティブセッションならクリア
-            active_game_session = None
-            log("Active game session cleared due to player disconnection.")
+        STATS.moves.add()
+        self.broadcast_state() # 状態変更後にブロードキャスト (終局ならセッションも終了する)
+        STATS.histograms["move"].observe(time.perf_counter() - received_at)
+
+
+    def notify_disconnection(self, disconnected_conn, disconnected_player_color, reason="Player disconnected"):
+        self._post(self._on_disconnection, disconnected_conn, disconnected_player_color, reason)
+
+    def _on_disconnection(self, disconnected_conn, disconnected_player_color, reason):
+        if not self.session_active or disconnected_conn not in self.clients:
+            return # 既に終了処理済み、または終了後に閉じた接続の通知
+        log(f"Player {disconnected_player_color} ({disconnected_conn.getpeername()}) disconnected. Reason: {reason}")
+
+        self.clients = [c for c in self.clients if c is not disconnected_conn and c is not None]
+        try:
+            disconnected_conn.close()
+        except Exception as e:
+            log(f"Error closing disconnected player socket: {e}")
+
+        self.game.case = "FORCED_TERMINATION"
+        self.game.message = f"Player {disconnected_player_color.capitalize()} disconnected. {reason}. Game over."
+        self.state.bump()
+        self.broadcast_state() # 残ったプレイヤーと観戦者に最終状態を送り、セッションを終える
 
 
     def end_session(self):
+        # 他のスレッドからセッションを終わらせる (新しいセッションを始める前など)
+        self._post(self._end)
+
+    def _end(self):
         global active_game_session
-        with self.lock:
-            if not self.session_active and self.game.case not in ["FINISH", "FORCED_TERMINATION"]:
-                # broadcast_stateから呼ばれる場合、既にsession_active=Falseになっていることがある
-                # game.caseが終了状態でなければ、それは不整合の可能性
-                pass
-            self.session_active = False
-            log(f"Ending game session. Final case: {self.game.case}")
-
-            for c in self.clients:
-                try: c.close()
-                except Exception: pass
-            self.clients.clear()
-
-            for s_conn in self.current_spectators:
-                try: s_conn.close()
-                except Exception: pass
-            self.current_spectators.clear()
-
-        if active_game_session == self:
-            active_game_session = None
-            log("Active game session cleared after ending.")
+        if self.stopping:
+            return
+        self.session_active = False
+        log(f"Ending game session {self.session_id}. Final case: {self.game.case}")
+        self._record_end()
+
+        for c in self.clients:
+            try: c.close()
+            except Exception: pass
+        self.clients.clear()
+
+        for s_conn in self.current_spectators:
+            try: s_conn.close()
+            except Exception: pass
+        self.current_spectators.clear()
+
+        for token in self.seat_tokens:
+            resumable_seats.pop(token, None)
+        with lobby_lock:
+            game_sessions.discard(self)
+            if active_game_session is self:
+                active_game_session = None
+                log("Active game session cleared after ending.")
+        self.stopping = True
+
+
+    def _record_end(self):
+        if self.end_recorded or not game_recorder:
+            return
+        self.end_recorded = True
+        if self.game.case == "FINISH":
+            black, white = self.game.count_discs()
+            result = game_record.RESULT_BLACK if black > white else game_record.RESULT_WHITE if white > black else game_record.RESULT_DRAW
+            game_recorder.record_end(self.session_id, self.ply, result)
+        else: # 切断やサーバー停止による中断
+            game_recorder.record_end(self.session_id, self.ply, game_record.RESULT_ABORTED, forced=True)
 
 
 # ------------------- グローバル変数とメイン処理 -------------------
+# 以下のロビーの状態は接続ごとのスレッドやセッションのワーカーから同時に触られるので、lobby_lock の中で操作する
+# (GIL なしのビルドでは list の check-then-act も競合する)
+lobby_lock = threading.Lock()
 waiting_players = [] # プレイヤーモードで接続し、相手を待っているクライアントのリスト [(conn, addr)]
 global_spectators = [] # アクティブなゲームがない場合に待機している観戦者のリスト [conn]
-active_game_session = None
+active_game_session = None # 観戦者が参加する対局 (最後に始まったプレイヤー同士の対局)
+game_sessions = set() # 進行中の全セッション
 main_server_socket = None # メインのサーバーソケット
+admin_server = None # 統計問い合わせ用の管理サーバー
+resumable_seats = {} # 再起動後に再接続を待っている席 {seat_token: GameSession}
+game_recorder = None # 対局記録ログ (server_main で開く)
+waiting_channels = [] # 対局相手を待っている多重化チャンネル [net_io.Channel] (lobby_lock で保護)
+dashboards = [] # 多盤面観戦の接続 [Dashboard] (lobby_lock で保護)
+DASHBOARD_MAX_BOARDS = 64 # 1つのダッシュボードが同時に観戦できる対局数の上限
+
+
+def _reject_resume(conn):
+    try:
+        conn.send(json.dumps({"status": "resume_failed", "message": "No session to resume."}).encode())
+    except Exception: pass
+    try: conn.close()
+    except Exception: pass
+
+
+def register_session(session):
+    with lobby_lock:
+        if not session.session_active:
+            return
+        game_sessions.add(session)
+    _subscribe_dashboards(session)
+
+
+def _subscribe_dashboards(session):
+    # 新しい対局を空きのあるダッシュボードに追加する。送信で待たされることがあるので lobby_lock の外で呼ぶ
+    with lobby_lock:
+        targets = list(dashboards)
+    for dashboard in targets:
+        dashboard.subscribe(session)
+
+
+def current_gauges():
+    # 管理スレッドから呼ばれる。ロビーのロックはリストのコピーにだけ使い、セッションの処理は止めない
+    with lobby_lock:
+        sessions = [s for s in game_sessions if s.session_active]
+        waiting = (len(waiting_players), len(waiting_channels), len(global_spectators))
+    return {
+        "active_sessions": len(sessions),
+        "waiting_players": waiting[0],
+        "waiting_channels": waiting[1],
+        "spectators": waiting[2] + sum(len(s.current_spectators) for s in sessions),
+        "waiting_spectators": waiting[2],
+        "dashboards": len(dashboards),
+        "session_workers": SESSION_POOL.size,
+        "log_dropped": LOGGER.dropped,
+    }
 
 
 def handle_new_connection(conn, addr):
     global waiting_players, global_spectators, active_game_session
     log(f"Handling new connection from: {addr}")
     try:
+        if not RATE_LIMITER.consume_ip(addr[0]): # 同じIPからの接続が多すぎる
+            log(f"Connection from {addr} rejected by rate limit.", level=WARNING)
+            STATS.rate_limited.add()
+            conn.close()
+            return
         conn.settimeout(10.0) # 10秒以内にモード情報が送られてくることを期待
-        initial_data_raw = conn.recv(1024)
+        initial_data_raw = conn.recv()
         conn.settimeout(None)
 
         if not initial_data_raw:
@@ -359,110 +737,130 @@ def handle_new_connection(conn, addr):
         log(f"Client {addr} mode: {client_mode}, data: {initial_data}")
 
         if client_mode == "spectator":
-            if active_game_session and active_game_session.session_active:
-                active_game_session.add_spectator(conn)
+            with lobby_lock: # 待機の通知より先に新しい対局の盤面が届かないよう、ロック内で送る
+                session = active_game_session
+                if session and session.session_active:
+                    session.add_spectator(conn, from_ply=initial_data.get("from_ply"))
+                else:
+                    global_spectators.append(conn)
+                    log(f"Spectator {addr} added to global list ({len(global_spectators)} total), waiting for a game.")
+                    try:
+                        conn.send(json.dumps({
+                            "status": "waiting_for_game",
+                            "message": "No active game. Waiting for a game to start or for players to connect."
+                        }).encode())
+                    except Exception as e:
+                        log(f"Error sending waiting message to spectator {addr}: {e}")
+                        global_spectators.remove(conn)
+                        conn.close()
+        elif client_mode == "dashboard": # 1本の接続で複数の対局を観戦する
+            conn.settimeout(None)
+            handle_dashboard(conn, addr, initial_data)
+        elif client_mode == "multiplex": # 1本の接続で複数の対局を行う (ボット用)
+            conn.settimeout(None)
+            handle_multiplex(conn, addr, initial_data)
+        elif client_mode == "resume": # サーバー再起動後の再接続
+            seat_token = initial_data.get("seat_token")
+            session = resumable_seats.pop(seat_token, None)
+            if session:
+                session.attach_player(conn, seat_token) # 席に戻れなければセッション側で resume_failed を返す
             else:
-                global_spectators.append(conn)
-                log(f"Spectator {addr} added to global list ({len(global_spectators)} total), waiting for a game.")
-                try:
-                    conn.sendall(json.dumps({
-                        "status": "waiting_for_game",
-                        "message": "No active game. Waiting for a game to start or for players to connect."
-                    }).encode())
-                except Exception as e:
-                    log(f"Error sending waiting message to spectator {addr}: {e}")
-                    if conn in global_spectators: global_spectators.remove(conn)
-                    conn.close()
+                log(f"Resume request from {addr} rejected (unknown or used seat token).")
+                _reject_resume(conn)
         else: # player mode
             # プレイヤーは色設定の確認までこのスレッドで行う
             player_conn = conn
             player_addr = addr
+            player_conn.player_id = clean_player_id(initial_data.get("player_id"))
             
             # クライアントからの最初のメッセージが色設定完了通知である場合もある
             # (クライアントが接続直後に色を期待して即座に "color_set" を送るパターン)
             is_color_set_message = initial_data.get("status") == "color_set" or "Setting_OK" in initial_data
 
-            with threading.Lock(): # waiting_playersリスト操作の保護
+            with lobby_lock:
                 waiting_players.append((player_conn, player_addr, is_color_set_message, initial_data if is_color_set_message else None))
                 log(f"Player {player_addr} added to waiting list. Total waiting: {len(waiting_players)}")
-
-                if len(waiting_players) >= 2:
-                    player1_info = waiting_players.pop(0)
-                    player2_info = waiting_players.pop(0)
-                    
-                    p1_conn, p1_addr, p1_is_color_set, p1_initial_data = player1_info
-                    p2_conn, p2_addr, p2_is_color_set, p2_initial_data = player2_info
-
-                    pair = [(p1_conn, p1_addr), (p2_conn, p2_addr)]
-                    colors_to_assign = ["black", "white"]
-                    assigned_players_conn = []
-                    assignment_ok = True
-
-                    # 色割り当てと確認
-                    for i, (p_conn, p_addr) in enumerate(pair):
-                        color = colors_to_assign[i]
-                        try:
-                            p_conn.sendall(json.dumps({"player_color": color}).encode())
-                            log(f"Sent color {color} to player {p_addr}")
-
-                            # クライアントからの "Setting_OK" または "color_set" を待つ
-                            # 既に最初のメッセージで受信済みの場合はそれを使う
-                            if (i == 0 and p1_is_color_set):
-                                response = p1_initial_data
-                                log(f"Player {p_addr} pre-sent color confirmation: {response}")
-                            elif (i == 1 and p2_is_color_set):
-                                response = p2_initial_data
-                                log(f"Player {p_addr} pre-sent color confirmation: {response}")
-                            else:
-                                p_conn.settimeout(10.0)
-                                response_raw = p_conn.recv(1024)
-                                p_conn.settimeout(None)
-                                if not response_raw: raise ConnectionAbortedError("Client disconnected before confirming color.")
-                                response = json.loads(response_raw.decode())
-                                log(f"Received color confirmation from {p_addr}: {response}")
-
-                            confirmed_color = response.get("color", response.get("Setting_OK"))
-                            if (response.get("status") == "color_set" or "Setting_OK" in response) and confirmed_color == color:
-                                log(f"Player {p_addr} confirmed color {color}.")
-                                assigned_players_conn.append(p_conn)
-                            else:
-                                raise ValueError(f"Color confirmation failed or wrong color. Expected {color}, got {confirmed_color}. Full response: {response}")
-                        except Exception as e:
-                            log(f"Error during color assignment for player {p_addr} ({color}): {e}")
-                            assignment_ok = False
-                            # 失敗したプレイヤーは閉じる
-                            try: p_conn.close()
-                            except: pass
-                            # もう片方のプレイヤーを待機リストに戻す
-                            other_player_idx = 1 - i
-                            other_p_conn, other_p_addr = pair[other_player_idx]
-                            if other_p_conn in assigned_players_conn : # もし片方成功していたら
-                                assigned_players_conn.remove(other_p_conn)
-                                waiting_players.insert(0, (other_p_conn, other_p_addr, False, None)) # 待機リストの先頭に戻す
-                                log(f"Returned player {other_p_addr} to waiting list.")
-                            break # forループを抜ける
-                    
-                    if assignment_ok and len(assigned_players_conn) == 2:
-                        log("Two players successfully assigned colors. Starting new game session.")
-                        if active_game_session:
-                            log("Warning: An active game session already exists. Ending it before starting a new one.")
-                            active_game_session.end_session() # 古いセッションを強制終了
-                            time.sleep(0.1) # 念のため少し待つ
-
-                        current_game_spectators_list = list(global_spectators) # コピー
-                        global_spectators.clear()
-                        
-                        active_game_session = GameSession(assigned_players_conn, colors_to_assign, current_game_spectators_list)
+                if len(waiting_players) < 2:
+                    return
+                player1_info = waiting_players.pop(0)
+                player2_info = waiting_players.pop(0)
+
+            # 色の確認は相手の応答を待つので、ロビーのロックは持たずに行う
+            p1_conn, p1_addr, p1_is_color_set, p1_initial_data = player1_info
+            p2_conn, p2_addr, p2_is_color_set, p2_initial_data = player2_info
+
+            pair = [(p1_conn, p1_addr), (p2_conn, p2_addr)]
+            colors_to_assign = ["black", "white"]
+            seat_tokens = [secrets.token_hex(8) for _ in colors_to_assign]
+            assigned_players_conn = []
+            assignment_ok = True
+
+            # 色割り当てと確認
+            for i, (p_conn, p_addr) in enumerate(pair):
+                color = colors_to_assign[i]
+                try:
+                    p_conn.send(json.dumps({"player_color": color, "seat_token": seat_tokens[i]}).encode())
+                    log(f"Sent color {color} to player {p_addr}")
+
+                    # クライアントからの "Setting_OK" または "color_set" を待つ
+                    # 既に最初のメッセージで受信済みの場合はそれを使う
+                    if (i == 0 and p1_is_color_set):
+                        response = p1_initial_data
+                        log(f"Player {p_addr} pre-sent color confirmation: {response}")
+                    elif (i == 1 and p2_is_color_set):
+                        response = p2_initial_data
+                        log(f"Player {p_addr} pre-sent color confirmation: {response}")
+                    else:
+                        p_conn.settimeout(10.0)
+                        response_raw = p_conn.recv()
+                        p_conn.settimeout(None)
+                        if not response_raw: raise ConnectionAbortedError("Client disconnected before confirming color.")
+                        response = json.loads(response_raw.decode())
+                        log(f"Received color confirmation from {p_addr}: {response}")
+
+                    confirmed_color = response.get("color", response.get("Setting_OK"))
+                    if (response.get("status") == "color_set" or "Setting_OK" in response) and confirmed_color == color:
+                        log(f"Player {p_addr} confirmed color {color}.")
+                        assigned_players_conn.append(p_conn)
                     else:
-                        log("Failed to set up a pair for the game. One or more players failed color assignment.")
-                        # 失敗しなかったプレイヤーがいれば、待機リストに戻されているはず
-                        # 既に接続が閉じられたプレイヤーは assigned_players_conn にはいない
-                        for p_rem in assigned_players_conn: # もし万が一残っていたら閉じる
-                             try: p_rem.close()
-                             except: pass
+                        raise ValueError(f"Color confirmation failed or wrong color. Expected {color}, got {confirmed_color}. Full response: {response}")
+                except Exception as e:
+                    log(f"Error during color assignment for player {p_addr} ({color}): {e}")
+                    assignment_ok = False
+                    # 失敗したプレイヤーは閉じる
+                    try: p_conn.close()
+                    except: pass
+                    # もう片方のプレイヤーを待機リストに戻す
+                    other_player_idx = 1 - i
+                    other_p_conn, other_p_addr = pair[other_player_idx]
+                    if other_p_conn in assigned_players_conn : # もし片方成功していたら
+                        assigned_players_conn.remove(other_p_conn)
+                        with lobby_lock:
+                            waiting_players.insert(0, (other_p_conn, other_p_addr, False, None)) # 待機リストの先頭に戻す
+                        log(f"Returned player {other_p_addr} to waiting list.")
+                    break # forループを抜ける
+
+            if assignment_ok and len(assigned_players_conn) == 2:
+                log("Two players successfully assigned colors. Starting new game session.")
+                # 以前の対局は終わらせずに並行して進める。観戦者は新しい対局に参加する
+                session = GameSession(assigned_players_conn, colors_to_assign, [], seat_tokens, start=False)
+                with lobby_lock:
+                    session.current_spectators.extend(global_spectators) # 初期盤面は最初のbroadcastで送る
+                    global_spectators.clear()
+                    active_game_session = session
+                    game_sessions.add(session)
+                _subscribe_dashboards(session)
+                session.start()
+            else:
+                log("Failed to set up a pair for the game. One or more players failed color assignment.")
+                # 失敗しなかったプレイヤーがいれば、待機リストに戻されているはず
+                # 既に接続が閉じられたプレイヤーは assigned_players_conn にはいない
+                for p_rem in assigned_players_conn: # もし万が一残っていたら閉じる
+                     try: p_rem.close()
+                     except: pass
 
 
-    except (socket.timeout, json.JSONDecodeError) as e:
+    except (socket.timeout, json.JSONDecodeError, net_io.FrameError) as e:
         log(f"Error handling new connection from {addr} (timeout or JSON error): {e}")
         try: conn.close()
         except: pass
@@ -471,34 +869,283 @@ def handle_new_connection(conn, addr):
         try: conn.close()
         except: pass
     except Exception as e:
-        log(f"Unexpected error handling new connection from {addr}: {e}")
         import traceback
-        traceback.print_exc()
+        log(f"Unexpected error handling new connection from {addr}: {e}\n{traceback.format_exc()}", level=ERROR)
         try: conn.close()
         except: pass
 
 
+# ------------------- 多重化接続 (ボット用) -------------------
+# 1本の接続上でチャンネル番号ごとに別々の対局を行う。チャンネル 0 は接続全体の制御用。
+# 各チャンネルで {"action": "join"} を送ると待機列に入り、他のチャンネル(別の接続でもよい)と対局する。
+# 対局中のメッセージの形式は通常のプレイヤー接続と同じで、受信はこの接続のスレッド1本で行う。
+def handle_multiplex(conn, addr, hello):
+    if MULTIPLEX_TOKEN and hello.get("token") != MULTIPLEX_TOKEN:
+        log(f"Multiplex connection from {addr} rejected (bad token).", level=WARNING)
+        try: conn.send(json.dumps({"status": "multiplex_rejected", "message": "Invalid token."}).encode())
+        except Exception: pass
+        conn.close()
+        return
+    bot_id = clean_player_id(hello.get("bot_id")) or addr[0]
+    guard = rate_limit.ConnectionGuard(addr[0], MUX_RATE_LIMITER, rate_limit.MUX_RATE, rate_limit.MUX_BURST)
+    channels = {} # channel_id -> net_io.Channel
+    conn.send(json.dumps({"status": "multiplex_ready", "bot_id": bot_id}).encode())
+    log(f"Multiplex connection from {addr} ready (bot {bot_id}).")
+
+    def channel_closed(channel):
+        if channels.get(channel.channel_id) is channel:
+            del channels[channel.channel_id]
+
+    try:
+        while not SERVER_SHUTDOWN_EVENT.is_set():
+            frame = conn.recv_frame()
+            if frame is None:
+                break
+            channel_id, raw = frame
+            received_at = time.perf_counter()
+            STATS.record_in(len(raw))
+            action = guard.on_message(len(raw))
+            if action != rate_limit.ALLOW:
+                STATS.rate_limited.add()
+                if action == rate_limit.DISCONNECT:
+                    log(f"Multiplex connection {addr} disconnected by rate limit.", level=WARNING)
+                    break
+                time.sleep(rate_limit.PENALTY_DELAY)
+            if channel_id == 0:
+                continue # 制御用チャンネルで受け付けるコマンドは今のところない
+
+            channel = channels.get(channel_id)
+            if channel is not None and channel.session is not None:
+                # 対局が終わるとチャンネルが閉じられ、そのチャンネル番号は次の join で使い回せる
+                channel.session.handle_player_message(channel, channel.seat, raw, guard, received_at)
+                continue
+            try:
+                request = json.loads(raw.decode())
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                guard.penalize()
+                continue
+            if channel is None:
+                channel = net_io.Channel(conn, channel_id, bot_id, on_close=channel_closed)
+                channels[channel_id] = channel
+            if request.get("action") == "join":
+                join_multiplex_queue(channel)
+            elif request.get("action") == "resume":
+                seat_token = request.get("seat_token")
+                session = resumable_seats.pop(seat_token, None)
+                if session:
+                    session.attach_player(channel, seat_token)
+                else:
+                    _reject_resume(channel)
+            else:
+                guard.penalize()
+    except (OSError, net_io.FrameError) as e:
+        log(f"Multiplex connection {addr} error: {e}")
+    finally:
+        log(f"Multiplex connection {addr} (bot {bot_id}) closed with {len(channels)} open channels.")
+        with lobby_lock:
+            waiting_channels[:] = [c for c in waiting_channels if c.connection is not conn]
+        for channel in list(channels.values()):
+            channel.closed = True # 接続ごと閉じるので個別の終了通知は送らない
+            session = channel.session
+            if session is not None and session.session_active:
+                session.notify_disconnection(channel, session.colors[channel.seat], "Multiplexed connection closed")
+        try: conn.close()
+        except Exception: pass
+
+
+def join_multiplex_queue(channel):
+    with lobby_lock:
+        if channel in waiting_channels:
+            return
+        waiting_channels.append(channel)
+        if len(waiting_channels) < 2:
+            channel.send(json.dumps({"status": "waiting_for_opponent"}).encode())
+            return
+        pair = [waiting_channels.pop(0), waiting_channels.pop(0)]
+    colors = ["black", "white"]
+    seat_tokens = [secrets.token_hex(8) for _ in colors]
+    # 色を知らせる前にチャンネルを席に結び付けておき、直後に届く手も取りこぼさないようにする
+    session = GameSession(pair, colors, [], seat_tokens, start=False)
+    register_session(session)
+    for channel, color, token in zip(pair, colors, seat_tokens):
+        try:
+            channel.send(json.dumps({"player_color": color, "seat_token": token, "session_id": session.session_id}).encode())
+        except OSError as e:
+            log(f"Error sending color to multiplexed channel {channel.channel_id}: {e}")
+    session.start()
+
+
+# ------------------- 多盤面観戦 (ダッシュボード) -------------------
+# 1本の接続で多数の対局を観戦する。対局ごとにチャンネルを1つ割り当て、そのチャンネルを観戦者として
+# セッションに登録するので、盤面は通常の観戦者と同じ共有ペイロードをヘッダだけ変えて送る。
+# 対局が終わるとチャンネルに channel_closed が届き、枠が空けば次に始まった対局が割り当てられる。
+class Dashboard:
+    def __init__(self, conn, max_boards, session_ids=None):
+        self.conn = conn
+        self.max_boards = max_boards
+        self.session_ids = session_ids # 観戦する対局を限定する場合のセッションIDの集合
+        self.channels = {} # session -> net_io.Channel
+        self.next_channel = 1 # チャンネル 0 は制御用。番号は使い回さない
+        self.lock = threading.Lock() # channels はセッションのワーカー (チャンネルを閉じるとき) からも触られる
+        self.closed = False
+
+    def subscribe(self, session):
+        # 送信で待たされることがあるので lobby_lock の外で呼ぶ。追加できたら True
+        with self.lock:
+            if self.closed or session in self.channels or len(self.channels) >= self.max_boards:
+                return False
+            if self.session_ids is not None and session.session_id not in self.session_ids:
+                return False
+            channel = net_io.Channel(self.conn, self.next_channel, on_close=self._channel_closed)
+            channel.session = session
+            self.next_channel += 1
+            self.channels[session] = channel
+        # 再起動後に復元した対局は、プレイヤーが戻るまで席が空いている (None)
+        players = {color: player_label(conn) if conn is not None else None for conn, color in zip(list(session.clients), session.colors)}
+        try:
+            # 盤面より先に、どの対局のチャンネルかを知らせる
+            channel.send(json.dumps({"status": "subscribed", "session_id": session.session_id, "players": players}).encode())
+        except OSError:
+            return False
+        session.add_spectator(channel)
+        return True
+
+    def _channel_closed(self, channel):
+        # 対局が終わってチャンネルが閉じられた (セッションのワーカーから呼ばれる)
+        with self.lock:
+            if self.channels.get(channel.session) is not channel:
+                return
+            del self.channels[channel.session]
+        # 空いた枠に、枠が埋まっていて観戦できなかった進行中の対局を古い順に入れる
+        for session in sorted(live_sessions(), key=lambda s: s.started_at):
+            if self.subscribe(session):
+                break
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            channels = list(self.channels.values())
+            self.channels.clear()
+        for channel in channels:
+            channel.closed = True # 接続ごと閉じるので個別の終了通知は送らない (セッション側は次の送信失敗で外す)
+
+
+def handle_dashboard(conn, addr, hello):
+    max_boards = max(1, min(int(hello.get("max_boards") or DASHBOARD_MAX_BOARDS), DASHBOARD_MAX_BOARDS))
+    session_ids = hello.get("session_ids")
+    dashboard = Dashboard(conn, max_boards, set(session_ids) if session_ids else None)
+    guard = RATE_LIMITER.guard(addr[0])
+    try:
+        conn.send(json.dumps({"status": "dashboard_ready", "max_boards": max_boards}).encode())
+        with lobby_lock:
+            dashboards.append(dashboard) # 以降に始まった対局は _subscribe_dashboards で追加される
+            sessions = sorted((s for s in game_sessions if s.session_active), key=lambda s: s.started_at)
+        for session in sessions: # 同じ対局を二重に追加しないことは subscribe が確かめる
+            dashboard.subscribe(session)
+        log(f"Dashboard {addr} subscribed to {len(dashboard.channels)} sessions (max {max_boards}).")
+        # 観戦側から送るものはないので、切断の検知と流量制限だけ行う
+        while not SERVER_SHUTDOWN_EVENT.is_set():
+            frame = conn.recv_frame()
+            if frame is None:
+                break
+            STATS.record_in(len(frame[1]))
+            if guard.on_message(len(frame[1])) == rate_limit.DISCONNECT:
+                log(f"Dashboard {addr} disconnected by rate limit.", level=WARNING)
+                break
+    except (OSError, net_io.FrameError) as e:
+        log(f"Dashboard connection {addr} error: {e}")
+    finally:
+        with lobby_lock:
+            if dashboard in dashboards:
+                dashboards.remove(dashboard)
+        dashboard.close()
+        log(f"Dashboard {addr} closed.")
+        try: conn.close()
+        except Exception: pass
+
+
+def live_sessions():
+    with lobby_lock:
+        return [s for s in game_sessions if s.session_active]
+
+
+def save_checkpoint(sessions):
+    states = [s.checkpoint_state() for s in sessions]
+    try:
+        session_checkpoint.write_checkpoint([state for state in states if state]) # 応答のない/終了したセッションは除く
+    except OSError as e:
+        log(f"Error writing session checkpoint: {e}", level=ERROR)
+
+
+def checkpoint_loop():
+    # 盤面が変わったときだけ定期的に書き出す
+    last_versions = None
+    while not SERVER_SHUTDOWN_EVENT.wait(CHECKPOINT_INTERVAL):
+        sessions = live_sessions()
+        versions = sorted((s.session_id, s.state.version) for s in sessions)
+        if versions != last_versions:
+            save_checkpoint(sessions)
+            last_versions = versions
+
+
+def restore_sessions():
+    global active_game_session
+    for state in session_checkpoint.load_checkpoint(log=log):
+        try:
+            session = GameSession.restore(state)
+        except (KeyError, ValueError) as e:
+            log(f"Skipping broken session checkpoint: {e}", level=WARNING)
+            continue
+        for token in session.seat_tokens:
+            resumable_seats[token] = session
+        register_session(session)
+        active_game_session = session
+
+
+def _handle_sigterm(signum, frame):
+    log("SIGTERM received. Checkpointing sessions and shutting down...")
+    SERVER_SHUTDOWN_EVENT.set()
+
+
 def server_main():
-    global main_server_socket, active_game_session
+    global main_server_socket, active_game_session, admin_server, game_recorder
     main_server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     main_server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     try:
         main_server_socket.bind(("0.0.0.0", PORT))
     except OSError as e:
-        log(f"Error binding to port {PORT}: {e}. Server cannot start.")
+        log(f"Error binding to port {PORT}: {e}. Server cannot start.", level=ERROR)
         return
         
     main_server_socket.listen()
+    game_recorder = game_record.GameRecordLog(GAME_RECORD_DIR, log=log)
+    restore_sessions()
+    threading.Thread(target=checkpoint_loop, daemon=True).start()
+    try:
+        signal.signal(signal.SIGTERM, _handle_sigterm)
+    except ValueError: # メインスレッド以外から起動された場合は登録できない
+        pass
     # main_server_socket.settimeout(1.0) # acceptにタイムアウトを設定してCtrl+Cを検知しやすくする
-    log(f"Server listening on port {PORT}")
+    gil = sys._is_gil_enabled() if hasattr(sys, "_is_gil_enabled") else True
+    log(f"Server listening on port {PORT} ({SESSION_POOL.size} session workers, GIL {'enabled' if gil else 'disabled'})")
+
+    admin_server = AdminServer(current_gauges)
+    try:
+        admin_server.start()
+        log(f"Admin stats listening on {admin_server.address[0]}:{admin_server.address[1]}")
+    except OSError as e:
+        log(f"Error starting admin stats listener: {e}. Continuing without it.")
+        admin_server = None
 
     try:
         while not SERVER_SHUTDOWN_EVENT.is_set():
             try:
                 # タイムアウト付きでacceptし、シャットダウンイベントをチェックできるようにする
                 main_server_socket.settimeout(1.0)
-                conn, addr = main_server_socket.accept()
+                raw_conn, addr = main_server_socket.accept()
                 main_server_socket.settimeout(None) # 通常のブロッキングモードに戻す
+                # 以降はフレーム単位で送受信する (TCP_NODELAY も設定)。送信は接続ごとの送信スレッドが行い、送信待ちには上限を設ける
+                conn = net_io.FramedConnection(raw_conn, max_queued_bytes=net_io.MAX_QUEUED_BYTES)
                 
                 threading.Thread(target=handle_new_connection, args=(conn, addr), daemon=True).start()
             except socket.timeout:
@@ -516,24 +1163,33 @@ def server_main():
     finally:
         SERVER_SHUTDOWN_EVENT.set()
         log("Cleaning up server resources...")
-        if active_game_session:
-            log("Ending active game session due to server shutdown...")
-            active_game_session.end_session() # アクティブなセッションを終了
-
+        # 進行中のセッションは終了させずにチェックポイントへ保存し、再起動後に再開できるようにする
+        sessions = live_sessions()
+        save_checkpoint(sessions)
+        for session in sessions:
+            session.suspend()
         # 残っている待機プレイヤーや観戦者の接続を閉じる
-        for p_conn, _, _, _ in waiting_players:
-            try: p_conn.close()
-            except: pass
-        waiting_players.clear()
-        for s_conn in global_spectators:
-            try: s_conn.close()
+        with lobby_lock:
+            active_game_session = None
+            waiting = [p_conn for p_conn, _, _, _ in waiting_players] + global_spectators + [c.connection for c in waiting_channels]
+            waiting += [d.conn for d in dashboards]
+            waiting_players.clear()
+            global_spectators.clear()
+            waiting_channels.clear()
+            dashboards.clear()
+        for w_conn in waiting:
+            try: w_conn.close()
             except: pass
-        global_spectators.clear()
 
+        if admin_server:
+            admin_server.stop()
+        if game_recorder:
+            game_recorder.close() # 未書き込みの記録を fsync してから閉じる
         if main_server_socket:
             main_server_socket.close()
             log("Main server socket closed.")
         log("Server shutdown complete.")
+        LOGGER.close() # キューに残ったログを書き出す
 
 
 if __name__ == "__main__":
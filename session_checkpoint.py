@@ -0,0 +1,72 @@
+import os
+import json
+import sys
+
+from async_log import WARNING
+
+# 進行中セッションのチェックポイント (ウォームリスタート用)
+# 盤面は黒・白それぞれ64ビットのマスクで保存し、1セッション数百バイトに収める。
+# 書き込みは一時ファイル経由の置き換えなので、途中で落ちても前回の内容が残る。
+
+CHECKPOINT_FILE = "session_checkpoint.json"
+CHECKPOINT_VERSION = 1
+
+
+def board_to_masks(board):
+    black = white = 0
+    bit = 1
+    for row in board:
+        for cell in row:
+            if cell == "black":
+                black |= bit
+            elif cell == "white":
+                white |= bit
+            bit <<= 1
+    return black, white
+
+
+def masks_to_board(black, white, board_size=8):
+    board = [[None] * board_size for _ in range(board_size)]
+    for i in range(board_size * board_size):
+        bit = 1 << i
+        if black & bit:
+            board[i // board_size][i % board_size] = "black"
+        elif white & bit:
+            board[i // board_size][i % board_size] = "white"
+    return board
+
+
+def decode_move(move):
+    # "Bf5" → (row, col, color)
+    color = "black" if move[0] == "B" else "white"
+    return int(move[2:]) - 1, ord(move[1]) - ord("a"), color
+
+
+def write_checkpoint(sessions, path=CHECKPOINT_FILE):
+    # sessions: GameSession.checkpoint_state() の戻り値のリスト
+    data = {"version": CHECKPOINT_VERSION, "sessions": sessions}
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, separators=(",", ":"))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path=CHECKPOINT_FILE, log=None):
+    # log: 読めなかったことを報告する関数 (serverv1.log と同じ形)。None なら標準エラーに出す
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError) as e:
+        message = f"[session_checkpoint] ignoring unreadable checkpoint {path}: {e}"
+        if log:
+            log(message, level=WARNING)
+        else:
+            print(message, file=sys.stderr)
+        return []
+    if data.get("version") != CHECKPOINT_VERSION:
+        return []
+    return data.get("sessions", [])
@@ -0,0 +1,237 @@
+import json
+import time
+import argparse
+import threading
+import tkinter as tk
+
+import net_io
+import othello_client
+
+# 多数の対局を1つのウィンドウでまとめて観戦するダッシュボード
+# サーバーへは "dashboard" モードの接続を1本だけ張り、対局ごとに割り当てられたチャンネルで盤面を受け取る。
+# 盤面はすべて1つのキャンバス上にタイル状に並べ、キャンバス項目は起動時に1度だけ作って使い回す。
+# 受信スレッドは届いた盤面を対局ごとの最新1件に畳んでおき、描画は1フレームに1回まとめて行う。
+#
+#   python spectator_dashboard.py -s 127.0.0.1 --boards 36
+
+PORT = 8080
+FRAME_INTERVAL = 1 / 60 # 全盤面の再描画は1フレーム(約60Hz)に1回まで
+DEFAULT_BOARDS = 16
+CELL_SIZE = 14 # タイル1マスの大きさ (px)
+TILE_GAP = 6
+LABEL_HEIGHT = 16 # 盤面の上の対局情報の高さ
+LABEL_FONT = ("Helvetica", 8)
+BOARD_COLOR = "green"
+FINISHED_BOARD_COLOR = "dark olive green" # 終わった対局は次の対局が割り当てられるまで色を変えて残す
+BOARD_SIZE = 8
+
+
+class BoardTile:
+    # 1盤面分のキャンバス項目。盤・線・石・対局情報の項目を最初に作り、以降は itemconfig だけで更新する
+    def __init__(self, canvas, x, y, cell_size):
+        self.canvas = canvas
+        size = cell_size * BOARD_SIZE
+        top = y + LABEL_HEIGHT
+        self.label_item = canvas.create_text(x, y + LABEL_HEIGHT // 2, anchor="w", text="(空き)", font=LABEL_FONT)
+        self.board_item = canvas.create_rectangle(x, top, x + size, top + size, fill=BOARD_COLOR, outline="black")
+        for i in range(1, BOARD_SIZE):
+            canvas.create_line(x, top + i * cell_size, x + size, top + i * cell_size, fill="black")
+            canvas.create_line(x + i * cell_size, top, x + i * cell_size, top + size, fill="black")
+        pad = max(1, cell_size // 8)
+        self.piece_items = []
+        for square in range(BOARD_SIZE * BOARD_SIZE):
+            row, col = divmod(square, BOARD_SIZE)
+            x0 = x + col * cell_size + pad
+            y0 = top + row * cell_size + pad
+            self.piece_items.append(canvas.create_oval(x0, y0, x0 + cell_size - 2 * pad, y0 + cell_size - 2 * pad,
+                                                       fill="black", outline="", state="hidden"))
+        self.drawn = [None] * (BOARD_SIZE * BOARD_SIZE) # 最後に描画した盤面 (マスごとの色)
+        self.channel = None # 表示中の対局のチャンネル
+        self.title = ""
+        self.finished_at = 0.0 # 0 なら未使用または対局中
+
+    def assign(self, channel, info):
+        self.channel = channel
+        self.finished_at = 0.0
+        players = info.get("players") or {} # 再起動後にプレイヤーの再接続を待っている席は null
+        self.title = f"#{info.get('session_id')} {players.get('black') or '?'} vs {players.get('white') or '?'}"
+        self.canvas.itemconfig(self.board_item, fill=BOARD_COLOR)
+        self.canvas.itemconfig(self.label_item, text=self.title)
+
+    def render(self, data):
+        # 前回から変わったマスの石だけを更新する
+        drawn = self.drawn
+        square = 0
+        black = white = 0
+        for row in data["board"]:
+            for color in row:
+                if color == "black":
+                    black += 1
+                elif color == "white":
+                    white += 1
+                if color != drawn[square]:
+                    if color is None:
+                        self.canvas.itemconfig(self.piece_items[square], state="hidden")
+                    else:
+                        self.canvas.itemconfig(self.piece_items[square], fill=color, state="normal")
+                    drawn[square] = color
+                square += 1
+        case = data.get("case")
+        status = "終局" if case == "FINISH" else "中断" if case == "FORCED_TERMINATION" else f"{(data.get('turn') or '?')[0].upper()}番"
+        self.canvas.itemconfig(self.label_item, text=f"{self.title}  B{black} W{white} {status}")
+
+    def finish(self):
+        self.channel = None
+        self.finished_at = time.monotonic()
+        self.canvas.itemconfig(self.board_item, fill=FINISHED_BOARD_COLOR)
+
+
+class DashboardGUI:
+    def __init__(self, root, host, port=PORT, boards=DEFAULT_BOARDS, columns=None, cell_size=CELL_SIZE):
+        self.root = root
+        self.root.title("Othello Dashboard")
+        self.server = (host, port)
+        self.boards = boards
+        columns = columns or max(1, round(boards ** 0.5))
+        rows = (boards + columns - 1) // columns
+        tile_w = cell_size * BOARD_SIZE + TILE_GAP
+        tile_h = cell_size * BOARD_SIZE + LABEL_HEIGHT + TILE_GAP
+        self.canvas = tk.Canvas(root, width=columns * tile_w + TILE_GAP, height=rows * tile_h + TILE_GAP, bg="white")
+        self.canvas.grid(row=0, column=0)
+        self.status_text = "接続中..."
+        self.status_label = tk.Label(root, text=self.status_text, anchor="w")
+        self.status_label.grid(row=1, column=0, sticky="ew")
+        self.tiles = [BoardTile(self.canvas, TILE_GAP + (i % columns) * tile_w, TILE_GAP + (i // columns) * tile_h, cell_size)
+                      for i in range(boards)]
+        self.tile_by_channel = {} # channel -> BoardTile
+
+        # 受信スレッドから描画への受け渡し。チャンネルごとに {"subscribed", "state", "closed"} の最新分だけを残す
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.frame_scheduled = False
+        self.last_frame = 0.0
+        self.frames = 0
+        self.updates = 0 # 受信した盤面の数 (描画されずに畳まれたものも含む)
+
+        self.conn = None
+        self.running = True
+        threading.Thread(target=self.receive_loop, daemon=True).start()
+
+    def connect(self):
+        sock = othello_client.connect_with_backoff(self.server)
+        self.conn = net_io.FramedConnection(sock)
+        self.conn.send(json.dumps({"mode": "dashboard", "max_boards": self.boards}).encode())
+
+    def receive_loop(self):
+        # 切断されたら指数バックオフで接続し直し、改めて観戦できる対局を割り当ててもらう
+        while self.running:
+            try:
+                self.connect()
+                self.post(0, "status", {"message": f"接続しました: {self.server[0]}:{self.server[1]}"})
+                while self.running:
+                    frame = self.conn.recv_frame()
+                    if frame is None:
+                        break
+                    channel, payload = frame
+                    data = json.loads(payload.decode())
+                    if channel == 0:
+                        continue # dashboard_ready など
+                    status = data.get("status")
+                    if status == "subscribed":
+                        self.post(channel, "subscribed", data)
+                    elif status == "channel_closed":
+                        self.post(channel, "closed", True)
+                    elif "board" in data:
+                        self.post(channel, "state", data)
+            except ConnectionError as e:
+                self.post(0, "status", {"message": f"接続できません: {e}"})
+                return
+            except (OSError, ValueError, net_io.FrameError) as e:
+                print(f"Dashboard connection error: {e}")
+            finally:
+                if self.conn:
+                    self.conn.close()
+            if self.running:
+                self.post(0, "reset", True)
+
+    def post(self, channel, kind, data):
+        # 受信スレッドから呼ぶ。描画はフレームごとに flush でまとめて行う
+        with self.pending_lock:
+            if kind == "reset": # 前の接続のチャンネル番号は新しい接続で使い回されるので、未描画の分は捨てる
+                self.pending.clear()
+            entry = self.pending.get(channel)
+            if entry is None:
+                entry = self.pending[channel] = {}
+            entry[kind] = data # まだ描画していない盤面は最新のもので置き換える
+            if kind == "state":
+                self.updates += 1
+            if self.frame_scheduled:
+                return
+            self.frame_scheduled = True
+        delay = max(0.0, self.last_frame + FRAME_INTERVAL - time.monotonic())
+        self.root.after(int(delay * 1000), self.flush)
+
+    def flush(self):
+        # Tk のメインループで1フレームに1回だけ呼ばれる。全チャンネル分の変更をここで反映するので、
+        # 再描画は届いた盤面の数によらず1回で済む
+        with self.pending_lock:
+            pending, self.pending = self.pending, {}
+            self.frame_scheduled = False
+        self.last_frame = time.monotonic()
+        self.frames += 1
+        control = pending.pop(0, {})
+        if "reset" in control: # 再接続した。チャンネル番号は接続ごとに振り直される
+            for tile in list(self.tile_by_channel.values()):
+                tile.finish()
+            self.tile_by_channel.clear()
+        # 終わった対局の枠を先に空けてから、新しく割り当てられた対局を置く
+        for channel, entry in sorted(pending.items(), key=lambda item: "subscribed" in item[1]):
+            tile = self.tile_by_channel.get(channel)
+            if "subscribed" in entry:
+                tile = self.free_tile()
+                if tile is None:
+                    continue
+                tile.assign(channel, entry["subscribed"])
+                self.tile_by_channel[channel] = tile
+            if tile is None:
+                continue
+            if "state" in entry:
+                tile.render(entry["state"])
+            if "closed" in entry:
+                tile.finish()
+                del self.tile_by_channel[channel]
+        if "status" in control:
+            self.status_text = control["status"]["message"]
+        self.status_label.config(text=f"{self.status_text}  観戦中 {len(self.tile_by_channel)} 局 / 受信 {self.updates} 盤面 / 描画 {self.frames} フレーム")
+
+    def free_tile(self):
+        # 未使用の枠を優先し、なければ最も前に終わった対局の枠を使う
+        free = [tile for tile in self.tiles if tile.channel is None]
+        if not free:
+            return None
+        return min(free, key=lambda tile: tile.finished_at)
+
+    def on_close(self):
+        self.running = False
+        if self.conn:
+            try: self.conn.close()
+            except OSError: pass
+        self.root.destroy()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Watch many Othello games in one window")
+    parser.add_argument("-s", "--server", default="127.0.0.1", help="Server IP address")
+    parser.add_argument("-p", "--port", type=int, default=PORT, help="Server port")
+    parser.add_argument("--boards", type=int, default=DEFAULT_BOARDS, help="Number of games to show (server caps this at 64)")
+    parser.add_argument("--columns", type=int, default=None, help="Boards per row (default: square layout)")
+    parser.add_argument("--cell-size", type=int, default=CELL_SIZE, help="Size of one square in pixels")
+    args = parser.parse_args()
+
+    root = tk.Tk()
+    gui = DashboardGUI(root, args.server, args.port, args.boards, args.columns, args.cell_size)
+    root.protocol("WM_DELETE_WINDOW", gui.on_close)
+    try:
+        root.mainloop()
+    except KeyboardInterrupt:
+        gui.on_close()
@@ -0,0 +1,142 @@
+
+import pytest
+
+import game_record
+import othello_rules
+from async_log import ERROR, WARNING
+
+
+def sample_moves(count, pick=0):
+    # 初期局面から合法手を選んで count 手進めた [(row, col, color)]
+    board = [[None] * 8 for _ in range(8)]
+    board[3][3] = board[4][4] = "white"
+    board[3][4] = board[4][3] = "black"
+    color, moves = "black", []
+    while len(moves) < count:
+        opponent = "white" if color == "black" else "black"
+        legal = list(othello_rules.squares(othello_rules.legal_mask(board, color)))
+        if not legal: # パス
+            color = opponent
+            continue
+        square = legal[pick % len(legal)] if len(moves) >= 2 else legal[0]
+        othello_rules.place_and_flip(board, square // 8, square % 8, color)
+        moves.append((square // 8, square % 8, color))
+        color = opponent
+    return moves
+
+
+def record_game(log, moves, players=None):
+    session_id = log.new_session_id()
+    log.record_start(session_id, players or {"black": "alice", "white": None})
+    for ply, (row, col, color) in enumerate(moves, start=1):
+        log.record_move(session_id, ply, row, col, color)
+    log.record_end(session_id, len(moves), game_record.RESULT_BLACK)
+    return session_id
+
+
+def as_records(moves):
+    return [(ply, game_record.square_of(row, col), color) for ply, (row, col, color) in enumerate(moves, start=1)]
+
+
+def test_write_and_replay(tmp_path):
+    moves = sample_moves(10)
+    log = game_record.GameRecordLog(str(tmp_path))
+    session_id = record_game(log, moves)
+    log.close()
+    meta, recorded, end = game_record.load_game_records(str(tmp_path), session_id)
+    assert meta["players"] == {"black": "alice", "white": None}
+    assert recorded == as_records(moves)
+    assert end == {"plies": 10, "result": game_record.RESULT_BLACK, "forced": False}
+    game, _, _ = game_record.replay_game(str(tmp_path), session_id)
+    assert sum(cell is not None for row in game.board for cell in row) == 4 + len(moves)
+
+
+def test_segments_rotate_and_games_span_them(tmp_path):
+    log = game_record.GameRecordLog(str(tmp_path), segment_bytes=64, commit_interval=0.001)
+    moves = sample_moves(20)
+    session_id = log.new_session_id()
+    log.record_start(session_id, {"black": "a", "white": "b"})
+    for ply, (row, col, color) in enumerate(moves, start=1):
+        log.record_move(session_id, ply, row, col, color)
+        log._commit() # 1手ずつ書き出してセグメントを切り替えさせる
+    log.record_end(session_id, len(moves), game_record.RESULT_DRAW)
+    log.close()
+    assert len(game_record.segment_paths(str(tmp_path))) > 1
+    assert game_record.load_game_records(str(tmp_path), session_id)[1] == as_records(moves)
+
+
+def test_reopen_starts_new_segment_and_keeps_session_ids_unique(tmp_path):
+    log = game_record.GameRecordLog(str(tmp_path))
+    first = record_game(log, sample_moves(4))
+    log.close()
+    log = game_record.GameRecordLog(str(tmp_path))
+    second = record_game(log, sample_moves(4))
+    log.close()
+    assert second > first
+    assert len(game_record.segment_paths(str(tmp_path))) == 2
+
+
+def test_restart_marker_supersedes_plies_after_the_checkpoint(tmp_path):
+    before, after = sample_moves(6, pick=0), sample_moves(6, pick=-1)
+    assert before[:2] == after[:2] and before[2:] != after[2:]
+    log = game_record.GameRecordLog(str(tmp_path))
+    session_id = log.new_session_id()
+    log.record_start(session_id, {"black": "a", "white": "b"})
+    for ply, move in enumerate(before[:5], start=1): # チェックポイント (2手目) の後、クラッシュ前に書かれた手を含む
+        log.record_move(session_id, ply, *move)
+    log.record_restart(session_id, 2)
+    for ply, move in enumerate(after[2:], start=3):
+        log.record_move(session_id, ply, *move)
+    log.record_end(session_id, 6, game_record.RESULT_WHITE)
+    log.close()
+    _, recorded, end = game_record.load_game_records(str(tmp_path), session_id)
+    assert recorded == as_records(after)
+    assert end["plies"] == 6
+    game_record.replay_game(str(tmp_path), session_id)
+
+
+def test_failed_commit_is_retried_without_losing_records(tmp_path):
+    reports = []
+    log = game_record.GameRecordLog(str(tmp_path), commit_interval=3600, log=lambda message, level: reports.append(level))
+    real_file = log._file
+    fail = {"count": 1}
+
+    class FailingFile:
+        name = real_file.name
+
+        def write(self, data):
+            if fail["count"]:
+                fail["count"] -= 1
+                real_file.write(data[:5]) # 途中まで書けてから失敗する
+                real_file.flush()
+                raise OSError(28, "No space left on device")
+            return real_file.write(data)
+
+        def __getattr__(self, name):
+            return getattr(real_file, name)
+
+    log._file = FailingFile()
+    moves = sample_moves(8)
+    session_id = record_game(log, moves)
+    log._commit()
+    assert reports == [ERROR]
+    log._commit()
+    assert reports == [ERROR, WARNING] # 復旧も報告する
+    log.close()
+    assert game_record.load_game_records(str(tmp_path), session_id)[1] == as_records(moves)
+
+
+def test_records_after_close_are_written(tmp_path):
+    log = game_record.GameRecordLog(str(tmp_path))
+    session_id = log.new_session_id()
+    log.record_start(session_id, {"black": None, "white": None})
+    log.close()
+    log.record_end(session_id, 0, game_record.RESULT_ABORTED, forced=True)
+    assert game_record.load_game_records(str(tmp_path), session_id)[2]["forced"]
+
+
+def test_oversized_metadata_is_rejected(tmp_path):
+    log = game_record.GameRecordLog(str(tmp_path))
+    with pytest.raises(ValueError):
+        log.record_start(log.new_session_id(), {"black": "x" * 70000, "white": None})
+    log.close()
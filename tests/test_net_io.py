@@ -0,0 +1,79 @@
+import socket
+import threading
+
+import pytest
+
+import net_io
+
+
+def read_all(sock, count):
+    reader = net_io.FrameReader(sock)
+    return [reader.read_frame() for _ in range(count)]
+
+
+def test_frames_round_trip_with_channels():
+    a, b = socket.socketpair()
+    with a, b:
+        conn = net_io.FramedConnection(a)
+        conn.send(b"hello")
+        conn.send(b"", channel=3)
+        conn.send_frames([net_io.make_frame(b"x" * 70000, 7), net_io.make_frame(b"last", 1)])
+        assert read_all(b, 4) == [(0, b"hello"), (3, b""), (7, b"x" * 70000), (1, b"last")]
+
+
+def test_reader_handles_frames_split_across_reads():
+    a, b = socket.socketpair()
+    with a, b:
+        header, payload = net_io.make_frame(b"split payload", 2)
+        data = bytes(header) + bytes(payload)
+        for i in range(len(data)): # 1バイトずつ届いても1フレームとして読める
+            a.sendall(data[i:i + 1])
+        assert net_io.FrameReader(b).read_frame() == (2, b"split payload")
+
+
+def test_reader_returns_none_on_close_and_rejects_oversized_frames():
+    a, b = socket.socketpair()
+    with b:
+        a.close()
+        assert net_io.FrameReader(b).read_frame() is None
+    a, b = socket.socketpair()
+    with a, b:
+        a.sendall(net_io.FRAME_HEADER.pack(net_io.MAX_FRAME_SIZE + 1, 0))
+        with pytest.raises(net_io.FrameError):
+            net_io.FrameReader(b).read_frame()
+
+
+def test_peer_writer_sends_large_batches_in_order():
+    a, b = socket.socketpair()
+    with a, b:
+        writer = net_io.PeerWriter(a)
+        frames = [net_io.make_frame(bytes([i % 256]) * 1000, i) for i in range(net_io.MAX_IOV)]
+        result = []
+        reader = threading.Thread(target=lambda: result.extend(read_all(b, len(frames))))
+        reader.start()
+        writer.send_frames(frames) # バッファ数が MAX_IOV を超え、途中までしか送れない場合も続きから送る
+        reader.join(5)
+        assert result == [(i, bytes([i % 256]) * 1000) for i in range(len(frames))]
+
+
+def test_queued_writer_drains_before_close():
+    a, b = socket.socketpair()
+    with b:
+        conn = net_io.FramedConnection(a, max_queued_bytes=net_io.MAX_QUEUED_BYTES)
+        for i in range(50):
+            conn.send(b"state %d" % i)
+        conn.close() # 呼び出し側は待たない。送信スレッドが送り切ってから閉じる
+        reader = net_io.FrameReader(b)
+        assert [reader.read_frame() for _ in range(50)] == [(0, b"state %d" % i) for i in range(50)]
+        assert reader.read_frame() is None
+
+
+def test_queued_writer_disconnects_a_peer_that_does_not_read():
+    a, b = socket.socketpair()
+    with a, b:
+        writer = net_io.QueuedPeerWriter(a, max_queued=4096)
+        with pytest.raises(net_io.SendQueueFull):
+            for _ in range(10000):
+                writer.send_frames([net_io.make_frame(b"x" * 1024)])
+        with pytest.raises(OSError): # 以降の送信も失敗する
+            writer.send_frames([net_io.make_frame(b"y")])
@@ -0,0 +1,82 @@
+import json
+import time
+
+import pytest
+
+import rate_limit
+import serverv1
+
+serverv1.LOGGER.level = serverv1.ERROR
+
+
+class FakeConn:
+    def __init__(self, port):
+        self.port = port
+        self.sent = []
+        self.closed = False
+
+    def getpeername(self):
+        return ("127.0.0.1", self.port)
+
+    def send(self, payload):
+        self.sent.append(json.loads(payload))
+
+    def send_frame(self, frame):
+        self.send(bytes(frame[1]))
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def session():
+    black, white = FakeConn(1), FakeConn(2)
+    return serverv1.GameSession([black, white], ["black", "white"], [], start=False)
+
+
+def send_move(session, raw):
+    guard = rate_limit.RateLimiter().guard("127.0.0.1")
+    session._on_player_message(session.clients[0], 0, raw, guard, time.perf_counter())
+    return guard
+
+
+@pytest.mark.parametrize("raw", [
+    b"[1,2]",
+    b"3",
+    b'"move"',
+    b'{"turn":"black","x":"a","y":0}',
+    b'{"turn":"black","x":2.0,"y":3}',
+    b'{"turn":"black","x":[1],"y":3}',
+    b'{"turn":"black","x":true,"y":3}',
+    b'{"turn":"black","x":3}',
+    b'{"turn":"black","x":8,"y":3}',
+    b'{"turn":"black","x":-1,"y":3}',
+    b"not json",
+])
+def test_malformed_moves_are_penalized_and_ignored(session, raw):
+    board = [row[:] for row in session.game.board]
+    guard = send_move(session, raw) # 例外がセッションの外へ出ないこと
+    assert guard.strikes > 0
+    assert session.game.board == board and session.ply == 0
+    assert session.session_active and all(not c.closed for c in session.clients)
+
+
+def test_valid_move_after_malformed_input_is_played(session):
+    send_move(session, b'{"turn":"black","x":[1],"y":3}')
+    send_move(session, json.dumps({"turn": "black", "x": 3, "y": 2}).encode())
+    assert session.ply == 1
+    assert session.game.board[2][3] == "black"
+    assert session.clients[1].sent[-1]["turn"] == "white"
+
+
+def test_illegal_move_is_answered_with_the_current_state(session):
+    guard = send_move(session, json.dumps({"turn": "black", "x": 0, "y": 0}).encode())
+    assert guard.strikes > 0
+    assert session.clients[0].sent[-1]["case"] == "ERROR"
+
+
+def test_valid_coordinates():
+    assert serverv1.valid_coordinates(0, 7)
+    assert not serverv1.valid_coordinates(True, 0)
+    assert not serverv1.valid_coordinates(0, 8)
+    assert not serverv1.valid_coordinates(0.0, 1)
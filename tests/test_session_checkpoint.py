@@ -0,0 +1,41 @@
+import json
+
+import session_checkpoint
+from async_log import WARNING
+
+
+def test_board_masks_round_trip():
+    board = [[None] * 8 for _ in range(8)]
+    board[0][0] = board[3][4] = board[7][7] = "black"
+    board[0][7] = board[4][4] = "white"
+    black, white = session_checkpoint.board_to_masks(board)
+    assert black & white == 0
+    assert session_checkpoint.masks_to_board(black, white) == board
+
+
+def test_decode_move():
+    assert session_checkpoint.decode_move("Bf5") == (4, 5, "black")
+    assert session_checkpoint.decode_move("Wa8") == (7, 0, "white")
+
+
+def test_checkpoint_round_trip(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    sessions = [{"session_id": 1, "colors": ["black", "white"], "ply": 3, "moves": "Bf5Wf6Be6"}]
+    session_checkpoint.write_checkpoint(sessions, path)
+    assert session_checkpoint.load_checkpoint(path) == sessions
+    assert not (tmp_path / "checkpoint.json.tmp").exists()
+
+
+def test_missing_or_other_version_checkpoint_is_empty(tmp_path):
+    path = tmp_path / "checkpoint.json"
+    assert session_checkpoint.load_checkpoint(str(path)) == []
+    path.write_text(json.dumps({"version": session_checkpoint.CHECKPOINT_VERSION + 1, "sessions": [{}]}))
+    assert session_checkpoint.load_checkpoint(str(path)) == []
+
+
+def test_unreadable_checkpoint_is_reported_and_ignored(tmp_path):
+    path = tmp_path / "checkpoint.json"
+    path.write_text('{"version": 1, "sessions": [') # 書き込み途中で切れたファイル
+    reports = []
+    assert session_checkpoint.load_checkpoint(str(path), log=lambda message, level: reports.append(level)) == []
+    assert reports == [WARNING]
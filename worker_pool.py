@@ -0,0 +1,47 @@
+import os
+import queue
+import threading
+
+# セッションを処理するワーカースレッドの固定プール
+# セッションは生成時にどれか1つのワーカーに割り当てられ、そのセッション宛てのメッセージは
+# すべて同じワーカーが到着順に処理する (セッションの状態にロックが要らないのはこのため)。
+# GIL なしのビルド (3.13t) では、ワーカーの数だけ別々のセッションが並列に進む。
+# 1つの処理が待つと同じワーカーの全セッションが止まるので、処理の中でソケットの送信などを待たないこと
+# (サーバーの送信は net_io.QueuedPeerWriter が接続ごとのスレッドで行う)。
+
+
+def default_size():
+    return int(os.environ.get("OTHELLO_SESSION_WORKERS", 0)) or os.cpu_count() or 1
+
+
+class Worker:
+    def __init__(self, name):
+        self.inbox = queue.SimpleQueue() # (関数, 引数) のメッセージ
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, fn, *args):
+        self.inbox.put((fn, args))
+
+    def _run(self):
+        while True:
+            fn, args = self.inbox.get()
+            fn(*args) # 例外は fn 側で処理する (ここで止まると担当セッションがすべて止まる)
+
+
+class WorkerPool:
+    def __init__(self, size=None, name="session-worker"):
+        self.size = size or default_size()
+        self.name = name
+        self.workers = [] # 最初の assign でスレッドを起動する
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def assign(self):
+        # セッションを順番にワーカーへ割り当てる
+        with self._lock:
+            if not self.workers:
+                self.workers = [Worker(f"{self.name}-{i}") for i in range(self.size)]
+            worker = self.workers[self._next]
+            self._next = (self._next + 1) % self.size
+        return worker